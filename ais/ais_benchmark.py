@@ -0,0 +1,191 @@
+import json
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import ais_summary, ais_views
+from .ais_cache import invalidate, sync_ingest
+from .ais_synthetic import load_fulldata
+from .ais_tables import DERIVED_MODELS, ensure_tables
+from .ais_trips import register_trips
+from .ais_vessels import sync_vessels
+from .models import (Full_Data, Merchant_Trip, Merchant_Vessel, MerSreports, MerVesselImage, MSReportPatroltype,
+                     Trip_Details)
+
+# Tables the benchmark fills and empties, children first. Vessel images and special reports stay empty,
+# but merchant_vessel_view reads them so they have to exist.
+BENCHMARK_MODELS = ([MSReportPatroltype, MerSreports, MerVesselImage, Trip_Details, Merchant_Trip, Merchant_Vessel,
+                     Full_Data] + DERIVED_MODELS)
+
+# (name, view, query parameters) of every endpoint measured. '{date_from}'/'{date_to}' are the
+# generated range, '{ship_id}' the busiest vessel; views taking mv_key get the busiest vessel's key.
+ENDPOINTS = [
+    ('mv_trips_count', ais_views.trip_count, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('mv_trips', ais_views.vessel_trip_counts, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('stay_count', ais_views.stay_count, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('stay_count_stats', ais_views.stay_count, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                'stats': 'true'}),
+    ('ship_counts', ais_views.ship_counts, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('ship_counts_week', ais_views.ship_counts_week, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('flag_counts', ais_views.flag_counts, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('type_counts', ais_views.type_counts, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('vessel_position', ais_views.vessel_position, {}),
+    ('vessel_position_track', ais_views.vessel_position, {'ship_id': '{ship_id}'}),
+    ('merchant_vessel_tracks', ais_views.vessel_tracks, {}),
+    ('merchant_vessel_view', ais_summary.MerchantVesselDataView.as_view(), {}),
+    ('mer_duration_at_sea', ais_views.mer_trip_duration, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('mer_activity_trend', ais_views.mer_trip_count, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('mer_leave_enter', ais_views.mer_leave_enter, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                    'boat_location': 'KARACHI'}),
+    ('mer_mv_leave_enter', ais_views.mer_mv_leave_enter, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                          'boat_location': 'KARACHI'}),
+    ('mer_fv_con', ais_views.mer_fv_con, {'date_from': '{date_from}', 'date_to': '{date_to}'}),
+    ('mer_visual_act_trend', ais_views.mer_visual_act_trend, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                              'filter': 'harbor and type', 'group_by': 'week'}),
+    ('mer_visual_harbor', ais_views.mer_visual_harbour, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                         'filter': 'harbor and type', 'group_by': 'week'}),
+    ('mer_visual_flag_count', ais_views.mer_visual_flag_count, {'date_from': '{date_from}', 'date_to': '{date_to}',
+                                                                'filter': 'harbor and type', 'group_by': 'week'}),
+]
+MV_KEY_VIEWS = {'merchant_vessel_tracks', 'merchant_vessel_view'}
+
+
+def populated_tables():
+    """The benchmark tables that exist and hold rows, i.e. the data reset_tables would destroy."""
+    existing = set(connection.introspection.table_names())
+    return [model._meta.db_table for model in BENCHMARK_MODELS
+            if model._meta.db_table in existing and model.objects.exists()]
+
+
+def reset_tables():
+    """Create the benchmark tables where missing and empty them, restarting their id sequences."""
+    ensure_tables(BENCHMARK_MODELS)
+    tables = [model._meta.db_table for model in BENCHMARK_MODELS]
+    connection.ops.execute_sql_flush(
+        connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True))
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux; it only grows, so it is the high-water mark of the run so far
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(call, repeat=3):
+    """
+    Latency (best and median of ``repeat`` timed runs), query count and peak Python heap of ``call``.
+    The response cache is dropped before every run so each one computes its response. An untimed
+    first run keeps one-off work (imports, the ingest version key, a new connection's setup) out of the numbers.
+    """
+    invalidate()
+    call()
+    invalidate()
+    with CaptureQueriesContext(connection) as queries:
+        response = call()
+    if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+        response.render()
+    result = {'status': response.status_code, 'queries': len(queries), 'response_bytes': len(response.content)}
+
+    timings = []
+    for _ in range(repeat):
+        invalidate()
+        started = time.perf_counter()
+        response = call()
+        if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+            response.render()
+        timings.append((time.perf_counter() - started) * 1000)
+    result['best_ms'] = round(min(timings), 2)
+    result['median_ms'] = round(float(np.median(timings)), 2)
+
+    # Allocation tracing slows the call down, so memory gets its own run
+    invalidate()
+    tracemalloc.start()
+    try:
+        call()
+        result['peak_memory_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def refresh_derived():
+    """Build the derived tables, as the scheduled refresh_ais_derived command does."""
+    sync_ingest()
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def run_size(rows, days=90, repeat=3, endpoints=None, stdout=None, **generator_options):
+    """Load ``rows`` synthetic rows into emptied tables, build everything derived and time every endpoint."""
+    reset_tables()
+    (inserted, first, last), load_seconds = timed(load_fulldata, rows, days=days, **generator_options)
+    trips, trip_seconds = timed(register_trips)
+    _, vessel_seconds = timed(sync_vessels)
+    _, derived_seconds = timed(refresh_derived)
+
+    result = {
+        'rows': inserted,
+        'days': days,
+        'vessels': Merchant_Vessel.objects.count(),
+        'load_seconds': load_seconds,
+        'register_trips': {'seconds': trip_seconds, 'trips_created': trips['trips_created'],
+                           'rows_per_second': trips['rows_per_second']},
+        'sync_vessels_seconds': vessel_seconds,
+        'refresh_derived_seconds': derived_seconds,
+        'endpoints': {},
+    }
+
+    busiest = (Merchant_Trip.objects.values('mt_mv_key').annotate(trips=Count('mt_key'))
+               .order_by('-trips', 'mt_mv_key').first())
+    mv_key = busiest['mt_mv_key'] if busiest else 0
+    ship_id = Merchant_Vessel.objects.filter(mv_key=mv_key).values_list('mv_ship_id', flat=True).first()
+    local_first, local_last = timezone.localtime(first), timezone.localtime(last)
+    values = {
+        'date_from': local_first.strftime('%Y-%m-%d'),
+        'date_to': local_last.strftime('%Y-%m-%d'),
+        'ship_id': ship_id or '',
+    }
+
+    factory = RequestFactory()
+    for name, view, params in ENDPOINTS:
+        if endpoints and name not in endpoints:
+            continue
+        query = {key: value.format(**values) for key, value in params.items()}
+        kwargs = {'mv_key': mv_key} if name in MV_KEY_VIEWS else {}
+        try:
+            result['endpoints'][name] = {'params': query, **measure(
+                lambda: view(factory.get(f'/{name}', query), **kwargs), repeat)}
+        except Exception as error:
+            result['endpoints'][name] = {'params': query, 'error': f'{type(error).__name__}: {error}'}
+        if stdout:
+            stdout.write(f"{rows:>10} rows  {name:<24} {json.dumps(result['endpoints'][name])}")
+
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+def run_benchmark(sizes, output, days=90, repeat=3, endpoints=None, stdout=None, **generator_options):
+    """Run every size in turn and write the results to ``output`` as JSON. Returns the report."""
+    report = {
+        'started_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'repeat': repeat,
+        'sizes': [],
+    }
+    for rows in sizes:
+        report['sizes'].append(run_size(rows, days, repeat, endpoints, stdout, **generator_options))
+        # Written after every size so a long run still leaves the finished sizes behind
+        with open(output, 'w') as handle:
+            json.dump(report, handle, indent=2, default=str)
+    return report
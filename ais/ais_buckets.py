@@ -0,0 +1,99 @@
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from .ais_rollup import activity
+
+
+def bucket_periods(date_from, date_to, grouping):
+    """
+    (first day, last day) of every bucket of the range: single days for 'day', seven-day runs from
+    ``date_from`` for 'week', else calendar months. The last bucket is cut off at ``date_to``.
+    """
+    periods = []
+    current = date_from
+    while current <= date_to:
+        if grouping == 'day':
+            last = current
+        elif grouping == 'week':
+            last = min(current + timedelta(days=6), date_to)
+        else:
+            start_of_next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+            last = min(start_of_next_month - timedelta(days=1), date_to)
+        periods.append((current, last))
+        current = last + timedelta(days=1)
+    return periods
+
+
+def bucket_items(periods, grouping):
+    """The leading keys of every bucket's response item: its year and day, week or month."""
+    items = []
+    for first, last in periods:
+        if grouping == 'day':
+            items.append({'Year': first.year, 'Month': first.strftime('%B'), 'Date': first.day})
+        elif grouping == 'week':
+            items.append({'Year': first.year, 'Week_Start': first.strftime('%d-%m-%Y'),
+                          'Week_End': last.strftime('%d-%m-%Y')})
+        else:
+            items.append({'Year': first.year, 'Month': first.strftime('%B')})
+    return items
+
+
+def bucket_ids(days, periods):
+    """Index into ``periods`` of every day, for the whole array at once."""
+    starts = np.array([first for first, _ in periods], dtype='datetime64[D]')
+    return np.searchsorted(starts, np.asarray(days, dtype='datetime64[D]'), side='right') - 1
+
+
+def encode(values):
+    """Integer codes of ``values`` and the value of every code. None gets a code of its own."""
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = list(uniques) + [None]
+    return np.where(codes < 0, len(uniques) - 1, codes), uniques
+
+
+def fetch_activity(date_from, date_to, columns, filters=None):
+    """``columns`` of the daily rollup rows of the range as {column: array}, plus 'day', in one query."""
+    queryset = activity(date_from, date_to)
+    if filters:
+        queryset = queryset.filter(**filters)
+    fields = ['day', *columns]
+    rows = list(queryset.values_list(*fields).order_by())
+    values = list(zip(*rows)) if rows else [()] * len(fields)
+    return {field: np.array(column, dtype='datetime64[D]' if field == 'day' else object)
+            for field, column in zip(fields, values)}
+
+
+def count_distinct(rows, periods, dimensions=(), distinct=()):
+    """
+    Number of distinct ``distinct`` value combinations per bucket and combination of ``dimensions``,
+    in one grouped pass over ``rows`` (see fetch_activity): every column is encoded to integers, the
+    distinct (bucket, dimensions, distinct) rows are kept and counted per (bucket, dimensions).
+    Returns a Counter {dimension values: count} per bucket.
+    """
+    buckets = [Counter() for _ in periods]
+    if not len(rows['day']):
+        return buckets
+    codes, uniques = [bucket_ids(rows['day'], periods)], []
+    for column in (*dimensions, *distinct):
+        column_codes, column_uniques = encode(rows[column])
+        codes.append(column_codes)
+        uniques.append(column_uniques)
+
+    keys = np.unique(np.column_stack(codes), axis=0)
+    groups, counts = np.unique(keys[:, :1 + len(dimensions)], axis=0, return_counts=True)
+    for group, count in zip(groups.tolist(), counts.tolist()):
+        buckets[group[0]][tuple(uniques[index][code] for index, code in enumerate(group[1:]))] = count
+    return buckets
+
+
+def sum_by_bucket(counts, periods):
+    """Fold daily counts {(day, *dimension values): count} into a Counter {dimension values: count} per bucket."""
+    buckets = [Counter() for _ in periods]
+    if counts:
+        keys = list(counts)
+        for bucket, key in zip(bucket_ids([key[0] for key in keys], periods).tolist(), keys):
+            buckets[bucket][key[1:]] += counts[key]
+    return buckets
@@ -0,0 +1,199 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max, Min
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from .ais_port_calls import refresh_port_calls
+from .ais_positions import refresh_latest_positions
+from .ais_rollup import refresh_port_activity
+from .models import Full_Data
+
+CACHE_PREFIX = 'ais_response'
+GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+LAST_ID_KEY = f'{CACHE_PREFIX}:last_id'
+VERSION_KEY = f'{CACHE_PREFIX}:ingest_version'
+CHANGES_KEY = f'{CACHE_PREFIX}:ingest_changes'
+MAX_CHANGES = 1000  # ingest syncs remembered; responses cached before all of them count as stale
+
+# Views wrapped with cached_response, by name, for the hit/miss report
+CACHED_VIEWS = []
+
+
+def get_cache():
+    return caches[getattr(settings, 'AIS_CACHE_ALIAS', 'default')]
+
+
+def generation():
+    cache = get_cache()
+    cache.add(GENERATION_KEY, 1, timeout=None)
+    return cache.get(GENERATION_KEY, 1)
+
+
+def invalidate():
+    """Drop every cached response by moving to a new key generation."""
+    cache = get_cache()
+    cache.add(GENERATION_KEY, 1, timeout=None)
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, timeout=None)
+        return 2
+
+
+def ingest_version():
+    cache = get_cache()
+    cache.add(VERSION_KEY, 0, timeout=None)
+    return cache.get(VERSION_KEY, 0)
+
+
+def record_ingest(first_day):
+    """
+    Note an ingest whose rows touch ``first_day`` and later days (None when unknown, i.e. any day).
+    Returns the new ingest version.
+    """
+    cache = get_cache()
+    cache.add(VERSION_KEY, 0, timeout=None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        version = 1
+        cache.set(VERSION_KEY, version, timeout=None)
+    changes = (cache.get(CHANGES_KEY) or [])[-(MAX_CHANGES - 1):]
+    changes.append((version, first_day))
+    cache.set(CHANGES_KEY, changes, timeout=None)
+    return version
+
+
+def is_stale(version, end):
+    """
+    Whether an ingest after ``version`` touched a day on or before ``end``, the last day of the cached
+    range (None for an open range, which any ingest changes). Ranges that ended before the oldest new
+    row stay cached.
+    """
+    if version >= ingest_version():
+        return False
+    changes = get_cache().get(CHANGES_KEY) or []
+    if not changes or version < changes[0][0] - 1:
+        return True
+    return any(changed > version and (first_day is None or end is None or first_day <= end)
+               for changed, first_day in changes)
+
+
+def sync_ingest():
+    """
+    Bring the derived tables up to date with fulldata and expire the cached responses the new rows can
+    change. Runs from the refresh_ais_derived command on a schedule, never from a request.
+    """
+    cache = get_cache()
+    last_id = Full_Data.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    stats = {
+        'port_activity': refresh_port_activity(),
+        'port_calls': refresh_port_calls(),
+        'latest_positions': refresh_latest_positions(),
+        'last_id': last_id,
+        'first_day': None,
+        'ingest_version': None,
+    }
+
+    previous = cache.get(LAST_ID_KEY)
+    if last_id != previous:
+        first = None
+        if previous is not None and last_id > previous:
+            first = (Full_Data.objects.filter(id__gt=previous, id__lte=last_id)
+                     .aggregate(first=Min('timestamp'))['first'])
+        if first is not None:
+            stats['first_day'] = timezone.localtime(first).date() if timezone.is_aware(first) else first.date()
+        stats['ingest_version'] = record_ingest(stats['first_day'])
+        cache.set(LAST_ID_KEY, last_id, timeout=None)
+    return stats
+
+
+def cache_key(name, params):
+    """Key of a response: view name, generation and the query parameters with blanks dropped, sorted."""
+    normalized = sorted((key, value.strip()) for key in params for value in params.getlist(key) if value.strip())
+    digest = hashlib.sha1(repr(normalized).encode()).hexdigest()
+    return f'{CACHE_PREFIX}:{generation()}:{name}:{digest}'
+
+
+def range_end(params):
+    """The last day of the requested range, None when it is open or unreadable."""
+    date_to = params.get('date_to')
+    try:
+        return datetime.strptime(date_to.strip(), '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        return None
+
+
+def response_timeout(params):
+    """Long TTL when the requested range ended before today, short when it reaches today or is open."""
+    end = range_end(params)
+    if end is not None and end < timezone.localdate():
+        return getattr(settings, 'AIS_CACHE_HISTORICAL_TTL', 24 * 60 * 60)
+    return getattr(settings, 'AIS_CACHE_RECENT_TTL', 60)
+
+
+def count(name, outcome):
+    cache = get_cache()
+    key = f'{CACHE_PREFIX}:stats:{name}:{outcome}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def cached_response(view):
+    """
+    Serve repeated GETs of an analytics view from Django's cache. Goes below @api_view so the
+    request is already parsed. Only successful responses are stored, with the ingest version they were
+    computed at, so an ingest only expires the ranges it touched (see is_stale).
+    """
+    name = view.__name__
+    CACHED_VIEWS.append(name)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        cache = get_cache()
+        key = cache_key(name, request.GET)
+
+        cached = cache.get(key)
+        if cached is not None and not is_stale(cached[2], range_end(request.GET)):
+            count(name, 'hits')
+            content, content_type, _ = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        count(name, 'misses')
+        # Read before computing, so rows ingested meanwhile expire the response
+        version = ingest_version()
+        response = view(request, *args, **kwargs)
+        if isinstance(response, JsonResponse) and response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type'], version), response_timeout(request.GET))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    cache = get_cache()
+    views = {}
+    for name in CACHED_VIEWS:
+        hits = cache.get(f'{CACHE_PREFIX}:stats:{name}:hits', 0)
+        misses = cache.get(f'{CACHE_PREFIX}:stats:{name}:misses', 0)
+        views[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return JsonResponse({'generation': generation(), 'ingest_version': ingest_version(), 'views': views})
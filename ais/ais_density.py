@@ -0,0 +1,138 @@
+import numpy as np
+from django.db.models import Max
+from django.utils.dateparse import parse_date
+
+from .ais_cache import CACHE_PREFIX, generation, get_cache, ingest_version, is_stale, range_end, response_timeout
+from .ais_rollup import day_start, timestamp_range
+from .models import Full_Data
+
+DEFAULT_RESOLUTION = 0.1  # degrees, the grid mer_fv_con always used
+# Grid resolution in degrees of every precomputed zoom level, halving per level
+ZOOM_RESOLUTIONS = {zoom: DEFAULT_RESOLUTION * 2 ** (7 - zoom) for zoom in range(2, 11)}
+TILE_CELLS = 256  # cells per tile side
+MAX_DENSE_CELLS = 4_000_000  # larger grids are counted sparsely instead of with a dense histogram
+
+
+def latest_coordinates_by_imo(date_from=None, date_to=None):
+    """Latitude and longitude arrays of the latest report of every IMO in the range, in one query."""
+    data_query = Full_Data.objects.all()
+    if date_from and date_to:
+        # Up to the start of date_to, as the range has always been read
+        data_query = data_query.filter(timestamp_range(day_start(parse_date(date_from)),
+                                                       day_start(parse_date(date_to))))
+    latest_ids = data_query.values('imo').annotate(max_id=Max('id')).values('max_id')
+    coordinates = np.array(
+        Full_Data.objects.filter(id__in=latest_ids, latitude__isnull=False, longitude__isnull=False)
+        .values_list('latitude', 'longitude'),
+        dtype=np.float64
+    ).reshape(-1, 2)
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def cell_index(values, resolution):
+    # Cells are centred on multiples of the resolution, like round(value / resolution) * resolution
+    return np.floor(values / resolution + 0.5).astype(np.int64)
+
+
+def density_grid(latitudes, longitudes, resolution=DEFAULT_RESOLUTION):
+    """
+    Count the points per grid cell with a 2-D histogram. Returns an (n, 3) array of
+    [latitude index, longitude index, count] for the non-empty cells; a cell's centre is index * resolution.
+    """
+    if not len(latitudes):
+        return np.empty((0, 3), dtype=np.int64)
+    lat_cells = cell_index(latitudes, resolution)
+    lon_cells = cell_index(longitudes, resolution)
+    shape = (lat_cells.max() - lat_cells.min() + 1, lon_cells.max() - lon_cells.min() + 1)
+    if shape[0] * shape[1] > MAX_DENSE_CELLS:
+        cells, counts = np.unique(np.column_stack([lat_cells, lon_cells]), axis=0, return_counts=True)
+        return np.column_stack([cells, counts])
+
+    lat_edges = np.arange(lat_cells.min(), lat_cells.max() + 2) - 0.5
+    lon_edges = np.arange(lon_cells.min(), lon_cells.max() + 2) - 0.5
+    counts, _, _ = np.histogram2d(lat_cells, lon_cells, bins=[lat_edges, lon_edges])
+
+    lat_offsets, lon_offsets = np.nonzero(counts)
+    return np.column_stack([lat_offsets + lat_cells.min(), lon_offsets + lon_cells.min(),
+                            counts[lat_offsets, lon_offsets].astype(np.int64)])
+
+
+def tile_grid(cells):
+    """Split grid cells into TILE_CELLS x TILE_CELLS tiles, keyed by (tile row, tile column)."""
+    tiles = {}
+    if not len(cells):
+        return tiles
+    keys = cells[:, :2] // TILE_CELLS
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    keys, cells = keys[order], cells[order]
+    boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(cells)]):
+        tiles[tuple(keys[start].tolist())] = cells[start:end]
+    return tiles
+
+
+class DensityPyramid:
+    """
+    Latest positions of a date range with their density grid precomputed at every zoom level and cut
+    into tiles, so panning only selects tiles and zooming only switches level.
+    """
+
+    def __init__(self, latitudes, longitudes):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.levels = {zoom: tile_grid(density_grid(latitudes, longitudes, resolution))
+                       for zoom, resolution in ZOOM_RESOLUTIONS.items()}
+
+    def cells(self, resolution=DEFAULT_RESOLUTION, zoom=None, bbox=None):
+        """
+        Non-empty cells at a zoom level or at any resolution in degrees, optionally clipped to
+        bbox = (min_lon, min_lat, max_lon, max_lat). Returns (cells, resolution).
+        """
+        if zoom is None:
+            zoom = next((level for level, value in ZOOM_RESOLUTIONS.items() if np.isclose(value, resolution)), None)
+        else:
+            zoom = min(max(zoom, min(ZOOM_RESOLUTIONS)), max(ZOOM_RESOLUTIONS))
+            resolution = ZOOM_RESOLUTIONS[zoom]
+
+        if zoom is None:
+            # Resolution off the pyramid: bin the cached positions directly
+            latitudes, longitudes = self.latitudes, self.longitudes
+            if bbox:
+                min_lon, min_lat, max_lon, max_lat = bbox
+                inside = ((latitudes >= min_lat) & (latitudes <= max_lat)
+                          & (longitudes >= min_lon) & (longitudes <= max_lon))
+                latitudes, longitudes = latitudes[inside], longitudes[inside]
+            return density_grid(latitudes, longitudes, resolution), resolution
+
+        tiles = self.levels[zoom]
+        if not bbox:
+            cells = list(tiles.values())
+        else:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            lat_range = cell_index(np.array([min_lat, max_lat]), resolution)
+            lon_range = cell_index(np.array([min_lon, max_lon]), resolution)
+            tile_rows = range(lat_range[0] // TILE_CELLS, lat_range[1] // TILE_CELLS + 1)
+            tile_columns = range(lon_range[0] // TILE_CELLS, lon_range[1] // TILE_CELLS + 1)
+            cells = [tiles[key] for key in tiles if key[0] in tile_rows and key[1] in tile_columns]
+            cells = [tile[(tile[:, 0] >= lat_range[0]) & (tile[:, 0] <= lat_range[1])
+                          & (tile[:, 1] >= lon_range[0]) & (tile[:, 1] <= lon_range[1])] for tile in cells]
+        if not cells:
+            return np.empty((0, 3), dtype=np.int64), resolution
+        return np.concatenate(cells), resolution
+
+
+def get_pyramid(date_from=None, date_to=None):
+    """
+    Density pyramid of the range, built once and shared through the cache until an ingest touches the
+    range (see ais_cache.is_stale).
+    """
+    cache = get_cache()
+    key = f'{CACHE_PREFIX}:{generation()}:density:{date_from}:{date_to}'
+    params = {'date_to': date_to}
+    cached = cache.get(key)
+    if cached is not None and not is_stale(cached[1], range_end(params)):
+        return cached[0]
+    version = ingest_version()
+    pyramid = DensityPyramid(*latest_coordinates_by_imo(date_from, date_to))
+    cache.set(key, (pyramid, version), response_timeout(params))
+    return pyramid
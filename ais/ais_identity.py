@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import VesselIdentity
+
+
+def canonical_identity(imo, mmsi):
+    """
+    The string a vessel is identified by: its MMSI when it reports imo '0' (no IMO number), else its
+    IMO. None when the row carries no usable identifier.
+    """
+    return (mmsi if imo == '0' else imo) or None
+
+
+class VesselKeyResolver:
+    """
+    Maps canonical identities to their VesselIdentity key, creating keys for new identities in bulk
+    (callers make sure the table exists, see ais_tables).
+    Resolved keys are kept in a bounded LRU cache, so steady-state lookups cost no query. Keys
+    created inside a transaction are only cached once it commits, so a rollback cannot leave the
+    cache pointing at keys that were never stored.
+    """
+
+    chunk_size = 5000
+
+    def __init__(self, size=None):
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def max_size(self):
+        return self.size or getattr(settings, 'AIS_IDENTITY_CACHE_SIZE', 100000)
+
+    def remember(self, keys):
+        with self.lock:
+            self.cache.update(keys)
+            for identity in keys:
+                self.cache.move_to_end(identity)
+            while len(self.cache) > self.max_size():
+                self.cache.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def resolve(self, identities):
+        """Key of every identity in ``identities`` (a dict identity -> (imo, mmsi) as first seen)."""
+        keys = {}
+        with self.lock:
+            for identity in identities:
+                if identity in self.cache:
+                    self.cache.move_to_end(identity)
+                    keys[identity] = self.cache[identity]
+
+        missing = [identity for identity in identities if identity not in keys]
+        if missing:
+            found = {}
+            for start in range(0, len(missing), self.chunk_size):
+                chunk = missing[start:start + self.chunk_size]
+                found.update(VesselIdentity.objects.filter(identity__in=chunk).values_list('identity', 'vessel_key'))
+                new = [identity for identity in chunk if identity not in found]
+                if new:
+                    # ignore_conflicts lets concurrent resolvers race on a new identity; the keys are read back
+                    VesselIdentity.objects.bulk_create(
+                        [VesselIdentity(identity=identity, imo=identities[identity][0], mmsi=identities[identity][1])
+                         for identity in new],
+                        ignore_conflicts=True)
+                    found.update(VesselIdentity.objects.filter(identity__in=new).values_list('identity', 'vessel_key'))
+            keys.update(found)
+            transaction.on_commit(lambda: self.remember(found))
+        return keys
+
+    def keys(self, pairs):
+        """Vessel key of every (imo, mmsi) pair, None where the pair has no identity."""
+        identities = {}
+        row_identities = []
+        for imo, mmsi in pairs:
+            identity = canonical_identity(imo, mmsi)
+            row_identities.append(identity)
+            if identity is not None:
+                identities.setdefault(identity, (imo, mmsi))
+        keys = self.resolve(identities)
+        return [keys.get(identity) for identity in row_identities]
+
+    def key(self, imo, mmsi):
+        return self.keys([(imo, mmsi)])[0]
+
+
+resolver = VesselKeyResolver()
+
+
+def vessel_keys(records):
+    """Vessel key of every fulldata record (dicts with 'imo' and 'mmsi')."""
+    return resolver.keys((record['imo'], record['mmsi']) for record in records)
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from rest_framework.exceptions import ParseError
+
+
+def number_param(params, name, kind, default=None, minimum=None, maximum=None):
+    """
+    Query parameter ``name`` converted with ``kind`` (int or float), ``default`` when it is missing or
+    empty. A value that does not convert or falls outside [minimum, maximum] raises ParseError, which
+    @api_view and APIView answer with a 400 instead of the 500 of a bare int() or float().
+    """
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ParseError(f"{name} must be {'an integer' if kind is int else 'a number'}, not '{value}'.")
+    if minimum is not None and number < minimum or maximum is not None and number > maximum:
+        bounds = f'at least {minimum}' if maximum is None else (
+            f'at most {maximum}' if minimum is None else f'between {minimum} and {maximum}')
+        raise ParseError(f'{name} must be {bounds}.')
+    return number
+
+
+def int_param(params, name, default=None, minimum=None, maximum=None):
+    return number_param(params, name, int, default, minimum, maximum)
+
+
+def float_param(params, name, default=None, minimum=None, maximum=None):
+    return number_param(params, name, float, default, minimum, maximum)
+
+
+def float_list_param(params, name, length):
+    """Comma separated list of ``length`` numbers (e.g. a bbox), None when missing; ParseError otherwise."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        numbers = [float(item) for item in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != length:
+        raise ParseError(f"{name} must be {length} comma separated numbers, not '{value}'.")
+    return numbers
+
+
+def int_list_param(params, name):
+    """Comma separated list of integers (e.g. ids), None when missing; ParseError otherwise."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return [int(item) for item in value.split(',')]
+    except ValueError:
+        raise ParseError(f"{name} must be comma separated integers, not '{value}'.")
+
+
+def date_param(params, name):
+    """Query parameter ``name`` as a YYYY-MM-DD date, None when missing; ParseError otherwise."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ParseError(f"{name} must be a YYYY-MM-DD date, not '{value}'.")
+
+
+def choice_param(params, name, choices, default):
+    """Query parameter ``name``, which must be one of ``choices``; ``default`` when missing."""
+    value = params.get(name) or default
+    if value not in choices:
+        raise ParseError(f"{name} must be one of {', '.join(choices)}, not '{value}'.")
+    return value
@@ -0,0 +1,340 @@
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .ais_rollup import day_start
+from .models import Full_Data, Trip_Details
+
+# Unmanaged tables kept as monthly range partitions: model -> field the rows are partitioned on
+PARTITIONED_MODELS = {
+    Full_Data: 'timestamp',
+    Trip_Details: 'mtd_timestamp',
+}
+MIGRATION_SUFFIX = '_partitioned'  # the partitioned copy being filled, until it replaces the original
+ORIGINAL_SUFFIX = '_unpartitioned'  # the original table once replaced, kept until it is dropped by hand
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def literal(moment):
+    return f"'{moment.isoformat()}'"
+
+
+def literal_name(name):
+    return f"'{quote(name)}'"
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def months_between(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def default_partition(table):
+    return f'{table}_default'
+
+
+def partition_key(model):
+    return model._meta.get_field(PARTITIONED_MODELS[model]).column
+
+
+def month_bounds(month):
+    """Start and end of a calendar month in the local timezone, the bounds of its partition."""
+    return day_start(month), day_start(add_months(month, 1))
+
+
+def require_postgres():
+    if connection.vendor != 'postgresql':
+        raise ValueError(f'Declarative partitioning needs PostgreSQL, not {connection.vendor}.')
+
+
+def table_kind(table):
+    """'p' for a partitioned table, 'r' for a plain one, None when the table does not exist."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [quote(table)])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def partitions(table, prefix=None):
+    """{month: partition name} of the monthly partitions attached to ``table`` (named ``<prefix>_pYYYY_MM``)."""
+    prefix = prefix or table
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = inhrelid '
+                       'WHERE inhparent = to_regclass(%s)', [quote(table)])
+        names = [name for name, in cursor.fetchall()]
+    months = {}
+    for name in names:
+        suffix = name[len(prefix) + 2:]
+        if name.startswith(f'{prefix}_p') and len(suffix) == 7 and suffix[4] == '_':
+            months[date(int(suffix[:4]), int(suffix[5:]), 1)] = name
+    return months
+
+
+def has_rows(table, condition):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {quote(table)} WHERE {condition})')
+        return cursor.fetchone()[0]
+
+
+def run(statements, dry_run=False, stdout=None):
+    """Execute ``statements`` in one transaction, or only print them when ``dry_run``."""
+    if stdout:
+        for sql in statements:
+            stdout.write(f'{sql};')
+    if dry_run or not statements:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def run_concurrently(sql, dry_run=False, stdout=None):
+    """Execute one CONCURRENTLY statement, which Postgres refuses inside a transaction block."""
+    if stdout:
+        stdout.write(f'{sql};')
+    if dry_run:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+def range_condition(key, month):
+    start, end = month_bounds(month)
+    return f'{quote(key)} >= {literal(start)} AND {quote(key)} < {literal(end)}'
+
+
+def partition_statements(model, month, table=None, check_default=True):
+    """
+    Statements creating the partition of ``month``. Rows of that month already in the default partition
+    would make the creation fail, so they are moved into the new partition while the default is detached.
+    """
+    table = table or model._meta.db_table
+    name = partition_name(model._meta.db_table, month)
+    start, end = month_bounds(month)
+    create = (f'CREATE TABLE {quote(name)} PARTITION OF {quote(table)} '
+              f'FOR VALUES FROM ({literal(start)}) TO ({literal(end)})')
+    default = default_partition(model._meta.db_table)
+    condition = range_condition(partition_key(model), month)
+    if not check_default or table_kind(default) is None or not has_rows(default, condition):
+        return [create]
+    return [
+        f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(default)}',
+        create,
+        f'INSERT INTO {quote(name)} SELECT * FROM {quote(default)} WHERE {condition}',
+        f'DELETE FROM {quote(default)} WHERE {condition}',
+        f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(default)} DEFAULT',
+    ]
+
+
+def index_columns(model, index):
+    return ', '.join(quote(model._meta.get_field(field).column) for field in index.fields)
+
+
+def index_statements(model, table):
+    """
+    The partitioned table's indexes: the primary key's column with the partition key (Postgres only
+    allows unique indexes that contain it) and the model's composite indexes, cascaded to every partition.
+    """
+    pk, key = model._meta.pk.column, partition_key(model)
+    db_table = model._meta.db_table
+    statements = [f'CREATE UNIQUE INDEX IF NOT EXISTS {quote(f"{db_table}_{pk}_{key}_uniq")} '
+                  f'ON {quote(table)} ({quote(pk)}, {quote(key)})']
+    for index in model._meta.indexes:
+        statements.append(f'CREATE INDEX IF NOT EXISTS {quote(index.name)} ON {quote(table)} '
+                          f'({index_columns(model, index)})')
+    return statements
+
+
+def index_names(table):
+    """{index name: valid} of the indexes on ``table``; a failed concurrent build leaves an invalid one."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT idx.relname, indisvalid FROM pg_index JOIN pg_class idx ON idx.oid = indexrelid '
+                       'WHERE indrelid = to_regclass(%s)', [quote(table)])
+        return dict(cursor.fetchall())
+
+
+def ensure_indexes(models=None, dry_run=False, stdout=None):
+    """
+    Create the model's composite indexes that are missing on the tables, so they exist without --migrate.
+    Plain tables are indexed concurrently, one statement at a time outside a transaction, so the ingest
+    is not blocked while they build; invalid leftovers of an interrupted build are dropped first.
+    Partitioned tables already got them with the migration; any missing one is cascaded to the partitions.
+    Returns the names of the indexes created.
+    """
+    require_postgres()
+    created = []
+    for model in models or PARTITIONED_MODELS:
+        table = model._meta.db_table
+        kind = table_kind(table)
+        if kind is None:
+            continue
+        existing = index_names(table)
+        missing = [index for index in model._meta.indexes if not existing.get(index.name)]
+        if not missing:
+            continue
+        if kind == 'p':
+            run(index_statements(model, table), dry_run, stdout)
+        else:
+            for index in missing:
+                statements = [f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(index.name)} '
+                              f'ON {quote(table)} ({index_columns(model, index)})']
+                if index.name in existing:
+                    statements.insert(0, f'DROP INDEX CONCURRENTLY IF EXISTS {quote(index.name)}')
+                for sql in statements:
+                    run_concurrently(sql, dry_run, stdout)
+        created += [index.name for index in missing]
+    return created
+
+
+def ensure_partitions(months_ahead=None, models=None, dry_run=False, stdout=None):
+    """
+    Create the partitions of the current month and the next ``months_ahead`` ones on every partitioned
+    table, so new rows never land in the default partition. Returns the names of the partitions created.
+    """
+    require_postgres()
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'AIS_PARTITION_MONTHS_AHEAD', 3)
+    current = month_start(timezone.localdate())
+    created = []
+    for model in models or PARTITIONED_MODELS:
+        table = model._meta.db_table
+        if table_kind(table) != 'p':
+            continue
+        existing = partitions(table)
+        for month in months_between(current, add_months(current, months_ahead)):
+            if month not in existing:
+                run(partition_statements(model, month), dry_run, stdout)
+                created.append(partition_name(table, month))
+    return created
+
+
+def detach_partitions(before, models=None, dry_run=False, stdout=None):
+    """
+    Detach the monthly partitions entirely before the month of ``before``. They stay behind as plain
+    tables to archive or drop, which costs no row-by-row delete. Returns their names.
+    """
+    require_postgres()
+    detached = []
+    for model in models or PARTITIONED_MODELS:
+        table = model._meta.db_table
+        if table_kind(table) != 'p':
+            continue
+        for month, name in sorted(partitions(table).items()):
+            if month < month_start(before):
+                run([f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}'], dry_run, stdout)
+                detached.append(name)
+    return detached
+
+
+def migrate_table(model, months_ahead=None, dry_run=False, stdout=None):
+    """
+    Convert the plain table of ``model`` into one range-partitioned by month on its timestamp:
+
+    1. create ``<table>_partitioned`` with the same columns and defaults, its monthly partitions from the
+       oldest row to ``months_ahead`` months ahead, a default partition (rows without a timestamp) and the
+       indexes;
+    2. copy the rows month by month, one transaction each, up to the highest id seen at the start;
+    3. lock the original, copy the rows added meanwhile, swap the names and move the id sequence.
+
+    The tables are append-only, so the catch-up in step 3 is short and the original is only locked
+    for it. Reruns start over from step 2. The original stays as ``<table>_unpartitioned``; foreign keys
+    and views referring to it keep doing so until recreated.
+    """
+    require_postgres()
+    table = model._meta.db_table
+    kind = table_kind(table)
+    if kind == 'p':
+        return {'table': table, 'partitions': 0, 'elapsed_seconds': 0.0}
+    if kind is None:
+        raise ValueError(f'{table} does not exist; it is created by the ingest, not by this app.')
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'AIS_PARTITION_MONTHS_AHEAD', 3)
+
+    new = f'{table}{MIGRATION_SUFFIX}'
+    pk, key = model._meta.pk.column, partition_key(model)
+    started = time.perf_counter()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT min({quote(key)}), max({quote(pk)}) FROM {quote(table)}')
+        first, high = cursor.fetchone()
+    high = high or 0
+    current = month_start(timezone.localdate())
+    if first is not None and timezone.is_aware(first):
+        first = timezone.localtime(first)
+    first_month = month_start(min(first.date(), current) if first is not None else current)
+    months = list(months_between(first_month, add_months(current, months_ahead)))
+
+    # Step 1: the partitioned table, indexed before the copy so the swap never waits for an index
+    # build. Index names are per schema, so the original's are renamed first.
+    statements = []
+    if table_kind(new) is None:
+        statements.append(f'CREATE TABLE {quote(new)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING STORAGE '
+                          f'INCLUDING COMMENTS) PARTITION BY RANGE ({quote(key)})')
+    existing = partitions(new, table) if table_kind(new) == 'p' else {}
+    statements += [statement for month in months if month not in existing
+                   for statement in partition_statements(model, month, new, check_default=False)]
+    if table_kind(default_partition(table)) is None:
+        statements.append(f'CREATE TABLE {quote(default_partition(table))} PARTITION OF {quote(new)} DEFAULT')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+        original_indexes = {name for name, in cursor.fetchall()}
+    statements += [f'ALTER INDEX {quote(index.name)} RENAME TO {quote((index.name + ORIGINAL_SUFFIX)[:63])}'
+                   for index in model._meta.indexes if index.name in original_indexes]
+    statements += index_statements(model, new)
+    run(statements, dry_run, stdout)
+
+    # Step 2: straight into each partition, skipping the routing; months are independent, so a rerun
+    # after an interruption just copies them again
+    bounded = f'{quote(pk)} <= {high}'
+    for month in months:
+        name = partition_name(table, month)
+        run([f'TRUNCATE {quote(name)}',
+             f'INSERT INTO {quote(name)} SELECT * FROM {quote(table)} '
+             f'WHERE {range_condition(key, month)} AND {bounded}'], dry_run, stdout)
+        if stdout:
+            stdout.write(f'{name} copied')
+    start, _ = month_bounds(months[0])
+    _, end = month_bounds(months[-1])
+    run([f'TRUNCATE {quote(default_partition(table))}',
+         f'INSERT INTO {quote(default_partition(table))} SELECT * FROM {quote(table)} '
+         f'WHERE ({quote(key)} IS NULL OR {quote(key)} < {literal(start)} OR {quote(key)} >= {literal(end)}) '
+         f'AND {bounded}'], dry_run, stdout)
+
+    # Step 3: catch up and swap while the ingest is held off
+    new_sequence = f'{table}_{pk}_part_seq'
+    run([
+        f'LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE',
+        f'INSERT INTO {quote(new)} SELECT * FROM {quote(table)} WHERE {quote(pk)} > {high}',
+        f'ALTER TABLE {quote(table)} RENAME TO {quote(table + ORIGINAL_SUFFIX)}',
+        f'ALTER TABLE {quote(new)} RENAME TO {quote(table)}',
+        f'CREATE SEQUENCE IF NOT EXISTS {quote(new_sequence)} OWNED BY {quote(table)}.{quote(pk)}',
+        f'SELECT setval({literal_name(new_sequence)}, '
+        f'COALESCE((SELECT max({quote(pk)}) FROM {quote(table)}), 0) + 1, false)',
+        f'ALTER TABLE {quote(table)} ALTER COLUMN {quote(pk)} SET DEFAULT nextval({literal_name(new_sequence)})',
+    ], dry_run, stdout)
+
+    return {
+        'table': table,
+        'partitions': len(months),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,222 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Count, DateField, Max, Q
+from django.db.models.functions import Trunc
+
+from .ais_identity import vessel_keys
+from .ais_rollup import day_range, day_start
+from .ais_stream import stream_records
+from .ais_tables import ensure_tables
+from .models import AisSyncState, Full_Data, PortCall, VesselIdentity
+
+PORT_CALL_SYNC = 'port_calls'
+CALL_COLUMNS = ['imo', 'mmsi', 'ship_id', 'current_port', 'ais_type_summary', 'flag', 'timestamp']
+
+# Anchorages reported as ports of their own, counted as part of the port they serve
+PORT_MERGES = {'KARACHI ANCH': 'KARACHI', 'PORT QASIM ANCH': 'PORT QASIM'}
+
+
+def merge_port(port):
+    return PORT_MERGES.get(port, port) or ''
+
+
+def open_calls():
+    """Calls still in progress, by vessel key. A vessel is at most at one port at a time."""
+    return {call.vessel_key: call for call in PortCall.objects.filter(departure__isnull=True)}
+
+
+def close_call(call):
+    call.departure = call.last_seen
+    call.dwell = call.last_seen - call.arrival
+
+
+def segment_calls(records, current, keys=None):
+    """
+    Fold one batch of fulldata rows into port calls.
+
+    Rows are ordered per vessel in time and split into runs of the same (merged) current_port.
+    A run at a port continues the vessel's open call when it is at the same port, otherwise it
+    closes that call and opens a new one; a run without a port (at sea) only closes it.
+    Vessels are told apart by their vessel key; rows without an identity cannot be attributed and
+    are skipped. ``current`` holds the open calls by vessel key and is updated in place, so it
+    carries over to the next batch. ``keys`` are the rows' vessel keys when already resolved.
+    Returns (new calls, existing calls that changed).
+    """
+    keys = vessel_keys(records) if keys is None else keys
+    rows = sorted(((key, record) for key, record in zip(keys, records)
+                   if key is not None and record['timestamp'] is not None),
+                  key=lambda row: (row[0], row[1]['timestamp'], row[1]['id']))
+    if not rows:
+        return [], []
+    keys = [key for key, _ in rows]
+    records = [record for _, record in rows]
+
+    frame = pd.DataFrame({'key': keys, 'port': [merge_port(record['current_port']) for record in records]})
+    boundary = frame['key'].ne(frame['key'].shift()) | frame['port'].ne(frame['port'].shift())
+    starts = np.flatnonzero(boundary.to_numpy())
+    ends = np.append(starts[1:], len(records))
+    ports = frame['port'].to_numpy()
+
+    created = []
+    changed = {}
+    for start, end in zip(starts, ends):
+        first, last = records[start], records[end - 1]
+        key = keys[start]
+        port = ports[start]
+
+        call = current.pop(key, None)
+        if call is not None and call.port == port:
+            call.last_seen = max(call.last_seen, last['timestamp'])
+            call.dwell = call.last_seen - call.arrival
+            call.reports += int(end - start)
+            current[key] = call
+        elif call is not None:
+            close_call(call)
+        if call is not None and call.pk is not None:
+            changed[call.pk] = call
+
+        if port and key not in current:
+            call = PortCall(imo=first['imo'], mmsi=first['mmsi'], ship_id=first['ship_id'], vessel_key=key, port=port,
+                            ais_type_summary=first['ais_type_summary'], flag=first['flag'],
+                            arrival=first['timestamp'], last_seen=last['timestamp'],
+                            dwell=last['timestamp'] - first['timestamp'], reports=int(end - start))
+            created.append(call)
+            current[key] = call
+
+    return created, list(changed.values())
+
+
+def latest_seen(keys, chunk_size=5000):
+    """Latest last_seen over the stored calls of every vessel in ``keys``, {vessel key: timestamp}."""
+    keys = list(keys)
+    latest = {}
+    for start in range(0, len(keys), chunk_size):
+        latest.update(PortCall.objects.filter(vessel_key__in=keys[start:start + chunk_size])
+                      .values('vessel_key').annotate(latest=Max('last_seen')).values_list('vessel_key', 'latest'))
+    return latest
+
+
+def late_rows(records, keys):
+    """
+    {vessel key: oldest timestamp} of the vessels with rows older than what their stored calls already
+    cover, e.g. delayed satellite reports arriving after newer ones.
+    """
+    latest = latest_seen({key for key in keys if key is not None})
+    late = {}
+    for key, record in zip(keys, records):
+        timestamp = record['timestamp']
+        if key in latest and timestamp is not None and timestamp < latest[key]:
+            late[key] = min(late.get(key, timestamp), timestamp)
+    return late
+
+
+def rewind(late, last_id, current):
+    """
+    Drop the calls of every vessel in ``late`` from the call the late rows fall in (or follow) onwards,
+    and return the vessels' fulldata rows from that call's arrival up to ``last_id``, to be segmented
+    again in time order.
+    """
+    identities = dict(VesselIdentity.objects.filter(vessel_key__in=list(late)).values_list('vessel_key', 'identity'))
+    window = Q(pk__in=[])
+    for key, oldest in late.items():
+        anchor = (PortCall.objects.filter(vessel_key=key, arrival__lte=oldest)
+                  .order_by('-arrival').values_list('arrival', flat=True).first())
+        start = anchor or oldest
+        PortCall.objects.filter(vessel_key=key, arrival__gte=start).delete()
+        current.pop(key, None)
+        # The rows whose canonical identity (see ais_identity) is the vessel's
+        identity = identities[key]
+        window |= (Q(imo=identity) | Q(imo='0', mmsi=identity)) & Q(timestamp__gte=start)
+    return list(Full_Data.objects.filter(window, id__lte=last_id).values('id', *CALL_COLUMNS))
+
+
+def refresh_port_calls(full=False, batch_size=50000, chunk_size=5000, stdout=None):
+    """
+    Fold fulldata rows newer than the stored high-water mark into the port-call table.
+    Each batch is committed together with the new mark; a batch whose mark was moved by a concurrent
+    refresh is dropped and the run stops, leaving the rest to that refresh. Vessels with rows older
+    than their stored calls are re-segmented from the affected call on (see rewind).
+    """
+    ensure_tables([AisSyncState, VesselIdentity])
+    # Calls are tracked by vessel key, so a new table or column means rebuilding them all
+    full = bool(ensure_tables([PortCall])) or full
+    started = time.perf_counter()
+
+    if full:
+        with transaction.atomic():
+            PortCall.objects.all().delete()
+            AisSyncState.set_mark(PORT_CALL_SYNC, 0)
+
+    last_id = AisSyncState.get_mark(PORT_CALL_SYNC)
+    current = open_calls()
+    totals = {'rows': 0, 'calls_created': 0, 'calls_updated': 0, 'vessels_resegmented': 0}
+
+    for records in stream_records(CALL_COLUMNS, chunk_size=batch_size, start_after=last_id):
+        with transaction.atomic():
+            state, _ = AisSyncState.objects.select_for_update().get_or_create(name=PORT_CALL_SYNC)
+            if state.last_id != last_id:
+                break
+            keys = vessel_keys(records)
+            late = late_rows(records, keys)
+            rows = records
+            if late:
+                kept = [(key, record) for key, record in zip(keys, records) if key not in late]
+                reread = rewind(late, records[-1]['id'], current)
+                rows = [record for _, record in kept] + reread
+                keys = [key for key, _ in kept] + vessel_keys(reread)
+            created, changed = segment_calls(rows, current, keys)
+            PortCall.objects.bulk_create(created, batch_size=chunk_size)
+            PortCall.objects.bulk_update(changed, ['departure', 'last_seen', 'dwell', 'reports'],
+                                         batch_size=chunk_size)
+            last_id = records[-1]['id']
+            AisSyncState.set_mark(PORT_CALL_SYNC, last_id)
+
+        totals['rows'] += len(records)
+        totals['calls_created'] += len(created)
+        totals['calls_updated'] += len(changed)
+        totals['vessels_resegmented'] += len(late)
+        if stdout:
+            stdout.write(f"{totals['rows']} rows up to id {last_id}")
+
+    totals['last_id'] = last_id
+    totals['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return totals
+
+
+def calls_between(field, date_from, date_to):
+    """
+    Calls whose ``field`` ('arrival' or 'departure') falls on the days ``date_from`` to ``date_to`` inclusive.
+    A plain read: the table is brought up to date by the scheduled refresh_port_calls command.
+    """
+    return PortCall.objects.filter(day_range(date_from, date_to, field))
+
+
+def calls_overlapping(date_from, date_to):
+    """Calls during which the vessel was at the port at some point of the days ``date_from`` to ``date_to``."""
+    return PortCall.objects.filter(arrival__lt=day_start(date_to) + timedelta(days=1),
+                                   last_seen__gte=day_start(date_from))
+
+
+def counts_by_period(field, date_from, date_to, kind='day', dimensions=(), distinct=None, filters=None):
+    """
+    Number of calls whose ``field`` falls in each ``kind`` ('day' or 'month') period of the range, per
+    combination of ``dimensions``, in one grouped query. With ``distinct`` (e.g. 'imo') the distinct
+    values of that column are counted instead. Returns {(period start date, *dimension values): count}.
+    """
+    queryset = calls_between(field, date_from, date_to)
+    if filters:
+        queryset = queryset.filter(**filters)
+    rows = (queryset
+            .annotate(period=Trunc(field, kind, output_field=DateField()))
+            .values('period', *dimensions)
+            .annotate(count=Count(distinct or 'id', distinct=distinct is not None))
+            .order_by())
+    return {(row['period'], *(row[dimension] for dimension in dimensions)): row['count'] for row in rows}
+
+
+def known_ports():
+    return list(PortCall.objects.values_list('port', flat=True).distinct().order_by('port'))
@@ -0,0 +1,184 @@
+import heapq
+import time
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .ais_stream import stream_records
+from .ais_tables import ensure_tables
+from .models import AisSyncState, VesselLatestPosition
+
+LATEST_POSITION_SYNC = 'latest_positions'
+POSITION_FIELDS = ['imo', 'mmsi', 'latitude', 'longitude', 'speed', 'course', 'timestamp']
+
+
+def latest_of_batch(records):
+    """The newest record of every ship_id in the batch (ties go to the higher id)."""
+    frame = pd.DataFrame.from_records(records)
+    frame = frame[frame['ship_id'].notna() & frame['timestamp'].notna()]
+    if frame.empty:
+        return {}
+    frame['sort_time'] = pd.to_datetime(frame['timestamp'], utc=True)
+    latest = frame.sort_values(['sort_time', 'id']).drop_duplicates('ship_id', keep='last')
+    return {record['ship_id']: record for record in latest.drop(columns='sort_time').to_dict('records')}
+
+
+def store_positions(latest, chunk_size=5000):
+    """Insert or move forward the stored position of every ship in ``latest``. Returns (created, updated)."""
+    created = updated = 0
+    ship_ids = list(latest)
+    for start in range(0, len(ship_ids), chunk_size):
+        chunk = ship_ids[start:start + chunk_size]
+        existing = VesselLatestPosition.objects.in_bulk(chunk)
+        new, changed = [], []
+        for ship_id in chunk:
+            record = latest[ship_id]
+            position = existing.get(ship_id)
+            if position is None:
+                position = VesselLatestPosition(ship_id=ship_id)
+                new.append(position)
+            elif (position.timestamp, position.fulldata_id) >= (record['timestamp'], record['id']):
+                continue
+            else:
+                changed.append(position)
+            position.fulldata_id = record['id']
+            for field in POSITION_FIELDS:
+                setattr(position, field, None if pd.isna(record[field]) else record[field])
+
+        VesselLatestPosition.objects.bulk_create(new, batch_size=chunk_size)
+        VesselLatestPosition.objects.bulk_update(changed, ['fulldata_id'] + POSITION_FIELDS, batch_size=chunk_size)
+        created += len(new)
+        updated += len(changed)
+    return created, updated
+
+
+def refresh_latest_positions(full=False, batch_size=50000, chunk_size=5000):
+    """
+    Fold fulldata rows added since the stored high-water mark into the latest-position table.
+    A ship's position only moves forward in time, so late rows for older reports are ignored.
+    """
+    ensure_tables([AisSyncState, VesselLatestPosition])
+    started = time.perf_counter()
+
+    if full:
+        with transaction.atomic():
+            VesselLatestPosition.objects.all().delete()
+            AisSyncState.set_mark(LATEST_POSITION_SYNC, 0)
+
+    last_id = AisSyncState.get_mark(LATEST_POSITION_SYNC)
+    totals = {'rows': 0, 'created': 0, 'updated': 0}
+    for records in stream_records(['ship_id'] + POSITION_FIELDS, chunk_size=batch_size, start_after=last_id):
+        with transaction.atomic():
+            state, _ = AisSyncState.objects.select_for_update().get_or_create(name=LATEST_POSITION_SYNC)
+            if state.last_id != last_id:
+                break
+            created, updated = store_positions(latest_of_batch(records), chunk_size)
+            last_id = records[-1]['id']
+            AisSyncState.set_mark(LATEST_POSITION_SYNC, last_id)
+
+        totals['rows'] += len(records)
+        totals['created'] += created
+        totals['updated'] += updated
+
+    totals['last_id'] = last_id
+    totals['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return totals
+
+
+def latest_positions(bbox=None, max_age=None):
+    """
+    Last known position of every ship, optionally only inside bbox = (min_lon, min_lat, max_lon, max_lat)
+    and only ships seen within ``max_age`` (a timedelta). A plain read: the table is updated as rows arrive by
+    the scheduled refresh_latest_positions command.
+    """
+    positions = VesselLatestPosition.objects.all()
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        positions = positions.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+    if max_age is not None:
+        positions = positions.filter(timestamp__gte=timezone.now() - max_age)
+    return positions.order_by('ship_id')
+
+
+DEFAULT_TIMEZONE = 'Asia/Karachi'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f %z'
+
+
+def format_timestamps(timestamps, tz=DEFAULT_TIMEZONE):
+    """Format a sequence of aware datetimes in ``tz`` in one vectorized pass."""
+    if not len(timestamps):
+        return []
+    return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).tz_convert(tz).strftime(TIMESTAMP_FORMAT).tolist()
+
+
+def project(longitudes, latitudes):
+    """Equirectangular projection to metres around the track's mean latitude, precise enough for simplification."""
+    scale = np.cos(np.radians(np.mean(latitudes))) if len(latitudes) else 1.0
+    return longitudes * scale * 111320.0, latitudes * 110540.0
+
+
+def segment_distances(x, y, start, end):
+    """Distance of the points strictly between ``start`` and ``end`` to the chord joining them."""
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+    length = np.hypot(dx, dy)
+    if length == 0:
+        return np.hypot(px, py)
+    return np.abs(dx * py - dy * px) / length
+
+
+def douglas_peucker(x, y, tolerance=0.0, max_points=None):
+    """
+    Indexes of the points kept by Douglas-Peucker simplification. Segments are split in order of
+    decreasing deviation, so the result stops at ``max_points`` with the most significant points kept,
+    or earlier once no point deviates more than ``tolerance`` from the simplified line.
+    """
+    size = len(x)
+    if size <= 2:
+        return np.arange(size)
+    budget = size if max_points is None else max(max_points, 2)
+
+    kept = [0, size - 1]
+    heap = []
+
+    def push(start, end):
+        if end - start > 1:
+            distances = segment_distances(x, y, start, end)
+            index = int(np.argmax(distances))
+            heapq.heappush(heap, (-distances[index], start, end, start + 1 + index))
+
+    push(0, size - 1)
+    while heap and len(kept) < budget:
+        distance, start, end, split = heapq.heappop(heap)
+        if -distance <= tolerance:
+            break
+        kept.append(split)
+        push(start, split)
+        push(split, end)
+    return np.sort(np.array(kept))
+
+
+def time_decimate(seconds, max_points):
+    """
+    Indexes of the first point of each of ``max_points - 1`` equal time buckets over the track, plus
+    the last point so the track still ends at the latest report.
+    """
+    if len(seconds) <= max_points:
+        return np.arange(len(seconds))
+    bucket_count = max(max_points - 1, 1)
+    span = seconds[-1] - seconds[0]
+    buckets = np.floor((seconds - seconds[0]) / (span / bucket_count or 1)).astype(np.int64)
+    buckets = np.minimum(buckets, bucket_count - 1)
+    _, first = np.unique(buckets, return_index=True)
+    return np.union1d(first, [len(seconds) - 1])
+
+
+def simplify_track(timestamps, latitudes, longitudes, max_points, tolerance=0.0, method='dp'):
+    """Indexes of the points to keep of a time-ordered track, honouring the ``max_points`` budget."""
+    if method == 'time':
+        seconds = pd.to_datetime(timestamps, utc=True).asi8 / 1e9
+        return time_decimate(seconds, max_points)
+    x, y = project(np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64))
+    return douglas_peucker(x, y, tolerance, max_points)
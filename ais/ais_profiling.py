@@ -0,0 +1,147 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+logger = logging.getLogger('ais.profiling')
+
+METRICS = ['queries', 'db_ms', 'python_ms', 'total_ms', 'rows', 'response_bytes']
+PERCENTILES = [50, 90, 99]
+
+_samples = defaultdict(lambda: deque(maxlen=getattr(settings, 'AIS_PROFILE_WINDOW', 1000)))
+_lock = threading.Lock()
+
+
+def sample_rate():
+    return getattr(settings, 'AIS_PROFILE_SAMPLE_RATE', 0.0)
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries, time spent in the database and rows returned."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            # rowcount is -1 where the driver does not report it for SELECTs (sqlite)
+            rowcount = getattr(context['cursor'], 'rowcount', -1)
+            if rowcount and rowcount > 0:
+                self.rows += rowcount
+
+
+def record(name, sample):
+    with _lock:
+        _samples[name].append(sample)
+    if getattr(settings, 'AIS_PROFILE_LOG', False):
+        logger.info(json.dumps({'endpoint': name, **sample}))
+
+
+def profile_call(name, call):
+    """
+    Run ``call`` and, if this request is sampled, record its profile under ``name`` (a string, or a
+    callable evaluated after the call). Unsampled calls only cost the sampling check.
+    """
+    rate = sample_rate()
+    if not rate or (rate < 1 and random.random() >= rate):
+        return call()
+
+    recorder = QueryRecorder()
+    started = time.perf_counter()
+    with connection.execute_wrapper(recorder):
+        response = call()
+    total = time.perf_counter() - started
+
+    if getattr(response, 'streaming', False):
+        size = None
+    else:
+        # DRF responses are only rendered after the view returns
+        if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+            response.render()
+        size = len(response.content)
+
+    record(name() if callable(name) else name, {
+        'queries': recorder.queries,
+        'db_ms': round(recorder.db_seconds * 1000, 3),
+        'python_ms': round((total - recorder.db_seconds) * 1000, 3),
+        'total_ms': round(total * 1000, 3),
+        'rows': recorder.rows,
+        'response_bytes': size,
+    })
+    return response
+
+
+def profiled(view):
+    """Profile a function view under its name. Goes above @cached_response so cache hits are measured too."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return profile_call(view.__name__, lambda: view(request, *args, **kwargs))
+
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """
+    Profile every request under its URL name, for views that are not decorated with @profiled.
+    Enable by adding 'ais.ais_profiling.ProfilingMiddleware' to MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return profile_call(lambda: endpoint_name(request), lambda: self.get_response(request))
+
+
+def endpoint_name(request):
+    # The URL name is only known once the request has been resolved
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else request.path
+
+
+def summary():
+    """Percentiles of every metric per endpoint over the retained samples."""
+    with _lock:
+        samples = {name: list(values) for name, values in _samples.items()}
+
+    endpoints = {}
+    for name, values in samples.items():
+        stats = {'samples': len(values)}
+        for metric in METRICS:
+            column = np.array([value[metric] for value in values if value[metric] is not None], dtype=np.float64)
+            if len(column):
+                stats[metric] = {f'p{point}': round(float(value), 3)
+                                 for point, value in zip(PERCENTILES, np.percentile(column, PERCENTILES))}
+        endpoints[name] = stats
+    return endpoints
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def profile_stats(request):
+    if request.method == 'DELETE':
+        reset()
+    return JsonResponse({'sample_rate': sample_rate(), 'endpoints': summary()})
@@ -0,0 +1,129 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .ais_identity import vessel_keys
+from .ais_tables import ensure_tables
+from .models import AisSyncState, Full_Data, PortActivityDaily, VesselIdentity
+
+PORT_ACTIVITY_SYNC = 'port_activity_daily'
+ACTIVITY_FIELDS = ['imo', 'mmsi', 'ship_id', 'current_port', 'last_port', 'ais_type_summary', 'flag',
+                   'next_port_country']
+MAX_DAYS_PER_QUERY = 31
+
+
+def day_start(day):
+    start = datetime.combine(day, datetime.min.time())
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def timestamp_range(start, end, field='timestamp'):
+    """
+    ``start <= field < end`` as a plain comparison on the column, which can use its indexes and lets
+    Postgres prune the monthly partitions (a ``__date`` lookup wraps the column in a cast and can do neither).
+    """
+    return Q(**{f'{field}__gte': start, f'{field}__lt': end})
+
+
+def day_range(date_from, date_to, field='timestamp'):
+    """The days ``date_from`` to ``date_to`` inclusive, as a half-open timestamp range."""
+    return timestamp_range(day_start(date_from), day_start(date_to + timedelta(days=1)), field)
+
+
+def day_ranges(days):
+    """Group sorted days into (first, last) ranges of consecutive days, at most MAX_DAYS_PER_QUERY long."""
+    ranges = []
+    for day in sorted(days):
+        if ranges and day - ranges[-1][1] == timedelta(days=1) and (day - ranges[-1][0]).days < MAX_DAYS_PER_QUERY:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+def rebuild_days(days, chunk_size=5000):
+    """Recompute the rollup rows of ``days`` from fulldata. Returns the number of rows written."""
+    written = 0
+    for first, last in day_ranges(days):
+        PortActivityDaily.objects.filter(day__range=(first, last)).delete()
+        rows = (Full_Data.objects
+                .filter(day_range(first, last))
+                .annotate(day=TruncDate('timestamp'))
+                .values('day', *ACTIVITY_FIELDS)
+                .annotate(reports=Count('id'), first_seen=Min('timestamp'), last_seen=Max('timestamp'))
+                .order_by())
+
+        batch = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                written += store_rows(batch)
+                batch = []
+        written += store_rows(batch)
+    return written
+
+
+def store_rows(rows):
+    keys = vessel_keys(rows)
+    PortActivityDaily.objects.bulk_create([PortActivityDaily(vessel_key=key, **row) for row, key in zip(rows, keys)])
+    return len(rows)
+
+
+def refresh_port_activity(full=False, chunk_size=5000):
+    """
+    Bring the daily rollup up to date with fulldata. Only the days touched by rows added since the
+    stored high-water mark are recomputed, so late-arriving reports for older days are handled too.
+    """
+    ensure_tables([AisSyncState, VesselIdentity])
+    # A new table or column (vessel_key, first_seen, ...) is only filled by a full rebuild
+    full = bool(ensure_tables([PortActivityDaily])) or full
+    started = time.perf_counter()
+
+    with transaction.atomic():
+        # Lock the state row so concurrent refreshes do not rebuild the same days twice
+        state, _ = AisSyncState.objects.select_for_update().get_or_create(name=PORT_ACTIVITY_SYNC)
+        mark = 0 if full else state.last_id
+        last_id = Full_Data.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        days = []
+        if last_id > mark:
+            if full:
+                PortActivityDaily.objects.all().delete()
+            days = list(Full_Data.objects
+                        .filter(id__gt=mark, id__lte=last_id, timestamp__isnull=False)
+                        .annotate(day=TruncDate('timestamp'))
+                        .values_list('day', flat=True)
+                        .distinct())
+            rows = rebuild_days(days, chunk_size)
+            AisSyncState.set_mark(PORT_ACTIVITY_SYNC, last_id)
+        else:
+            rows = 0
+
+    return {
+        'days_rebuilt': len(days),
+        'rows_written': rows,
+        'last_id': max(last_id, mark),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def activity(date_from, date_to):
+    """
+    Rollup rows of the days from ``date_from`` to ``date_to``, both inclusive. A plain read: the rollup is
+    brought up to date by the scheduled refresh_port_activity command, never from a request.
+    """
+    if isinstance(date_from, datetime):
+        date_from = date_from.date()
+    if isinstance(date_to, datetime):
+        date_to = date_to.date()
+    return PortActivityDaily.objects.filter(day__range=(date_from, date_to))
+
+
+def activity_values(field):
+    """Every value of ``field`` seen in the rollup, replacing a distinct scan over fulldata."""
+    return PortActivityDaily.objects.values_list(field, flat=True).distinct()
@@ -0,0 +1,122 @@
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Q
+
+from .ais_port_calls import PORT_MERGES, merge_port
+from .ais_rollup import day_range
+from .ais_stream import stream_frames
+
+STAY_COLUMNS = ['imo', 'ship_id', 'current_port', 'timestamp']
+PERCENTILES = [50, 75, 90, 95, 99]
+
+
+def default_gap():
+    return timedelta(hours=getattr(settings, 'AIS_STAY_GAP_HOURS', 6))
+
+
+def port_filter(port=None):
+    """Reports at ``port`` under any of its names, or at any port."""
+    if port:
+        return Q(current_port__in=[port] + [name for name, merged in PORT_MERGES.items() if merged == port])
+    return Q(current_port__isnull=False) & ~Q(current_port='')
+
+
+class StaySessions:
+    """
+    Splits the in-port reports of every vessel into visits, one page of reports at a time.
+
+    Consecutive reports of a vessel at a port belong to the same visit while they are at most ``gap``
+    apart; a longer silence starts a new visit. Pages must arrive in timestamp order. Only the visits
+    still open are kept between pages, and finished visits are folded into a histogram of whole
+    minutes, so memory stays bounded however long the range is.
+    """
+
+    def __init__(self, gap):
+        self.gap = np.timedelta64(int(gap.total_seconds()), 's')
+        self.open = {}  # (imo, ship_id, port) -> [first report, last report] as datetime64
+        self.minutes = Counter()  # visit duration in whole minutes -> number of visits
+
+    def close(self, first, last):
+        durations = (np.asarray(last) - np.asarray(first)) // np.timedelta64(1, 'm')
+        self.minutes.update(durations.astype(np.int64).tolist())
+
+    def add(self, frame):
+        frame = pd.DataFrame({
+            'imo': frame['imo'].fillna(''),
+            'ship_id': frame['ship_id'].fillna(''),
+            'port': frame['current_port'].map(merge_port),
+            'timestamp': pd.to_datetime(frame['timestamp'], utc=True).dt.tz_localize(None),
+        }).sort_values(['imo', 'ship_id', 'port', 'timestamp'], kind='stable')
+
+        same_key = (frame['imo'].eq(frame['imo'].shift()) & frame['ship_id'].eq(frame['ship_id'].shift())
+                    & frame['port'].eq(frame['port'].shift()))
+        within_gap = frame['timestamp'].diff().le(pd.Timedelta(self.gap))
+        runs = (frame.groupby((~(same_key & within_gap)).cumsum().to_numpy(), sort=False)
+                .agg(imo=('imo', 'first'), ship_id=('ship_id', 'first'), port=('port', 'first'),
+                     first=('timestamp', 'min'), last=('timestamp', 'max')))
+
+        key_columns = ['imo', 'ship_id', 'port']
+        first_of_key = ~runs.duplicated(key_columns, keep='first').to_numpy()
+        last_of_key = ~runs.duplicated(key_columns, keep='last').to_numpy()
+        firsts = runs['first'].to_numpy()
+        lasts = runs['last'].to_numpy()
+
+        # Runs with another run of the same vessel and port on both sides are complete visits
+        middle = ~first_of_key & ~last_of_key
+        self.close(firsts[middle], lasts[middle])
+
+        # The first run of a key may continue the visit left open by the previous page
+        keys = list(zip(runs['imo'], runs['ship_id'], runs['port']))
+        for index in np.flatnonzero(first_of_key | last_of_key):
+            key, first, last = keys[index], firsts[index], lasts[index]
+            if first_of_key[index]:
+                visit = self.open.pop(key, None)
+                if visit is not None:
+                    if first - visit[1] <= self.gap:
+                        first = visit[0]
+                    else:
+                        self.close([visit[0]], [visit[1]])
+            if last_of_key[index]:
+                self.open[key] = [first, last]
+            else:
+                self.close([first], [last])
+
+        # Visits silent for longer than the gap cannot be continued by later pages
+        if len(frame):
+            horizon = frame['timestamp'].to_numpy().max() - self.gap
+            expired = [key for key, (_, last) in self.open.items() if last < horizon]
+            for key in expired:
+                self.close(*([value] for value in self.open.pop(key)))
+
+    def finish(self):
+        for first, last in self.open.values():
+            self.close([first], [last])
+        self.open = {}
+        return self.minutes
+
+
+def percentiles(minutes, points=PERCENTILES):
+    """Percentiles, in hours, of a {duration in minutes: visits} histogram."""
+    total = sum(minutes.values())
+    if not total:
+        return {}
+    values = np.array(sorted(minutes))
+    cumulative = np.cumsum([minutes[value] for value in values])
+    return {f'p{point}': round(float(values[np.searchsorted(cumulative, total * point / 100)]) / 60, 2)
+            for point in points}
+
+
+def visit_durations(date_from, date_to, port=None, gap=None, chunk_size=50000):
+    """
+    Histogram {whole minutes: visits} of the visits to ``port`` (or to any port) seen between the days
+    ``date_from`` and ``date_to`` inclusive, streamed from fulldata in timestamp order.
+    """
+    sessions = StaySessions(gap if gap is not None else default_gap())
+    filters = port_filter(port) & day_range(date_from, date_to)
+    for frame in stream_frames(STAY_COLUMNS, filters, chunk_size=chunk_size, order='timestamp'):
+        sessions.add(frame)
+    return sessions.finish()
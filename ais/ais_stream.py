@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from django.db.models import Q
+
+from .models import Full_Data
+
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def stream_records(columns, filters=None, chunk_size=DEFAULT_CHUNK_SIZE, order='id', start_after=None):
+    """
+    Yield lists of Full_Data rows (dicts of ``columns`` plus id) of at most ``chunk_size`` rows.
+
+    Pages are fetched with keyset pagination instead of OFFSET, so every page is an index range scan
+    and memory stays bounded by one page:
+    - order='id' pages on the primary key, the cheapest order and the one to use for full scans;
+    - order='timestamp' pages on (timestamp, id), for consumers that need rows in time order;
+      rows without a timestamp are skipped.
+    ``filters`` is a Q object or a dict of lookups applied to every page.
+    ``start_after`` resumes after a previous position: an id, or a (timestamp, id) pair.
+    """
+    if isinstance(filters, dict):
+        filters = Q(**filters)
+    queryset = Full_Data.objects.all()
+    if filters is not None:
+        queryset = queryset.filter(filters)
+    if order == 'timestamp':
+        queryset = queryset.filter(timestamp__isnull=False)
+
+    fields = list(dict.fromkeys(list(columns) + ['id'] + (['timestamp'] if order == 'timestamp' else [])))
+    order_by = ['id'] if order == 'id' else ['timestamp', 'id']
+    position = start_after
+
+    while True:
+        page = queryset
+        if position is not None:
+            if order == 'id':
+                page = page.filter(id__gt=position)
+            else:
+                timestamp, row_id = position
+                page = page.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=row_id))
+
+        records = list(page.order_by(*order_by).values(*fields)[:chunk_size])
+        if not records:
+            return
+        yield records
+
+        if len(records) < chunk_size:
+            return
+        last = records[-1]
+        position = last['id'] if order == 'id' else (last['timestamp'], last['id'])
+
+
+def stream_frames(columns, filters=None, chunk_size=DEFAULT_CHUNK_SIZE, order='id', start_after=None):
+    """Like stream_records but yields one pandas DataFrame with ``columns`` (plus id) per page."""
+    for records in stream_records(columns, filters, chunk_size, order, start_after):
+        yield pd.DataFrame.from_records(records)
+
+
+def stream_columns(columns, filters=None, chunk_size=DEFAULT_CHUNK_SIZE, order='id', start_after=None):
+    """Like stream_records but yields a dict of NumPy arrays, one per column, per page."""
+    for records in stream_records(columns, filters, chunk_size, order, start_after):
+        yield {column: np.array([record[column] for record in records]) for column in records[0]}
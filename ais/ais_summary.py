@@ -1,11 +1,19 @@
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
 from rest_framework.generics import get_object_or_404
 from rest_framework.views import APIView
 
 from dadss_server.parent import *
+from .ais_params import int_param
 from .mer_special_report import MerSpecialReportListSerializer
 from .mer_vessel import MerchantVesselMinimalSerializer
 from .models import *
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+DEFAULT_DETAILS_LIMIT = 500  # detail rows per trip with expand=details
+MAX_DETAILS_LIMIT = 5000
+
 
 class TripDetailsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,35 +31,95 @@ class MerVesselTripSerializer(serializers.ModelSerializer):
         read_only_fields = ['mt_key', 'mt_mv_key']
 
 
-class MerchantVesselBundleSerializer(serializers.Serializer):
-    merchant_vessel = MerchantVesselMinimalSerializer()
-    trips = MerVesselTripSerializer(many=True)
-    reports = MerSpecialReportListSerializer(many=True)
+class TripSummarySerializer(serializers.ModelSerializer):
+    detail_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Merchant_Trip
+        fields = '__all__'
+        read_only_fields = ['mt_key', 'mt_mv_key']
+
+
+class TripWithDetailsSerializer(TripSummarySerializer):
+    # Only the first details_limit details of the trip, attached by attach_details
+    trip_details = TripDetailsSerializer(source='limited_details', many=True, read_only=True)
+
+
+def attach_details(trips, limit):
+    """
+    Set ``limited_details`` on every trip to its first ``limit`` detail rows (oldest first), fetched for
+    all the trips in one query by numbering the rows per trip.
+    """
+    details = {trip.mt_key: [] for trip in trips}
+    rows = (Trip_Details.objects
+            .filter(mtd_mt_key__in=list(details))
+            .annotate(row_number=Window(RowNumber(), partition_by=[F('mtd_mt_key')],
+                                        order_by=[F('mtd_timestamp').asc(), F('mtd_key').asc()]))
+            .filter(row_number__lte=limit)
+            .order_by('mtd_mt_key', 'row_number'))
+    for detail in rows:
+        details[detail.mtd_mt_key_id].append(detail)
+    for trip in trips:
+        trip.limited_details = details[trip.mt_key]
+
+
+def paginate(queryset, request, prefix, default_size):
+    """
+    Slice one page of ``queryset`` from ?<prefix>_page and ?<prefix>_page_size. Returns (items, page info).
+    Out of range numbers are clamped; values that are not integers answer 400.
+    """
+    page = max(int_param(request.query_params, f'{prefix}_page', 1), 1)
+    page_size = min(max(int_param(request.query_params, f'{prefix}_page_size', default_size), 1), MAX_PAGE_SIZE)
+    count = queryset.count()
+    items = list(queryset[(page - 1) * page_size:page * page_size])
+    return items, {'count': count, 'page': page, 'page_size': page_size,
+                   'pages': (count + page_size - 1) // page_size}
 
 
 class MerchantVesselDataView(DebugTimingMixin, APIView):
-    def get(self, mv_key):
+    """
+    Vessel page bundle: the vessel, one page of trip summaries and one page of special reports.
+    ?expand=details adds each trip's detail rows, at most ?details_limit per trip (oldest first).
+    Pages are chosen with ?trips_page / ?trips_page_size and ?reports_page / ?reports_page_size.
+    The query count does not depend on the number of trips, details or reports.
+    """
+
+    def get(self, request, mv_key):
         vessel = get_object_or_404(
             Merchant_Vessel.objects.select_related('mv_ship_type')
             .prefetch_related('mv_images'),  # If images exist
             mv_key=mv_key
         )
 
-        trips = (Merchant_Trip.objects.filter(mt_mv_key=vessel))
+        trips = (Merchant_Trip.objects
+                 .filter(mt_mv_key=vessel)
+                 .annotate(detail_count=Count('tripdetails'))
+                 .order_by('-mt_first_observed_at', '-mt_key'))
+        expand_details = 'details' in request.query_params.get('expand', '').split(',')
 
         reports = (
             MerSreports.objects
             .filter(msr_mv_key=vessel.mv_key)
             .select_related('msr_action', 'msr_mv_key')
             .prefetch_related('msr_patroltype')
+            .order_by('-msr_dtg', '-msr_key')
         )
 
-        trips_data = MerVesselTripSerializer(trips, many=True).data
-        reports_data = MerSpecialReportListSerializer(reports, many=True).data
+        trips_page, trips_info = paginate(trips, request, 'trips', DEFAULT_PAGE_SIZE)
+        reports_page, reports_info = paginate(reports, request, 'reports', DEFAULT_PAGE_SIZE)
+        if expand_details and trips_page:
+            attach_details(trips_page, min(int_param(request.query_params, 'details_limit', DEFAULT_DETAILS_LIMIT),
+                                           MAX_DETAILS_LIMIT))
+
+        trip_serializer = TripWithDetailsSerializer if expand_details else TripSummarySerializer
+        trips_data = trip_serializer(trips_page, many=True).data
+        reports_data = MerSpecialReportListSerializer(reports_page, many=True).data
         vessel = MerchantVesselMinimalSerializer(vessel).data
 
         return Response({
             "merchant_vessel": vessel,
             "trips": trips_data,
-            "reports": reports_data
+            "trips_page": trips_info,
+            "reports": reports_data,
+            "reports_page": reports_info
         })
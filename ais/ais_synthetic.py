@@ -0,0 +1,218 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Full_Data
+
+# name: (latitude, longitude, country, anchorage reported while waiting outside the port)
+PORTS = {
+    'KARACHI': (24.84, 66.98, 'PK', 'KARACHI ANCH'),
+    'PORT QASIM': (24.77, 67.33, 'PK', 'PORT QASIM ANCH'),
+    'GWADAR': (25.11, 62.33, 'PK', None),
+    'JEBEL ALI': (25.01, 55.06, 'AE', None),
+    'SALALAH': (16.94, 54.00, 'OM', None),
+    'MUMBAI': (18.95, 72.84, 'IN', None),
+    'CHITTAGONG': (22.31, 91.80, 'BD', None),
+}
+HOME_PORTS = 3  # the first ports are the Pakistani ones every vessel keeps returning to
+FLAGS = ['PK', 'PA', 'LR', 'MH', 'SG', 'AE', 'IN', 'MT', 'BS', 'CN', 'GR', 'HK']
+# ais_type_summary: (type_name, share of the fleet)
+TYPES = {
+    'Cargo': ('General Cargo', 0.45),
+    'Tanker': ('Oil Products Tanker', 0.25),
+    'Fishing': ('Fishing Vessel', 0.12),
+    'Tug': ('Tug', 0.08),
+    'Passenger': ('Passenger Ship', 0.05),
+    'Other': ('Other Type', 0.05),
+}
+
+MEAN_DWELL_HOURS = 36  # time alongside or at anchor per port call
+MEAN_LEG_HOURS = 96  # time at sea between two calls
+ANCHORAGE_SHARE = 0.4  # share of port reports that name the anchorage instead of the port
+
+
+def default_vessels(rows):
+    """A fleet size that grows with the data, between a small port and a busy region's year of traffic."""
+    return int(min(max(rows // 5000, 50), 5000))
+
+
+def build_fleet(vessels, rng, mmsi_only_share=0.15):
+    """Static attributes of every vessel, as arrays indexed by vessel number."""
+    numbers = np.arange(vessels)
+    mmsi = (rng.choice(np.arange(200, 780), vessels) * 1000000 + numbers).astype(str)
+    imo = (9000000 + numbers).astype(str).astype(object)
+    # Small craft without an IMO number report imo '0' and are told apart by MMSI only
+    imo[rng.random(vessels) < mmsi_only_share] = '0'
+    summaries = list(TYPES)
+    summary = rng.choice(len(summaries), vessels, p=[share for _, share in TYPES.values()])
+    length = np.round(rng.gamma(4, 40, vessels), 1)
+    return {
+        'mmsi': mmsi,
+        'imo': imo,
+        'ship_id': (100000 + numbers).astype(str),
+        'ship_name': np.char.add('SYNTHETIC ', numbers.astype(str)),
+        'call_sign': np.char.add('SYN', numbers.astype(str)),
+        'flag': rng.choice(FLAGS, vessels),
+        'ais_type_summary': np.array(summaries, dtype=object)[summary],
+        'type_name': np.array([TYPES[name][0] for name in summaries], dtype=object)[summary],
+        'length': length,
+        'width': np.round(length / 6.5, 1),
+        'dwt': np.round(length ** 2 * 1.8),
+        'grt': np.round(length ** 2 * 1.1),
+        'year_built': rng.integers(1985, 2024, vessels),
+        'draught': np.round(length / 25, 1),
+        # Busy liners report far more often than the average vessel
+        'weight': rng.pareto(2.0, vessels) + 1,
+    }
+
+
+def build_schedules(vessels, span, rng):
+    """
+    Alternating port calls and sea legs of every vessel over ``span`` seconds, as flat arrays of
+    segments ordered by vessel then start. A segment's port is -1 at sea; prev/next are the ports of
+    the surrounding calls. Every vessel's segments cover [0, span).
+    """
+    port_count = len(PORTS)
+    columns = {name: [] for name in ('vessel', 'start', 'end', 'port', 'prev', 'next')}
+    for vessel in range(vessels):
+        in_port = rng.random() < 0.5
+        time = -rng.uniform(0, MEAN_LEG_HOURS * 3600)  # random phase so vessels do not move in step
+        # Most calls are at home ports; foreign ports are where the legs lead
+        port = int(rng.integers(0, HOME_PORTS))
+        previous = int(rng.integers(0, port_count))
+        while time < span:
+            hours = rng.lognormal(np.log(MEAN_DWELL_HOURS if in_port else MEAN_LEG_HOURS), 0.6)
+            end = time + hours * 3600
+            following = int(rng.integers(0, HOME_PORTS) if port >= HOME_PORTS or rng.random() < 0.5
+                            else rng.integers(0, port_count))
+            if in_port:
+                columns['port'].append(port)
+                columns['prev'].append(previous)
+                columns['next'].append(following)
+            else:
+                columns['port'].append(-1)
+                columns['prev'].append(previous)
+                columns['next'].append(port)
+            columns['vessel'].append(vessel)
+            columns['start'].append(max(time, 0.0))
+            columns['end'].append(end)
+            if in_port:
+                previous, port = port, following
+            in_port = not in_port
+            time = end
+    return {name: np.array(values) for name, values in columns.items()}
+
+
+def generate_fulldata(rows, days=90, vessels=None, satellite_share=0.35, mmsi_only_share=0.15, start=None,
+                      seed=0, chunk_size=10000):
+    """
+    Yield lists of unsaved Full_Data rows, ``rows`` in total, spread over ``days`` days and in time
+    order like the ingest produces them. Vessels alternate between port calls (terrestrial reports
+    near the port, a share of them naming the anchorage) and sea legs (a ``satellite_share`` of the
+    reports through satellite). Destination and eta change per leg, so trips segment realistically.
+    """
+    rng = np.random.default_rng(seed)
+    vessels = vessels or default_vessels(rows)
+    if start is None:
+        start = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=days), datetime.min.time()))
+    span = days * 86400.0
+
+    fleet = build_fleet(vessels, rng, mmsi_only_share)
+    schedule = build_schedules(vessels, span, rng)
+    weights = fleet['weight'] / fleet['weight'].sum()
+    segment_keys = schedule['vessel'] * span + schedule['start']
+
+    names = np.array(list(PORTS), dtype=object)
+    anchorages = np.array([PORTS[name][3] for name in PORTS], dtype=object)
+    countries = np.array([PORTS[name][2] for name in PORTS], dtype=object)
+    has_anchorage = np.array([PORTS[name][3] is not None for name in PORTS])
+    coordinates = np.array([PORTS[name][:2] for name in PORTS], dtype=np.float64)
+
+    produced = 0
+    while produced < rows:
+        size = min(chunk_size, rows - produced)
+        # Each chunk covers its share of the time span, so ids increase with time
+        window = (produced / rows * span, (produced + size) / rows * span)
+        seconds = np.sort(rng.uniform(*window, size))
+        vessel = rng.choice(vessels, size, p=weights)
+
+        segment = np.searchsorted(segment_keys, vessel * span + seconds, side='right') - 1
+        port = schedule['port'][segment]
+        previous, following = schedule['prev'][segment], schedule['next'][segment]
+        at_port = port >= 0
+        progress = np.clip((seconds - schedule['start'][segment])
+                           / (schedule['end'][segment] - schedule['start'][segment]), 0, 1)
+
+        # At port: jitter around the berth. At sea: along the line between the two calls.
+        origin, target = coordinates[previous], coordinates[np.where(at_port, port, following)]
+        position = np.where(at_port[:, None], coordinates[np.maximum(port, 0)],
+                            origin + (target - origin) * progress[:, None])
+        position += rng.normal(0, 1, (size, 2)) * np.where(at_port, 0.02, 0.15)[:, None]
+        speed = np.where(at_port, rng.exponential(0.3, size), rng.normal(12, 2, size).clip(4))
+
+        current_port = np.where(at_port, names[np.maximum(port, 0)], None)
+        anchored = at_port & (rng.random(size) < ANCHORAGE_SHARE) & has_anchorage[np.maximum(port, 0)]
+        current_port[anchored] = anchorages[port[anchored]]
+        dsrc = np.where(~at_port & (rng.random(size) < satellite_share), 'SAT', 'TER')
+
+        # Destination is the next call; eta the end of the leg towards it
+        destination = names[following]
+        next_leg = np.minimum(segment + at_port, len(schedule['end']) - 1)
+        next_leg = np.where(schedule['vessel'][next_leg] == vessel, next_leg, segment)
+        eta_seconds = np.round(schedule['end'][next_leg] / 3600) * 3600
+
+        batch = []
+        for (index, row_vessel, second, latitude, longitude, row_speed, row_port, row_dsrc, row_destination,
+             row_eta, row_previous, row_at_port) in zip(
+                range(size), vessel.tolist(), seconds.tolist(), position[:, 0].tolist(), position[:, 1].tolist(),
+                speed.tolist(), current_port.tolist(), dsrc.tolist(), destination.tolist(), eta_seconds.tolist(),
+                previous.tolist(), at_port.tolist()):
+            batch.append(Full_Data(
+                mmsi=fleet['mmsi'][row_vessel],
+                imo=fleet['imo'][row_vessel],
+                ship_id=fleet['ship_id'][row_vessel],
+                latitude=round(latitude, 5),
+                longitude=round(longitude, 5),
+                speed=round(row_speed, 1),
+                course=float((second / 60 + row_vessel * 37) % 360),
+                heading=None,
+                status='1' if row_at_port else '0',
+                timestamp=start + timedelta(seconds=second),
+                dsrc=row_dsrc,
+                ship_name=str(fleet['ship_name'][row_vessel]),
+                call_sign=str(fleet['call_sign'][row_vessel]),
+                flag=fleet['flag'][row_vessel],
+                length=float(fleet['length'][row_vessel]),
+                width=float(fleet['width'][row_vessel]),
+                grt=float(fleet['grt'][row_vessel]),
+                dwt=float(fleet['dwt'][row_vessel]),
+                draught=float(fleet['draught'][row_vessel]),
+                year_built=int(fleet['year_built'][row_vessel]),
+                type_name=fleet['type_name'][row_vessel],
+                ais_type_summary=fleet['ais_type_summary'][row_vessel],
+                destination=row_destination,
+                eta=start + timedelta(seconds=row_eta),
+                current_port=row_port,
+                current_port_country=countries[port[index]] if row_at_port else None,
+                last_port=names[row_previous],
+                last_port_country=countries[row_previous],
+                next_port_name=row_destination,
+                next_port_country=countries[following[index]],
+            ))
+        produced += size
+        yield batch
+
+
+def load_fulldata(rows, chunk_size=10000, stdout=None, **options):
+    """Bulk insert a synthetic dataset into fulldata. Returns (rows inserted, first timestamp, last timestamp)."""
+    inserted = 0
+    first = last = None
+    for batch in generate_fulldata(rows, chunk_size=chunk_size, **options):
+        Full_Data.objects.bulk_create(batch, batch_size=chunk_size)
+        inserted += len(batch)
+        first = first or batch[0].timestamp
+        last = batch[-1].timestamp
+        if stdout:
+            stdout.write(f'{inserted} of {rows} rows loaded')
+    return inserted, first, last
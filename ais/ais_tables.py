@@ -0,0 +1,48 @@
+from django.db import connection
+from django.db.models import Index
+
+from .models import AisSyncState, PortActivityDaily, PortCall, VesselIdentity, VesselLatestPosition
+
+# Tables derived from fulldata that this app creates and maintains itself
+DERIVED_MODELS = [
+    AisSyncState,
+    PortActivityDaily,
+    PortCall,
+    VesselIdentity,
+    VesselLatestPosition,
+]
+
+
+def ensure_tables(models=None):
+    """
+    Create any missing derived table, and add the columns and indexes a newer version of the model
+    has to an existing one. Returns the names of what was created: tables, 'table.column' and
+    'table:index'.
+    """
+    existing = set(connection.introspection.table_names())
+    missing = []
+    for model in models or DERIVED_MODELS:
+        table = model._meta.db_table
+        if table not in existing:
+            missing.append((model, table, None))
+            continue
+        with connection.cursor() as cursor:
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+            constraints = set(connection.introspection.get_constraints(cursor, table))
+        missing += [(model, f'{table}.{field.column}', field) for field in model._meta.local_fields
+                    if field.column not in columns]
+        missing += [(model, f'{table}:{index.name}', index) for index in model._meta.indexes
+                    if index.name not in constraints]
+
+    # The schema editor is only entered when there is something to create (SQLite refuses it inside
+    # a transaction)
+    if missing:
+        with connection.schema_editor() as editor:
+            for model, name, item in missing:
+                if item is None:
+                    editor.create_model(model)
+                elif isinstance(item, Index):
+                    editor.add_index(model, item)
+                else:
+                    editor.add_field(model, item)
+    return [name for _, name, _ in missing]
@@ -0,0 +1,108 @@
+import io
+
+import numpy as np
+
+from .models import Merchant_Trip, Trip_Details
+
+# Column name in the columnar output <- Trip_Details field
+TRACK_FIELDS = {
+    'lon': 'mtd_longitude',
+    'lat': 'mtd_latitude',
+    'speed': 'mtd_speed',
+    'course': 'mtd_course',
+    'timestamp': 'mtd_timestamp',
+}
+COORDINATE_SCALE = 100000  # delta-encoded coordinates are integers of 1e-5 degrees (about a metre)
+
+
+def load_tracks(mv_key, trip_keys=None):
+    """
+    Track points of a vessel's trips as parallel NumPy arrays, ordered by trip then time, in one query.
+    Points without a position or timestamp are left out. Timestamps are epoch seconds (UTC).
+    """
+    details = Trip_Details.objects.filter(mtd_mt_key__mt_mv_key=mv_key, mtd_longitude__isnull=False,
+                                          mtd_latitude__isnull=False, mtd_timestamp__isnull=False)
+    if trip_keys:
+        details = details.filter(mtd_mt_key__in=trip_keys)
+    rows = list(details.order_by('mtd_mt_key', 'mtd_timestamp', 'mtd_key')
+                .values_list('mtd_mt_key', *TRACK_FIELDS.values()))
+
+    columns = {'trip': np.array([row[0] for row in rows], dtype=np.int64)}
+    for index, name in enumerate(TRACK_FIELDS, start=1):
+        if name == 'timestamp':
+            columns[name] = np.array([row[index].timestamp() for row in rows], dtype=np.float64).astype(np.int64)
+        else:
+            columns[name] = np.array([row[index] for row in rows], dtype=np.float64)  # None becomes NaN
+    return columns
+
+
+def trip_offsets(trips):
+    """Index of the first point of every trip in the trip-ordered arrays, and the trip keys in that order."""
+    starts = np.flatnonzero(np.r_[True, trips[1:] != trips[:-1]]) if len(trips) else np.array([], dtype=np.int64)
+    return starts, trips[starts]
+
+
+def delta_encode(values, starts):
+    """Differences to the previous point of the same trip; the first point of each trip stays absolute."""
+    deltas = np.diff(values, prepend=values[:1]) if len(values) else values.copy()
+    deltas[starts] = values[starts]
+    return deltas
+
+
+def encode_tracks(columns, delta=False):
+    """
+    Columnar form of the tracks. With ``delta`` coordinates become integer deltas of 1e-5 degrees and
+    timestamps deltas in seconds, restarting at every trip, which keeps the numbers short.
+    """
+    starts, trip_keys = trip_offsets(columns['trip'])
+    encoded = {name: columns[name] for name in TRACK_FIELDS}
+    if delta:
+        for name in ('lon', 'lat'):
+            encoded[name] = delta_encode(np.round(columns[name] * COORDINATE_SCALE).astype(np.int64), starts)
+        encoded['timestamp'] = delta_encode(columns['timestamp'], starts)
+    return starts, trip_keys, encoded
+
+
+def tracks_json(mv_key, columns, delta=False):
+    starts, trip_keys, encoded = encode_tracks(columns, delta)
+    trips = Merchant_Trip.objects.in_bulk(trip_keys.tolist())
+
+    def values(array):
+        if array.dtype.kind == 'f':
+            # Missing speed/course readings are NaN, which JSON cannot carry
+            return [None if value != value else round(value, 5) for value in array.tolist()]
+        return array.tolist()
+
+    return {
+        'mv_key': mv_key,
+        'encoding': {'delta': delta, 'coordinate_scale': COORDINATE_SCALE if delta else None,
+                     'timestamp': 'epoch seconds'},
+        'trips': [
+            {
+                'mt_key': key,
+                'offset': int(start),
+                'mt_trip_status': trips[key].mt_trip_status,
+                'mt_destination': trips[key].mt_destination,
+                'mt_first_observed_at': trips[key].mt_first_observed_at,
+                'mt_last_observed_at': trips[key].mt_last_observed_at,
+            }
+            for key, start in zip(trip_keys.tolist(), starts.tolist())
+        ],
+        'columns': {name: values(array) for name, array in encoded.items()},
+    }
+
+
+def tracks_npy(columns, delta=False):
+    """The tracks as one structured NumPy array (.npy bytes), a row per point with its trip key."""
+    _, _, encoded = encode_tracks(columns, delta)
+    coordinate_type = np.int64 if delta else np.float64
+    dtype = [('trip', np.int64), ('lon', coordinate_type), ('lat', coordinate_type), ('speed', np.float32),
+             ('course', np.float32), ('timestamp', np.int64)]
+    array = np.empty(len(columns['trip']), dtype=dtype)
+    array['trip'] = columns['trip']
+    for name in TRACK_FIELDS:
+        array[name] = encoded[name]
+
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
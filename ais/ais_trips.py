@@ -0,0 +1,377 @@
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from operator import itemgetter
+
+import django
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+
+from .ais_identity import resolver
+from .ais_stream import stream_records
+from .ais_tables import ensure_tables
+from .models import *
+
+TRIP_SYNC = 'register_trip'
+
+
+class SyncInProgress(Exception):
+    """Another run of the same job holds its lock."""
+
+
+@contextmanager
+def job_lock(name):
+    """
+    Hold the job ``name`` for the whole run. On Postgres this is a session advisory lock, taken without
+    waiting: SyncInProgress is raised when another run holds it. Elsewhere every batch still locks the
+    job's AisSyncState row and checks its mark (see register_all).
+    """
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    key = zlib.crc32(name.encode())
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        if not cursor.fetchone()[0]:
+            raise SyncInProgress(f'{name} is already running.')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+# Merchant_Vessel field <- Full_Data column, filled from the first row seen for a vessel
+VESSEL_FIELDS = {
+    'mv_mmsi': 'mmsi',
+    'mv_ship_name': 'ship_name',
+    'mv_ship_type_id': 'ship_type',
+    'mv_call_sign': 'call_sign',
+    'mv_flag': 'flag',
+    'mv_length': 'length',
+    'mv_width': 'width',
+    'mv_grt': 'grt',
+    'mv_dwt': 'dwt',
+    'mv_year_built': 'year_built',
+    'mv_type_name': 'type_name',
+    'mv_ais_type_summary': 'ais_type_summary',
+}
+
+# Trip_Details field <- Full_Data column
+TRIP_DETAIL_FIELDS = {
+    'mtd_longitude': 'longitude',
+    'mtd_latitude': 'latitude',
+    'mtd_speed': 'speed',
+    'mtd_heading': 'heading',
+    'mtd_status': 'status',
+    'mtd_course': 'course',
+    'mtd_timestamp': 'timestamp',
+    'mtd_utc_seconds': 'utc_seconds',
+    'mtd_draught': 'draught',
+    'mtd_rot': 'rot',
+    'mtd_current_port': 'current_port',
+    'mtd_last_port': 'last_port',
+    'mtd_last_port_time': 'last_port_time',
+    'mtd_current_port_id': 'current_port_id',
+    'mtd_current_port_unlocode': 'current_port_unlocode',
+    'mtd_current_port_country': 'current_port_country',
+    'mtd_last_port_id': 'last_port_id',
+    'mtd_last_port_unlocode': 'last_port_unlocode',
+    'mtd_last_port_country': 'last_port_country',
+    'mtd_next_port_id': 'next_port_id',
+    'mtd_next_port_unlocode': 'next_port_unlocode',
+    'mtd_next_port_name': 'next_port_name',
+    'mtd_next_port_country': 'next_port_country',
+    'mtd_eta_calc': 'eta_calc',
+    'mtd_eta_updated': 'eta_updated',
+    'mtd_distance_to_go': 'distance_to_go',
+    'mtd_distance_travelled': 'distance_travelled',
+    'mtd_awg_speed': 'awg_speed',
+    'mtd_max_speed': 'max_speed',
+}
+
+TRIP_COLUMNS = ['id', 'imo', 'ship_id', 'dsrc', 'destination', 'eta']
+FULL_DATA_COLUMNS = list(dict.fromkeys(TRIP_COLUMNS + list(VESSEL_FIELDS.values()) + list(TRIP_DETAIL_FIELDS.values())))
+# Full_Data columns of a detail row in Trip_Details field order (after mtd_key and mtd_mt_key), so rows
+# travel between processes as plain tuples and become instances positionally, both far cheaper than dicts
+DETAIL_COLUMNS = [TRIP_DETAIL_FIELDS[field.attname] for field in Trip_Details._meta.concrete_fields[2:]]
+
+
+def resolve_vessels(records, vessel_keys):
+    """
+    Return the Merchant_Vessel key of every record, creating unknown vessels in bulk.
+    ``vessel_keys`` maps (imo, ship_id) -> mv_key and is reused across batches.
+    """
+    missing = {}
+    for record in records:
+        key = (record['imo'], record['ship_id'])
+        if key not in vessel_keys and key not in missing:
+            missing[key] = record
+
+    if missing:
+        imos = {imo for imo, _ in missing}
+        ship_ids = {ship_id for _, ship_id in missing}
+        existing = (Merchant_Vessel.objects
+                    .filter(mv_imo__in=imos, mv_ship_id__in=ship_ids)
+                    .values_list('mv_imo', 'mv_ship_id', 'mv_key'))
+        for imo, ship_id, mv_key in existing:
+            vessel_keys.setdefault((imo, ship_id), mv_key)
+            missing.pop((imo, ship_id), None)
+
+    # IN (...) does not match NULL identifiers, so those are looked up one by one
+    for imo, ship_id in [key for key in missing if None in key]:
+        vessel = Merchant_Vessel.objects.filter(mv_imo=imo, mv_ship_id=ship_id).values_list('mv_key', flat=True).first()
+        if vessel is not None:
+            vessel_keys[(imo, ship_id)] = vessel
+            del missing[(imo, ship_id)]
+
+    created = Merchant_Vessel.objects.bulk_create([
+        Merchant_Vessel(mv_imo=imo, mv_ship_id=ship_id,
+                        **{field: record[column] for field, column in VESSEL_FIELDS.items()})
+        for (imo, ship_id), record in missing.items()
+    ])
+    for vessel in created:
+        vessel_keys[(vessel.mv_imo, vessel.mv_ship_id)] = vessel.mv_key
+
+    return [vessel_keys[(record['imo'], record['ship_id'])] for record in records], len(created)
+
+
+def run_starts(frame):
+    """
+    Positions (in the sorted frame) where a new run of rows begins. A run is consecutive rows of one
+    vessel reporting the same destination and eta, so no trip boundary can fall inside it.
+    """
+    identity = frame['identity']
+    destination = frame['destination'].fillna('\0')
+    eta = frame['eta']
+
+    same_vessel = identity.eq(identity.shift())
+    same_destination = destination.eq(destination.shift())
+    same_eta = eta.eq(eta.shift()) | (eta.isna() & eta.shift().isna())
+    return np.flatnonzero(~(same_vessel & same_destination & same_eta).to_numpy())
+
+
+def identity_keys(pairs):
+    """
+    Vessel key trips are tracked by for every (imo, mmsi) pair, see ais_identity. Rows without an
+    identity share key 0, as they always shared one (empty) identity here.
+    """
+    return [key or 0 for key in resolver.keys(pairs)]
+
+
+def ongoing_trips(mv_keys):
+    """
+    Latest 'Ongoing' trip of each vessel key, so a batch continues where the last one stopped.
+    Older 'Ongoing' trips of the same key (several vessel rows of one identity, or an interrupted run)
+    could never be continued, so they are closed at their last observation.
+    """
+    trips = list(Merchant_Trip.objects
+                 .filter(mt_mv_key__in=mv_keys, mt_trip_status='Ongoing')
+                 .select_related('mt_mv_key')
+                 .order_by('mt_first_observed_at', 'mt_key'))
+    keys = identity_keys((trip.mt_mv_key.mv_imo, trip.mt_mv_key.mv_mmsi) for trip in trips)
+
+    current = {}
+    superseded = []
+    for key, trip in zip(keys, trips):
+        if key in current:
+            superseded.append(current[key])
+        current[key] = trip
+    for trip in superseded:
+        trip.mt_trip_status = 'Completed'
+        if trip.mt_last_observed_at and trip.mt_first_observed_at:
+            trip.mt_observed_duration = (trip.mt_last_observed_at - trip.mt_first_observed_at).days
+    Merchant_Trip.objects.bulk_update(superseded, ['mt_observed_duration', 'mt_trip_status'])
+    return current
+
+
+def segment_trips(records, mv_keys, current, keys):
+    """
+    Split the records into trips per vessel. A vessel starts a new trip when both its destination
+    and eta differ from the ones the current trip started with (the rule register_trip used).
+    ``keys`` are the records' vessel keys (identity_keys) and ``current`` maps vessel key ->
+    ongoing Merchant_Trip, see ongoing_trips. No database access, so this can run in a worker process.
+    Returns (trips, trip_of_row, order): trips are new or updated Merchant_Trip instances,
+    trip_of_row[i] is the index in trips of the i-th row of ``order``.
+    """
+    frame = pd.DataFrame({
+        'identity': np.asarray(keys, dtype=np.int64),
+        'timestamp': pd.to_datetime([record['timestamp'] for record in records], utc=True),
+        'destination': [record['destination'] for record in records],
+        'eta': pd.to_datetime([record['eta'] for record in records], utc=True),
+    })
+    frame = frame.sort_values(['identity', 'timestamp'], kind='stable')
+    order = frame.index.to_numpy()
+
+    starts = run_starts(frame)
+    ends = np.append(starts[1:], len(order))
+    identities = frame['identity'].to_numpy().tolist()
+
+    trips = []
+    trip_index = {}  # identity -> index in trips of its current trip
+    trip_of_run = np.empty(len(starts), dtype=np.int64)
+    last_seen = {}  # identity -> timestamp of the vessel's previous row
+
+    for run, (start, end) in enumerate(zip(starts, ends)):
+        identity = identities[start]
+        first = records[order[start]]
+
+        if identity not in trip_index and identity in current:
+            trips.append(current[identity])
+            trip_index[identity] = len(trips) - 1
+            last_seen[identity] = current[identity].mt_last_observed_at
+
+        trip = trips[trip_index[identity]] if identity in trip_index else None
+        if trip is not None and first['destination'] != trip.mt_destination and first['eta'] != trip.mt_eta:
+            previous_timestamp = last_seen[identity]
+            trip.mt_last_observed_at = previous_timestamp
+            if previous_timestamp and trip.mt_first_observed_at:
+                trip.mt_observed_duration = (previous_timestamp - trip.mt_first_observed_at).days
+            trip.mt_trip_status = 'Completed'
+            trip = None
+
+        if trip is None:
+            trip = Merchant_Trip(
+                mt_mv_key_id=mv_keys[order[start]],
+                mt_dsrc=first['dsrc'],
+                mt_destination=first['destination'],
+                mt_eta=first['eta'],
+                mt_first_observed_at=first['timestamp'],
+                mt_trip_status='Ongoing'
+            )
+            trips.append(trip)
+            trip_index[identity] = len(trips) - 1
+
+        trip_of_run[run] = trip_index[identity]
+        last_seen[identity] = records[order[end - 1]]['timestamp']
+        if trip.mt_trip_status == 'Ongoing':
+            trip.mt_last_observed_at = last_seen[identity]
+
+    trip_of_row = np.repeat(trip_of_run, ends - starts)
+    return trips, trip_of_row, order
+
+
+def build_partition(records, mv_keys, current, keys):
+    """
+    Segment one partition of a batch and extract its detail rows. Returns (trips, rows, trip_of_row)
+    where rows are DETAIL_COLUMNS tuples and trip_of_row[i] is the index in trips of row i's trip.
+    """
+    trips, trip_of_row, order = segment_trips(records, mv_keys, current, keys)
+    detail_values = itemgetter(*DETAIL_COLUMNS)
+    return trips, [detail_values(records[row]) for row in order], trip_of_row
+
+
+def partition_batch(records, mv_keys, current, keys, partitions):
+    """
+    Split a batch into at most ``partitions`` build_partition arguments. Vessels are assigned by
+    their vessel key, so all rows and the ongoing trip of a vessel land in one partition.
+    """
+    rows = [[] for _ in range(partitions)]
+    for index, key in enumerate(keys):
+        rows[key % partitions].append(index)
+
+    for indexes in filter(None, rows):
+        partition_keys = [keys[index] for index in indexes]
+        vessels = set(partition_keys)
+        yield ([records[index] for index in indexes], [mv_keys[index] for index in indexes],
+               {key: trip for key, trip in current.items() if key in vessels}, partition_keys)
+
+
+def write_partition(trips, rows, trip_of_row, chunk_size=5000):
+    """The single writer: store the trips and trip details built for one partition."""
+    new_trips = [trip for trip in trips if trip.pk is None]
+    continued_trips = [trip for trip in trips if trip.pk is not None]
+    Merchant_Trip.objects.bulk_create(new_trips, batch_size=chunk_size)
+    Merchant_Trip.objects.bulk_update(
+        continued_trips,
+        ['mt_last_observed_at', 'mt_observed_duration', 'mt_trip_status'],
+        batch_size=chunk_size
+    )
+
+    trip_keys = [trip.pk for trip in trips]
+    for start in range(0, len(rows), chunk_size):
+        Trip_Details.objects.bulk_create([
+            Trip_Details(None, trip_keys[trip], *values)
+            for values, trip in zip(rows[start:start + chunk_size], trip_of_row[start:start + chunk_size].tolist())
+        ])
+
+    return {
+        'trips_created': len(new_trips),
+        'trips_completed': sum(trip.mt_trip_status == 'Completed' for trip in trips),
+        'details_created': len(rows),
+    }
+
+
+def register_batch(records, vessel_keys, chunk_size=5000, pool=None, workers=1):
+    """
+    Register the trips of one batch. With a process ``pool`` the batch is split into partitions that
+    are segmented in parallel, and each is written as soon as it is ready while the rest are still
+    being built. The database work all stays in this process.
+    """
+    mv_keys, vessels_created = resolve_vessels(records, vessel_keys)
+    keys = identity_keys((record['imo'], record['mmsi']) for record in records)
+    current = ongoing_trips(set(mv_keys))
+
+    if pool is None:
+        results = [build_partition(records, mv_keys, current, keys)]
+    else:
+        # More partitions than workers, so the writer can start on the first while the rest are built
+        results = pool.map(build_partition, *zip(*partition_batch(records, mv_keys, current, keys, workers * 4)))
+
+    stats = {'vessels_created': vessels_created, 'trips_created': 0, 'trips_completed': 0, 'details_created': 0}
+    for result in results:
+        for key, value in write_partition(*result, chunk_size).items():
+            stats[key] += value
+    return stats
+
+
+def register_trips(batch_size=50000, chunk_size=5000, stdout=None, workers=None):
+    """
+    Register trips for every Full_Data row newer than the stored high-water mark.
+    Each batch is committed together with the new mark, so an interrupted run resumes cleanly.
+    With ``workers`` > 1 (default AIS_TRIP_WORKERS, 1) segmentation runs in a process pool.
+    Raises SyncInProgress when another run is registering trips.
+    """
+    workers = workers or getattr(settings, 'AIS_TRIP_WORKERS', 1)
+    if workers > 1:
+        # Workers only segment, they never touch the database. Forked workers must not inherit an open
+        # connection, and django.setup makes them work under the spawn and forkserver start methods too.
+        if not connection.in_atomic_block:
+            connection.close()
+        with job_lock(TRIP_SYNC), ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            return register_all(batch_size, chunk_size, stdout, pool, workers)
+    with job_lock(TRIP_SYNC):
+        return register_all(batch_size, chunk_size, stdout)
+
+
+def register_all(batch_size, chunk_size, stdout, pool=None, workers=1):
+    ensure_tables([AisSyncState, VesselIdentity])
+    started = time.perf_counter()
+    last_id = AisSyncState.get_mark(TRIP_SYNC)
+    vessel_keys = {}
+    totals = {'rows': 0, 'vessels_created': 0, 'trips_created': 0, 'trips_completed': 0, 'details_created': 0}
+
+    for records in stream_records(FULL_DATA_COLUMNS, chunk_size=batch_size, start_after=last_id):
+        with transaction.atomic():
+            # A run that read the same mark must not register the batch a second time
+            state, _ = AisSyncState.objects.select_for_update().get_or_create(name=TRIP_SYNC)
+            if state.last_id != last_id:
+                raise SyncInProgress(f'{TRIP_SYNC} mark moved to {state.last_id} by another run.')
+            stats = register_batch(records, vessel_keys, chunk_size, pool, workers)
+            last_id = records[-1]['id']
+            AisSyncState.set_mark(TRIP_SYNC, last_id)
+
+        totals['rows'] += len(records)
+        for key, value in stats.items():
+            totals[key] += value
+        if stdout:
+            elapsed = time.perf_counter() - started
+            stdout.write(f"{totals['rows']} rows up to id {last_id} ({totals['rows'] / elapsed:.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - started
+    totals['last_id'] = last_id
+    totals['elapsed_seconds'] = round(elapsed, 3)
+    totals['rows_per_second'] = round(totals['rows'] / elapsed, 1) if elapsed else 0
+    return totals
@@ -3,7 +3,7 @@ from django.conf.urls.static import static
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from . import ais_views, mer_vessel, misrep_views, ais_summary, mer_special_report
+from . import ais_cache, ais_profiling, ais_views, mer_vessel, misrep_views, ais_summary, mer_special_report
 
 router = DefaultRouter(trailing_slash=False)
 router.register(r'merchant', mer_special_report.MerSpecialReportViewSet, basename="merchant")
@@ -26,6 +26,7 @@ urlpatterns = [
     path('register_trip', ais_views.register_trip, name='register_trip'),
     path('merchant_vessel_view/<int:mv_key>', ais_summary.MerchantVesselDataView.as_view(),
          name='merchant_vessel_view'),
+    path('merchant_vessel_tracks/<int:mv_key>', ais_views.vessel_tracks, name='merchant_vessel_tracks'),
     path("mer_duration_at_sea", ais_views.mer_trip_duration),
     path("mer_activity_trend", ais_views.mer_trip_count),
     path("mer_leave_enter", ais_views.mer_leave_enter),
@@ -34,6 +35,8 @@ urlpatterns = [
     path("mer_visual_act_trend", ais_views.mer_visual_act_trend),
     path("mer_visual_harbor", ais_views.mer_visual_harbour),
     path("mer_visual_flag_count", ais_views.mer_visual_flag_count),
+    path("cache_stats", ais_cache.cache_stats),
+    path("profile_stats", ais_profiling.profile_stats),
 
 ]
 
@@ -0,0 +1,77 @@
+import time
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from .ais_trips import VESSEL_FIELDS
+from .models import *
+
+# Static attributes brought up to date from the latest report when refreshing
+REFRESH_FIELDS = ['mv_mmsi', 'mv_ship_name', 'mv_call_sign', 'mv_flag', 'mv_length', 'mv_width', 'mv_grt', 'mv_dwt',
+                  'mv_year_built', 'mv_type_name', 'mv_ais_type_summary']
+
+
+def fetch_rows(ids, chunk_size=5000):
+    """Static vessel columns of the given Full_Data ids, keyed by id."""
+    rows = {}
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        chunk = Full_Data.objects.filter(id__in=ids[start:start + chunk_size]) \
+            .values('id', 'imo', 'ship_id', *VESSEL_FIELDS.values())
+        rows.update((row['id'], row) for row in chunk)
+    return rows
+
+
+@transaction.atomic
+def sync_vessels(refresh=False, chunk_size=5000):
+    """
+    Make mer_vessel contain one row per distinct (imo, ship_id) in fulldata.
+    The distinct set is computed in SQL together with the first and latest report of each vessel.
+    Missing vessels are bulk inserted from their first report, as populate_data did. With ``refresh``,
+    existing vessels whose static attributes changed are updated from their latest report.
+    """
+    started = time.perf_counter()
+
+    identities = (Full_Data.objects
+                  .values('imo', 'ship_id')
+                  .annotate(first_id=Min('id'), last_id=Max('id'))
+                  .order_by())
+    identities = {(row['imo'], row['ship_id']): row for row in identities}
+
+    existing = {}
+    for vessel in Merchant_Vessel.objects.only('mv_key', 'mv_imo', 'mv_ship_id', *REFRESH_FIELDS):
+        existing.setdefault((vessel.mv_imo, vessel.mv_ship_id), vessel)
+
+    missing = [key for key in identities if key not in existing]
+    rows = fetch_rows([identities[key]['first_id'] for key in missing], chunk_size)
+    created = Merchant_Vessel.objects.bulk_create([
+        Merchant_Vessel(mv_imo=imo, mv_ship_id=ship_id, mv_data_source='ais',
+                        **{field: rows[identities[(imo, ship_id)]['first_id']][column]
+                           for field, column in VESSEL_FIELDS.items()})
+        for imo, ship_id in missing
+    ], batch_size=chunk_size)
+
+    updated = []
+    if refresh:
+        known = [key for key in identities if key in existing]
+        rows = fetch_rows([identities[key]['last_id'] for key in known], chunk_size)
+        for key in known:
+            vessel = existing[key]
+            row = rows[identities[key]['last_id']]
+            changed = False
+            for field in REFRESH_FIELDS:
+                value = row[VESSEL_FIELDS[field]]
+                if value is not None and getattr(vessel, field) != value:
+                    setattr(vessel, field, value)
+                    changed = True
+            if changed:
+                updated.append(vessel)
+        Merchant_Vessel.objects.bulk_update(updated, REFRESH_FIELDS, batch_size=chunk_size)
+
+    return {
+        'distinct_vessels': len(identities),
+        'existing': len(identities) - len(missing),
+        'created': len(created),
+        'updated': len(updated),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
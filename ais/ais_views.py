@@ -1,20 +1,33 @@
 import pycountry
 from django.utils.dateparse import parse_date
 
+from .ais_buckets import bucket_items, bucket_periods, count_distinct, fetch_activity, sum_by_bucket
+from .ais_cache import cached_response
+from .ais_density import DEFAULT_RESOLUTION, get_pyramid
+from .ais_port_calls import counts_by_period, known_ports
+from .ais_positions import format_timestamps, latest_positions, simplify_track
+from .ais_params import choice_param, date_param, float_list_param, float_param, int_list_param, int_param
+from .ais_profiling import profiled
+from .ais_rollup import activity, activity_values, day_start, timestamp_range
+from .ais_stays import percentiles, visit_durations
+from .ais_stream import stream_frames
+from .ais_tracks import load_tracks, tracks_json, tracks_npy
+from .ais_trips import SyncInProgress, register_trips
+from .ais_vessels import sync_vessels
 from .models import *
-from django.http import JsonResponse
-from django.db.models import Q, F, ExpressionWrapper, DurationField, Case, When, CharField, Min, Max, Count
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Q, F, ExpressionWrapper, DurationField, Min, Max, Count
+from django.db.models.functions import TruncMonth
 from datetime import datetime, timedelta
 import pandas as pd
-from pytz import timezone
 from rest_framework.decorators import api_view
-from django.db import transaction
-from itertools import groupby
 from dateutil.relativedelta import relativedelta
 from collections import defaultdict
 from collections import Counter
 
 @api_view(http_method_names=['GET'])
+@profiled
 def trip_count(request):
     """
     Returns a distribution like:
@@ -57,6 +70,7 @@ def trip_count(request):
     return JsonResponse(distribution, safe=False)
 
 @api_view(['GET'])
+@profiled
 def vessel_trip_counts(request):
     """
     Returns vessels and their trip counts with optional filters:
@@ -109,6 +123,7 @@ def vessel_trip_counts(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
 def stay_count(request):
     start_date_str = request.GET.get('date_from')
     end_date_str = request.GET.get('date_to')
@@ -117,42 +132,34 @@ def stay_count(request):
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
 
-    ship_data = Full_Data.objects.filter(timestamp__range=[start_date, end_date]).values(
-        'ship_id', 'current_port','timestamp').order_by('timestamp')
+    gap = float_param(request.GET, 'gap', minimum=0)  # hours without a report at the port that end a visit
+    gap = timedelta(hours=gap) if gap is not None else None
 
-    if not ship_data:
-        return JsonResponse({})
+    # Split each ship's presence at the port into visits, streaming the range in timestamp order
+    minutes = visit_durations(start_date, end_date, port, gap)
 
-    ship_df = pd.DataFrame.from_records(ship_data)
-
-    # Combine "KARACHI" and "KARACHI ANCH" into a single category "KARACHI" and same for PORT QASIM AND PORT QASIM ANCH
-    ship_df['current_port'] = ship_df['current_port'].replace(
-        {'KARACHI ANCH': 'KARACHI', 'PORT QASIM ANCH': 'PORT QASIM'})
-
-    # Filter data for provided port only
-    karachi_data = ship_df[ship_df['current_port'] == port]
-
-    # Group data by ship_id
-    grouped_data = karachi_data.groupby('ship_id')
-
-    # Calculate the duration for each group (first and last timestamp)
-    port_durations = grouped_data.agg({'timestamp': ['first', 'last']})
-
-    # Calculate the duration in days
-    port_durations['duration'] = (port_durations['timestamp']['last'] - port_durations['timestamp']['first']).dt.days
-
-    port_durations = port_durations[port_durations['duration'] > 0]
-
-    # Calculate the number of days each ship stayed in Karachi
-    days_counts = port_durations['duration'].value_counts().sort_index()
+    # Number of visits per whole day of duration
+    days_counts = Counter()
+    for duration, visits in minutes.items():
+        days_counts[duration // (24 * 60)] += visits
 
     # Create a dictionary for the JSON response
-    response_data = {f"{days} day{'s' if days > 1 else ''}": count for days, count in days_counts.items()}
+    response_data = {f"{days} day{'s' if days > 1 else ''}": count
+                     for days, count in sorted(days_counts.items()) if days > 0}
+
+    if request.GET.get('stats') == 'true':
+        response_data = {
+            'histogram': response_data,
+            'visits': sum(minutes.values()),
+            'percentiles_hours': percentiles(minutes),
+        }
 
     return JsonResponse(response_data)
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def ship_counts(request):
     start_date_str = request.GET.get('date_from')
     end_date_str = request.GET.get('date_to')
@@ -164,9 +171,8 @@ def ship_counts(request):
         end_date = datetime.now()
         start_date = end_date - timedelta(days=7 * 7)
 
-    # Filter the data based on the specified time period
-    filtered_data = Full_Data.objects.filter(Q(timestamp__range=(start_date, end_date))). \
-        values('ship_id', 'current_port').distinct()
+    # Distinct ships per port for the period, answered from the daily rollup
+    filtered_data = activity(start_date, end_date).values('ship_id', 'current_port').distinct()
 
     # Create a dictionary to count the ports
     port_counts = {
@@ -192,6 +198,8 @@ def ship_counts(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def ship_counts_week(request):
     # Get the start and end dates from the request
     start_date_str = request.GET.get('date_from')
@@ -203,6 +211,14 @@ def ship_counts_week(request):
     # Calculate the number of weeks between start and end dates
     total_weeks = (end_date - start_date).days // 7 + 1
 
+    # One query for the whole range; daily entries are merged into weeks by de-duplicating per week
+    daily = pd.DataFrame.from_records(
+        activity(start_date, start_date + timedelta(weeks=total_weeks) - timedelta(days=1))
+        .values('day', 'ship_id', 'current_port').distinct(),
+        columns=['day', 'ship_id', 'current_port'])
+    daily['week'] = [(day - start_date.date()).days // 7 for day in daily['day']]
+    weekly = daily.drop_duplicates(subset=['week', 'ship_id', 'current_port'])
+
     # Create a list of dictionaries to store counts for each week
     weekly_counts = []
 
@@ -211,11 +227,6 @@ def ship_counts_week(request):
         week_start = start_date + timedelta(weeks=week)
         week_end = week_start + timedelta(days=6)
 
-        # Filter the data for the current week
-        filtered_data = Full_Data.objects.filter(
-            Q(timestamp__range=(week_start, week_end))
-        ).values('ship_id', 'current_port').distinct()
-
         # Create a dictionary to count the ports
         port_counts = {
             "KARACHI": 0,
@@ -224,8 +235,7 @@ def ship_counts_week(request):
             "CROSSING": 0,
         }
 
-        for item in filtered_data:
-            current_port = item['current_port']
+        for current_port in weekly.loc[weekly['week'] == week, 'current_port']:
             if current_port in ['KARACHI', 'KARACHI ANCH']:
                 port_counts['KARACHI'] += 1
             elif current_port in ['PORT QASIM', 'PORT QASIM ANCH']:
@@ -250,75 +260,105 @@ def ship_counts_week(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
 def vessel_position(request):
     ship_id = request.GET.get('ship_id')
 
     if ship_id:
-        ship_positions = Full_Data.objects.filter(ship_id=ship_id).order_by('-timestamp').values(
-            'timestamp',
-            'latitude',
-            'longitude'
-        )
+        date_from = date_param(request.GET, 'date_from')
+        date_to = date_param(request.GET, 'date_to')
+        # Most recent reports only; without a limit the track is capped so it never reads a ship's whole history
+        limit = int_param(request.GET, 'limit', getattr(settings, 'AIS_TRACK_MAX_ROWS', 50000), minimum=1)
+        max_points = int_param(request.GET, 'max_points', getattr(settings, 'AIS_TRACK_MAX_POINTS', 5000), minimum=2)
+        # metres a dropped point may deviate from the track
+        tolerance = float_param(request.GET, 'tolerance', 0.0, minimum=0)
+        # 'dp' (Douglas-Peucker) or 'time' (time buckets)
+        method = choice_param(request.GET, 'simplify', ('dp', 'time'), 'dp')
+
+        ship_positions = Full_Data.objects.filter(ship_id=ship_id, timestamp__isnull=False,
+                                                  latitude__isnull=False, longitude__isnull=False)
+        if date_from:
+            ship_positions = ship_positions.filter(timestamp__gte=day_start(date_from))
+        if date_to:
+            ship_positions = ship_positions.filter(timestamp__lt=day_start(date_to + timedelta(days=1)))
+        ship_positions = ship_positions.order_by('-timestamp').values_list('timestamp', 'latitude', 'longitude')
+        ship_positions = ship_positions[:limit]
+
+        # Oldest first for simplification, then back to the newest-first order of the response
+        rows = list(ship_positions)[::-1]
+        timestamps = [row[0] for row in rows]
+        latitudes = [row[1] for row in rows]
+        longitudes = [row[2] for row in rows]
+        if len(timestamps) > max_points or tolerance:
+            keep = simplify_track(timestamps, latitudes, longitudes, max_points, tolerance, method)
+            timestamps = [timestamps[index] for index in keep]
+            latitudes = [latitudes[index] for index in keep]
+            longitudes = [longitudes[index] for index in keep]
 
         response_data = [
             {
-                'timestamp': position['timestamp'].astimezone(timezone('Asia/Karachi')).strftime(
-                    '%Y-%m-%d %H:%M:%S.%f %z'),
-                'latitude': position['latitude'],
-                'longitude': position['longitude']
+                'timestamp': timestamp,
+                'latitude': latitude,
+                'longitude': longitude
             }
-            for position in ship_positions
+            for timestamp, latitude, longitude in zip(format_timestamps(timestamps[::-1]), latitudes[::-1],
+                                                      longitudes[::-1])
         ]
     else:
-        latest_positions = Full_Data.objects.order_by('ship_id', '-timestamp').distinct('ship_id').values(
-            'ship_id',
-            'latitude',
-            'longitude',
-            'timestamp'
-        )
+        bbox = float_list_param(request.GET, 'bbox', 4)  # min_lon,min_lat,max_lon,max_lat
+        max_age = float_param(request.GET, 'max_age', minimum=0)  # hours since the ship was last seen
+
+        # Read the maintained last-known-position table instead of scanning every report
+        latest = latest_positions(bbox=bbox, max_age=timedelta(hours=max_age) if max_age else None)
+        latest_positions_data = latest.values('ship_id', 'latitude', 'longitude', 'timestamp')
 
         response_data = [
             {
                 'ship_id': position['ship_id'],
                 'latitude': position['latitude'],
                 'longitude': position['longitude'],
-                'timestamp': position['timestamp'].astimezone(timezone('Asia/Karachi')).strftime(
-                    '%Y-%m-%d %H:%M:%S.%f %z')
+                'timestamp': timestamp
             }
-            for position in latest_positions
+            for position, timestamp in zip(latest_positions_data,
+                                           format_timestamps([position['timestamp'] for position in latest_positions_data]))
         ]
 
     return JsonResponse(response_data, safe=False)
 
 
+@api_view(http_method_names=['GET'])
+@profiled
+def vessel_tracks(request, mv_key):
+    """
+    Columnar trip tracks of a vessel: parallel lon/lat/speed/course/timestamp arrays with per-trip offsets.
+    ?delta=true delta-encodes coordinates and timestamps, ?output=npy returns a structured NumPy array,
+    ?trips=1,2 limits the output to those trips.
+    """
+    trips = int_list_param(request.GET, 'trips')
+    delta = request.GET.get('delta') == 'true'
+    columns = load_tracks(mv_key, trips)
+
+    if request.GET.get('output') == 'npy':
+        response = HttpResponse(tracks_npy(columns, delta), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="vessel_{mv_key}_tracks.npy"'
+        return response
+
+    return JsonResponse(tracks_json(mv_key, columns, delta))
+
+
 @api_view(http_method_names=['POST'])
+@profiled
 def populate_data(request):
-    full_data_records = Full_Data.objects.all().order_by('timestamp')
-
-    for row in full_data_records:
-        Merchant_Vessel.objects.get_or_create(
-            mv_imo=row.imo,
-            mv_ship_id=row.ship_id,
-            defaults={
-                'mv_mmsi': row.mmsi,
-                'mv_ship_name': row.ship_name,
-                'mv_ship_type': row.ship_type,
-                'mv_flag': row.flag,
-                'mv_length': row.length,
-                'mv_width': row.width,
-                'mv_grt': row.grt,
-                'mv_dwt': row.dwt,
-                'mv_year_built': row.year_built,
-                'mv_type_name': row.type_name,
-                'mv_ais_type_summary': row.ais_type_summary,
-                'mv_data_source': 'ais'
-            }
-        )
+    refresh = str(request.data.get('refresh', request.GET.get('refresh', ''))).lower() in ('1', 'true', 'yes')
+    stats = sync_vessels(refresh=refresh)
     return JsonResponse(
-        {"message": "All unique ships from Full_Data has been successfully uploaded in merchant_vessel."}, status=200)
+        {"message": "All unique ships from Full_Data has been successfully uploaded in merchant_vessel.", **stats},
+        status=200)
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def flag_counts(request):
     start_date_str = request.GET.get('date_from')
     end_date_str = request.GET.get('date_to')
@@ -327,17 +367,16 @@ def flag_counts(request):
     date_from = datetime.strptime(start_date_str, '%Y-%m-%d')
     date_to = datetime.strptime(end_date_str, '%Y-%m-%d')
 
-    all_ships = Full_Data.objects.filter(timestamp__range=(date_from, date_to))
-    ship_data = list(all_ships.values())
-    ship_df = pd.DataFrame.from_records(ship_data)
-    ship_df['current_port'] = ship_df['current_port'].replace(
-        {'KARACHI ANCH': 'KARACHI', 'PORT QASIM ANCH': 'PORT QASIM'})
-    if port:
-        ship_df = ship_df[ship_df['current_port'] == port]
-
+    # Stream only the needed columns; the last flag reported per ship wins, as before
     unique_ships = {}
-    for ship in ship_df.itertuples():
-        unique_ships[ship.ship_id] = ship.flag
+    for ship_df in stream_frames(['ship_id', 'flag', 'current_port'],
+                                 filters=timestamp_range(day_start(date_from), day_start(date_to))):
+        ship_df['current_port'] = ship_df['current_port'].replace(
+            {'KARACHI ANCH': 'KARACHI', 'PORT QASIM ANCH': 'PORT QASIM'})
+        if port:
+            ship_df = ship_df[ship_df['current_port'] == port]
+        last_flags = ship_df.drop_duplicates(subset='ship_id', keep='last')
+        unique_ships.update(zip(last_flags['ship_id'], last_flags['flag']))
 
     flag_count = {}
     for flag in unique_ships.values():
@@ -347,6 +386,8 @@ def flag_counts(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def type_counts(request):
     start_date_str = request.GET.get('date_from')
     end_date_str = request.GET.get('date_to')
@@ -355,177 +396,52 @@ def type_counts(request):
     date_from = datetime.strptime(start_date_str, '%Y-%m-%d')
     date_to = datetime.strptime(end_date_str, '%Y-%m-%d')
 
-    all_ships = Full_Data.objects.filter(timestamp__range=(date_from, date_to))
+    ship_filter = timestamp_range(day_start(date_from), day_start(date_to))
     if port:
-        all_ships = all_ships.filter(current_port=port)
+        ship_filter &= Q(current_port=port)
+
+    # Stream only the needed columns; the first type reported per ship wins, as before
+    unique_ships = {}
+    for ship_df in stream_frames(['ship_id', 'ais_type_summary'], filters=ship_filter):
+        first_types = ship_df.drop_duplicates(subset='ship_id')
+        for ship_id, ais_type in zip(first_types['ship_id'], first_types['ais_type_summary']):
+            unique_ships.setdefault(ship_id, ais_type)
 
-    ship_data = list(all_ships.values())
-    ship_df = pd.DataFrame.from_records(ship_data)
-    ship_df['current_port'] = ship_df['current_port'].replace(
-        {'KARACHI ANCH': 'KARACHI', 'PORT QASIM ANCH': 'PORT QASIM'})
-    unique_ships = ship_df.drop_duplicates(subset='ship_id')
-    type_count = unique_ships.groupby('ais_type_summary')['ship_id'].count().to_dict()
+    type_count = dict(Counter(ais_type for ais_type in unique_ships.values() if pd.notna(ais_type)))
 
     return JsonResponse(type_count)
 
 
-@transaction.atomic
 def register_trip(request):
-    data_records = Full_Data.objects.all().order_by('imo', 'mmsi', 'timestamp')
-    # Group records by IMO or MMSI based on the condition
-    records_by_identifier = {}
-    for is_imo_zero, group in groupby(data_records, key=lambda x: x.imo == '0'):
-        identifier = 'mmsi' if is_imo_zero else 'imo'
-        records_by_identifier[identifier] = list(group)
-
-    for identifier, records in records_by_identifier.items():
-        # Initialize a dictionary to keep track of ongoing trips for each vessel
-        ongoing_trips = {}
-        previous_timestamp = None
-
-        for row in records:
-            # Determine the identifier value (either MMSI or IMO)
-            identifier_value = row.mmsi if identifier == 'mmsi' else row.imo
-            # Register vessel data if not already registered
-            vessel, created = Merchant_Vessel.objects.get_or_create(
-                mv_imo=row.imo,
-                mv_ship_id=row.ship_id,
-                defaults={
-                    'mv_mmsi': row.mmsi,
-                    'mv_ship_name': row.ship_name,
-                    'mv_ship_type': row.ship_type,
-                    'mv_call_sign': row.call_sign,
-                    'mv_flag': row.flag,
-                    'mv_length': row.length,
-                    'mv_width': row.width,
-                    'mv_grt': row.grt,
-                    'mv_dwt': row.dwt,
-                    'mv_year_built': row.year_built,
-                    'mv_type_name': row.type_name,
-                    'mv_ais_type_summary': row.ais_type_summary
-                }
-            )
-            timestamp = row.timestamp
-            if identifier_value in ongoing_trips:
-                trip = ongoing_trips[identifier_value]
-                if row.destination != trip.mt_destination and row.eta != trip.mt_eta:
-                    trip.mt_last_observed_at = previous_timestamp
-                    trip.mt_observed_duration = (previous_timestamp - trip.mt_first_observed_at).days
-                    trip.mt_trip_status = 'Completed'
-                    trip.save()
-                    trip = Merchant_Trip.objects.create(
-                        mt_mv_key=vessel,
-                        mt_dsrc=row.dsrc,
-                        mt_destination=row.destination,
-                        mt_eta=row.eta,
-                        mt_first_observed_at=timestamp,
-                        mt_trip_status='Ongoing'
-                    )
-                    ongoing_trips[identifier_value] = trip
-                # Create or update TripDetail for ongoing trip
-                Trip_Details.objects.create(
-                    mtd_mt_key=trip,
-                    mtd_longitude=row.longitude,
-                    mtd_latitude=row.latitude,
-                    mtd_speed=row.speed,
-                    mtd_heading=row.heading,
-                    mtd_status=row.status,
-                    mtd_course=row.course,
-                    mtd_timestamp=timestamp,
-                    mtd_utc_seconds=row.utc_seconds,
-                    mtd_draught=row.draught,
-                    mtd_rot=row.rot,
-                    mtd_current_port=row.current_port,
-                    mtd_last_port=row.last_port,
-                    mtd_last_port_time=row.last_port_time,
-                    mtd_current_port_id=row.current_port_id,
-                    mtd_current_port_unlocode=row.current_port_unlocode,
-                    mtd_current_port_country=row.current_port_country,
-                    mtd_last_port_id=row.last_port_id,
-                    mtd_last_port_unlocode=row.last_port_unlocode,
-                    mtd_last_port_country=row.last_port_country,
-                    mtd_next_port_id=row.next_port_id,
-                    mtd_next_port_unlocode=row.next_port_unlocode,
-                    mtd_next_port_name=row.next_port_name,
-                    mtd_next_port_country=row.next_port_country,
-                    mtd_eta_calc=row.eta_calc,
-                    mtd_eta_updated=row.eta_updated,
-                    mtd_distance_to_go=row.distance_to_go,
-                    mtd_distance_travelled=row.distance_travelled,
-                    mtd_awg_speed=row.awg_speed,
-                    mtd_max_speed=row.max_speed
-                )
-            else:
-                # Create a new trip and TripDetail
-                trip = Merchant_Trip.objects.create(
-                    mt_mv_key=vessel,
-                    mt_dsrc=row.dsrc,
-                    mt_destination=row.destination,
-                    mt_eta=row.eta,
-                    mt_first_observed_at=timestamp,
-                    mt_trip_status='Ongoing'
-                )
-                ongoing_trips[identifier_value] = trip
-
-                Trip_Details.objects.create(
-                    mtd_mt_key=trip,
-                    mtd_longitude=row.longitude,
-                    mtd_latitude=row.latitude,
-                    mtd_speed=row.speed,
-                    mtd_heading=row.heading,
-                    mtd_status=row.status,
-                    mtd_course=row.course,
-                    mtd_timestamp=timestamp,
-                    mtd_utc_seconds=row.utc_seconds,
-                    mtd_draught=row.draught,
-                    mtd_rot=row.rot,
-                    mtd_current_port=row.current_port,
-                    mtd_last_port=row.last_port,
-                    mtd_last_port_time=row.last_port_time,
-                    mtd_current_port_id=row.current_port_id,
-                    mtd_current_port_unlocode=row.current_port_unlocode,
-                    mtd_current_port_country=row.current_port_country,
-                    mtd_last_port_id=row.last_port_id,
-                    mtd_last_port_unlocode=row.last_port_unlocode,
-                    mtd_last_port_country=row.last_port_country,
-                    mtd_next_port_id=row.next_port_id,
-                    mtd_next_port_unlocode=row.next_port_unlocode,
-                    mtd_next_port_name=row.next_port_name,
-                    mtd_next_port_country=row.next_port_country,
-                    mtd_eta_calc=row.eta_calc,
-                    mtd_eta_updated=row.eta_updated,
-                    mtd_distance_to_go=row.distance_to_go,
-                    mtd_distance_travelled=row.distance_travelled,
-                    mtd_awg_speed=row.awg_speed,
-                    mtd_max_speed=row.max_speed
-                )
-            previous_timestamp = timestamp
-
-    return JsonResponse({"message": "Data registration complete"}, status=200)
+    # Only rows newer than the stored high-water mark are processed, see ais_trips.register_trips
+    try:
+        stats = register_trips()
+    except SyncInProgress as error:
+        return JsonResponse({"error": str(error)}, status=409)
+    return JsonResponse({"message": "Data registration complete", **stats}, status=200)
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def mer_trip_duration(request):
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
-
-    data = Full_Data.objects.filter(timestamp__range=[date_from, date_to])
+    date_from = datetime.strptime(request.GET.get('date_from'), '%Y-%m-%d').date()
+    date_to = datetime.strptime(request.GET.get('date_to'), '%Y-%m-%d').date()
 
-    # Step 2: Handle the case where IMO is 0 by using MMSI
-    data = data.annotate(unique_id=F('imo')).annotate(unique_id=Case(When(unique_id='0', then=F('mmsi')),
-                                                                     default=F('unique_id'), output_field=CharField()))
-    # Step 3: Calculate the duration each ship has spent at sea
-    data = data.values('unique_id').annotate(
-        min_timestamp=Min('timestamp'),
-        max_timestamp=Max('timestamp')
-    ).annotate(duration=ExpressionWrapper(F('max_timestamp') - F('min_timestamp'), output_field=DurationField()))
+    # Step 2: Time each vessel was seen from the start of date_from up to the start of date_to, per
+    # vessel key (the MMSI identifies imo '0' vessels), from the daily rollup's first and last reports
+    data = (activity(date_from, date_to - timedelta(days=1))
+            .values('vessel_key')
+            .annotate(min_timestamp=Min('first_seen'), max_timestamp=Max('last_seen'))
+            .annotate(duration=ExpressionWrapper(F('max_timestamp') - F('min_timestamp'),
+                                                 output_field=DurationField())))
 
-    # Step 4: Categorize these durations
+    # Step 3: Categorize these durations
     less_than_15_days = data.filter(duration__lt=timedelta(days=15)).count()
     between_15_and_30_days = data.filter(duration__gte=timedelta(days=15), duration__lte=timedelta(days=30)).count()
     greater_than_30_days = data.filter(duration__gt=timedelta(days=30)).count()
 
-    # Step 5: Return the counts
+    # Step 4: Return the counts
     response_data = {
         "less than 15 days": less_than_15_days,
         "between 15 and 30 days": between_15_and_30_days,
@@ -536,6 +452,8 @@ def mer_trip_duration(request):
 
 
 @api_view(['GET'])
+@profiled
+@cached_response
 def mer_trip_count(request):
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
@@ -554,7 +472,21 @@ def mer_trip_count(request):
     else:
         increment = timedelta(days=1)
 
-    trips = Full_Data.objects.filter(timestamp__range=(date_from, date_to))
+    # One grouped query for the whole range: distinct vessel keys per (day or month, port)
+    bucket = TruncMonth('day') if grouping_level == 'month' else F('day')
+    counts = (activity(date_from, date_to)
+              .annotate(bucket=bucket)
+              .values('bucket', 'current_port')
+              .annotate(count=Count('vessel_key', distinct=True))
+              .order_by())
+
+    bucket_counts = defaultdict(list)
+    for count in counts:
+        bucket_counts[count['bucket']].append((count['current_port'], count['count']))
+
+    # The list of ports does not depend on the bucket, so it is fetched once
+    all_possible_locations = list(activity_values('current_port'))
+
     current_date = date_from
     while current_date <= date_to:
         year = current_date.year
@@ -564,28 +496,14 @@ def mer_trip_count(request):
         item = {'Year': year, 'Month': datetime.strftime(current_date, '%B')}
         if grouping_level == 'day':
             item['Date'] = day
-
-        if grouping_level == 'month':
-            filtered_trips = trips.filter(timestamp__year=year, timestamp__month=month)
+            key = current_date.date()
         else:
-            filtered_trips = trips.filter(timestamp__date=current_date)
-
-        # Annotate and count based on unique ship identification
-        counts = (filtered_trips
-                  .annotate(unique_ship=Case(
-            When(imo=0, then=F('mmsi')),
-            default=F('imo'),
-            output_field=CharField()))
-                  .values('current_port', 'unique_ship')
-                  .distinct()
-                  .values('current_port')
-                  .annotate(count=Count('unique_ship'))
-                  .order_by('current_port'))
-
-        for count in counts:
-            item[count['current_port']] = count['count']
-
-        all_possible_locations = Full_Data.objects.values_list('current_port', flat=True).distinct()
+            key = current_date.date().replace(day=1)
+
+        # Ports in the same order the per-bucket query returned them (by name, NULL last)
+        for port, count in sorted(bucket_counts[key], key=lambda entry: (entry[0] is None, entry[0] or '')):
+            item[port] = count
+
         for location in all_possible_locations:
             if location not in item:
                 item[location] = 0
@@ -597,6 +515,8 @@ def mer_trip_count(request):
 
 
 @api_view(['GET'])
+@profiled
+@cached_response
 def mer_leave_enter(request):
     date_from_str = request.GET.get('date_from')
     date_to_str = request.GET.get('date_to')
@@ -608,48 +528,46 @@ def mer_leave_enter(request):
 
     # Calculate the duration between date_from and date_to
     duration = (date_to - date_from).days
+    kind = 'day' if duration < 90 else 'month'
 
     # Set the initial date
     current_date = date_from
 
     data = []
 
+    # Distinct vessels arriving at / departing from ports per period, from the port-call table
+    if boat_location:
+        arrivals = counts_by_period('arrival', date_from, date_to, kind, distinct='imo',
+                                    filters={'port': boat_location})
+        departures = counts_by_period('departure', date_from, date_to, kind, distinct='imo',
+                                      filters={'port': boat_location})
+        total_arrivals = counts_by_period('arrival', date_from, date_to, kind, distinct='imo')
+        total_departures = counts_by_period('departure', date_from, date_to, kind, distinct='imo')
+
     # Initialize date labels and counters
     while current_date <= date_to:
         if duration < 90:
             next_date = current_date + timedelta(days=1)
             date_range_label = current_date.strftime("%d-%B-%Y")
+            period = (current_date.date(),)
         else:
             next_date = current_date.replace(month=current_date.month % 12 + 1,
                                              day=1) if current_date.month < 12 else current_date.replace(
                 year=current_date.year + 1, month=1, day=1)
             date_range_label = current_date.strftime("%B %Y")
+            period = (current_date.date().replace(day=1),)
 
-        # Filter for the specific date range
-        date_filter = Q(timestamp__gte=current_date) & Q(timestamp__lt=next_date)
-
-        # Filter records for the date range and optionally by boat location
         if boat_location:
-            arrivals = Full_Data.objects.filter(date_filter, current_port=boat_location).distinct('imo')
-            departures = Full_Data.objects.filter(date_filter, last_port=boat_location).distinct('imo')
             data.append({
                 "date": date_range_label,
-                "arrivals": arrivals.count(),
-                "departures": -1 * departures.count()
+                "arrivals": arrivals.get(period, 0),
+                "departures": -1 * departures.get(period, 0)
             })
 
-            total_arrivals = Full_Data.objects.filter(date_filter).aggregate(
-                total=Count('imo', distinct=True, filter=Q(current_port__isnull=False) & ~Q(current_port=''))
-            )['total'] or 0
-
-            total_departures = Full_Data.objects.filter(date_filter).aggregate(
-                total=Count('imo', distinct=True, filter=Q(last_port__isnull=False) & ~Q(last_port=''))
-            )['total'] or 0
-
             data.append({
                 "date": date_range_label,
-                "arrivals": total_arrivals,
-                "departures": -1 * total_departures
+                "arrivals": total_arrivals.get(period, 0),
+                "departures": -1 * total_departures.get(period, 0)
             })
 
         current_date = next_date
@@ -658,6 +576,8 @@ def mer_leave_enter(request):
 
 
 @api_view(['GET'])
+@profiled
+@cached_response
 def mer_mv_leave_enter(request):
     date_from_str = request.GET.get('date_from')
     date_to_str = request.GET.get('date_to')
@@ -675,51 +595,32 @@ def mer_mv_leave_enter(request):
 
     data = []
 
-    # Get a distinct list of ports based on current_port
-    port_list = list(
-        Full_Data.objects.exclude(current_port__isnull=True).exclude(current_port='').values_list('current_port',
-                                                                                                  flat=True).distinct())
+    # Ports vessels called at, with anchorages merged into their port
+    port_list = known_ports()
+
+    # Distinct vessels arriving at / departing from each port per period, from the port-call table
+    kind = 'day' if duration < 90 else 'month'
+    filters = {'port': boat_location} if boat_location else None
+    arrivals = counts_by_period('arrival', date_from, date_to, kind, ['port'], distinct='imo', filters=filters)
+    departures = counts_by_period('departure', date_from, date_to, kind, ['port'], distinct='imo', filters=filters)
 
     # Initialize date labels and counters
     while current_date <= date_to:
         if duration < 90:
             next_date = current_date + timedelta(days=1)
             date_range_label = current_date.strftime("%d-%B-%Y")
+            period = current_date.date()
         else:
             next_date = current_date.replace(month=current_date.month % 12 + 1,
                                              day=1) if current_date.month < 12 else current_date.replace(
                 year=current_date.year + 1, month=1, day=1)
             date_range_label = current_date.strftime("%B %Y")
-
-        # Filter for the specific date range
-        date_filter = Q(timestamp__gte=current_date) & Q(timestamp__lt=next_date)
-        ports_data = {port: {"arrivals": 0, "departures": 0} for port in port_list}
-
-        # Filter records for the date range and optionally by boat location
-        if boat_location:
-            arrivals = Full_Data.objects.filter(date_filter, current_port=boat_location).values(
-                'current_port').annotate(
-                imo_count=Count('imo', distinct=True))
-            departures = Full_Data.objects.filter(date_filter, last_port=boat_location).values('last_port').annotate(
-                imo_count=Count('imo', distinct=True))
-
-        else:
-            # Query arrivals and departures
-            arrivals = Full_Data.objects.filter(date_filter).values('current_port').annotate(
-                imo_count=Count('imo', distinct=True))
-            departures = Full_Data.objects.filter(date_filter).values('last_port').annotate(
-                imo_count=Count('imo', distinct=True))
+            period = current_date.date().replace(day=1)
 
         # Fill in arrivals and departures counts
-        for arrival in arrivals:
-            port = arrival['current_port']
-            if port in ports_data:
-                ports_data[port]['arrivals'] = arrival['imo_count']
-
-        for departure in departures:
-            port = departure['last_port']
-            if port in ports_data:
-                ports_data[port]['departures'] = departure['imo_count']
+        ports_data = {port: {"arrivals": arrivals.get((period, port), 0),
+                             "departures": departures.get((period, port), 0)}
+                      for port in port_list}
 
         data.append({
             "date": date_range_label,
@@ -732,32 +633,23 @@ def mer_mv_leave_enter(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def mer_fv_con(request):
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
+    # grid size in degrees; 0.001 (about 100 m) is finer than any AIS position is worth
+    resolution = float_param(request.GET, 'resolution', DEFAULT_RESOLUTION, minimum=0.001)
+    zoom = int_param(request.GET, 'zoom')  # precomputed level, overrides resolution
+    bbox = float_list_param(request.GET, 'bbox', 4)  # min_lon,min_lat,max_lon,max_lat
 
-    # Filter data based on date range
-    if date_from and date_to:
-        data_query = Full_Data.objects.filter(timestamp__gte=date_from, timestamp__lte=date_to)
-    else:
-        data_query = Full_Data.objects.all()
+    if not (date_from and date_to):
+        date_from = date_to = None
 
-    # Get the latest entry for each unique IMO
-    latest_entries = data_query.values('imo').annotate(max_id=Max('id'))
-    latest_data = Full_Data.objects.filter(id__in=[entry['max_id'] for entry in latest_entries])
-
-    # Extract coordinates for the heatmap
-    coordinates = [(data.latitude, data.longitude) for data in latest_data if
-                   data.latitude is not None and data.longitude is not None]
-
-    # Calculate density using a grid approach
-    grid_size = 0.1  # Adjust grid size for resolution
-    density_map = defaultdict(int)
-
-    for lat, lon in coordinates:
-        lat_grid = round(lat / grid_size) * grid_size
-        lon_grid = round(lon / grid_size) * grid_size
-        density_map[(lat_grid, lon_grid)] += 1
+    # Density of the latest position of each unique IMO, from the range's precomputed grids
+    pyramid = get_pyramid(date_from, date_to)
+    cells, resolution = pyramid.cells(resolution, zoom, bbox)
+    density_map = {(lat * resolution, lon * resolution): density for lat, lon, density in cells.tolist()}
 
     # Convert to the specified JSON format
     heatmap_data = []
@@ -779,140 +671,62 @@ def mer_fv_con(request):
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def mer_visual_act_trend(request):
     date_from = datetime.strptime(request.GET.get('date_from'), '%Y-%m-%d').date()
     date_to = datetime.strptime(request.GET.get('date_to'), '%Y-%m-%d').date()
 
-    filter = request.GET.get('filter')  # 'harbor and type', 'harbor' or 'type'
+    filter = request.GET.get('filter')  # 'harbor and type', 'harbor', 'type' or 'all'
     harbor = request.GET.get('harbor')
     type = request.GET.get('type')
     grouping_level = request.GET.get('group_by')
 
-    if type:
-        type_list = type.split(',')
-
-    all_possible_types = Full_Data.objects.exclude(ais_type_summary='').values_list('ais_type_summary',
-                                                                                    flat=True).distinct()
+    type_list = type.split(',') if type and filter in ('harbor and type', 'type') else None
     all_possible_locations = ['KARACHI', 'PORT QASIM', 'GWADAR']
-    response_data = []
-
-    current_date = date_from
-    while current_date <= date_to:
-        year = current_date.year
-        month = current_date.strftime('%B')
-        filter_start = current_date
-        week_end = current_date + timedelta(days=6)
-
-        if grouping_level == 'day':
-            item = {'Year': year, 'Month': month, 'Date': current_date.day}
-            filter_end = current_date
-        elif grouping_level == 'week':
-            if week_end > date_to:
-                week_end = date_to
-            item = {
-                'Year': year,
-                'Week_Start': current_date.strftime('%d-%m-%Y'),
-                'Week_End': week_end.strftime('%d-%m-%Y')
-            }
-            filter_end = week_end
-            if filter_end > date_to:
-                filter_end = date_to
-
-        else:  # month
-            start_of_next_month = (current_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-            if start_of_next_month > date_to:
-                filter_end = date_to
-            else:
-                filter_end = start_of_next_month - timedelta(days=1)
-            item = {'Year': year, 'Month': month}
-
-        filtered_trips = Full_Data.objects.filter(timestamp__date__range=(filter_start, filter_end))
-
+    if harbor and filter in ('harbor and type', 'harbor'):
+        all_possible_locations = [harbor]
+    all_possible_types = type_list
+    if filter in ('harbor and type', 'type') and not type_list:
+        all_possible_types = list(activity_values('ais_type_summary').exclude(ais_type_summary=''))
+
+    periods = bucket_periods(date_from, date_to, grouping_level)
+    response_data = bucket_items(periods, grouping_level)
+
+    # Distinct vessels per bucket and port and/or type, from one fetch of the range's rollup rows.
+    # 'type' and 'all' count a vessel once per port it was seen at.
+    groupings = {
+        'harbor and type': (['current_port', 'ais_type_summary'], ['imo', 'ship_id']),
+        'harbor': (['current_port'], ['imo', 'ship_id']),
+        'type': (['ais_type_summary'], ['imo', 'ship_id', 'current_port']),
+        'all': ([], ['imo', 'ship_id', 'current_port']),
+    }
+    if filter not in groupings:
+        return JsonResponse(response_data, safe=False)
+    filters = {'current_port__in': all_possible_locations}
+    if type_list:
+        filters['ais_type_summary__in'] = type_list
+    dimensions, distinct = groupings[filter]
+    rows = fetch_activity(date_from, date_to, ['imo', 'ship_id', 'current_port', 'ais_type_summary'], filters)
+    counts = count_distinct(rows, periods, dimensions, distinct)
+
+    for item, bucket in zip(response_data, counts):
         if filter == 'harbor and type':
-
-            count = (filtered_trips.values('imo', 'ship_id', 'current_port', 'ais_type_summary').distinct())
-            if harbor:
-                count = count.filter(current_port=harbor)
-                all_possible_locations = [harbor]
-
-            if type:
-                count = count.filter(ais_type_summary__in=type_list)
-                all_possible_types = type_list
-
-            for location in all_possible_locations:
-                if location not in item:
-                    item[location] = {}
-                    for t in all_possible_types:
-                        item[location][t] = 0
-
-                # Count distinct entries and update the item
-            for counts in count:
-                port = counts['current_port']
-                ais_type = counts['ais_type_summary']
-                if port in item and ais_type in item[port]:
-                    item[port][ais_type] += 1  # Increment the count for the port and type
-
-                # Ensure all possible locations and types are included in item
             for location in all_possible_locations:
-                if location not in item:
-                    item[location] = {}
-                    for t in all_possible_types:
-                        item[location][t] = 0
-
+                item[location] = {t: bucket[(location, t)] for t in all_possible_types}
         elif filter == 'harbor':
-
-            count = (filtered_trips.values('imo', 'ship_id', 'current_port').distinct())
-            if harbor:
-                count = count.filter(current_port=harbor)
-                all_possible_locations = [harbor]
-
-            port_counts = {location: 0 for location in all_possible_locations}
-
-            for count_item in count:
-                port = count_item['current_port']
-                if port in port_counts:
-                    port_counts[port] += 1
-            item.update(port_counts)
-
-            for location in all_possible_locations:
-                if location not in item:
-                    item[location] = 0
-
+            item.update({location: bucket[(location,)] for location in all_possible_locations})
         elif filter == 'type':
-            count = (
-                filtered_trips.filter(current_port__in=all_possible_locations).values('imo', 'ship_id', 'current_port',
-                                                                                      'ais_type_summary').distinct())
-            if type:
-                count = count.filter(ais_type_summary__in=type_list)
-                all_possible_types = type_list
-
-            type_counts = {types: 0 for types in all_possible_types}
-            for count_item in count:
-                port = count_item['ais_type_summary']
-                if port in type_counts:
-                    type_counts[port] += 1
-            item.update(type_counts)
-
-            for types in all_possible_types:
-                if types not in item:
-                    item[types] = 0
-
-        elif filter == 'all':
-            count = (
-                filtered_trips.filter(current_port__in=all_possible_locations).values('imo', 'ship_id', 'current_port').distinct())
-            total_count = 0
-            for count_item in count:
-                port = count_item['current_port']
-                if port in all_possible_locations:
-                    total_count += 1
-            item['total_count'] = total_count
-        response_data.append(item)
-        current_date = filter_end + timedelta(days=1)
+            item.update({types: bucket[(types,)] for types in all_possible_types})
+        else:
+            item['total_count'] = bucket[()]
 
     return JsonResponse(response_data, safe=False)
 
 
 @api_view(http_method_names=['GET'])
+@profiled
+@cached_response
 def mer_visual_harbour(request):
     date_from = datetime.strptime(request.GET.get('date_from'), '%Y-%m-%d').date()
     date_to = datetime.strptime(request.GET.get('date_to'), '%Y-%m-%d').date()
@@ -922,216 +736,56 @@ def mer_visual_harbour(request):
     type = request.GET.get('type')
     grouping_level = request.GET.get('group_by')
 
-    if type:
-        type_list = type.split(',')
+    type_list = type.split(',') if type else None
 
-    all_possible_types = Full_Data.objects.exclude(ais_type_summary='').values_list('ais_type_summary', flat=True).\
-        distinct()
+    all_possible_types = list(activity_values('ais_type_summary').exclude(ais_type_summary=''))
+    if type and filter in ('harbor and type', 'type'):
+        all_possible_types = type_list
     all_possible_locations = ['KARACHI', 'PORT QASIM', 'GWADAR']
-
-    response_data = []
-
-    # Sets to keep track of unique ships counted for arrival and departure
-    unique_arrival_ships = set()
-    unique_departure_ships = set()
-
-    current_date = date_from
-    while current_date <= date_to:
-        year = current_date.year
-        month = current_date.strftime('%B')
-        filter_start = current_date
-        week_end = current_date + timedelta(days=6)
-
-        if grouping_level == 'day':
-            item = {'Year': year, 'Month': month, 'Date': current_date.day}
-            filter_end = current_date
-        elif grouping_level == 'week':
-            if week_end > date_to:
-                week_end = date_to
-            item = {
-                'Year': year,
-                'Week_Start': current_date.strftime('%d-%m-%Y'),
-                'Week_End': week_end.strftime('%d-%m-%Y')
-            }
-            filter_end = week_end
-            if filter_end > date_to:
-                filter_end = date_to
-
-        else:  # month
-            start_of_next_month = (current_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-            if start_of_next_month > date_to:
-                filter_end = date_to
-            else:
-                filter_end = start_of_next_month - timedelta(days=1)
-            item = {'Year': year, 'Month': month}
-
-        filtered_trips = Full_Data.objects.filter(timestamp__date__range=(filter_start, filter_end))
-
+    if harbor and filter in ('harbor and type', 'harbor'):
+        all_possible_locations = [harbor]
+    arrival_types = type_list if filter in ('harbor and type', 'type') else None
+
+    periods = bucket_periods(date_from, date_to, grouping_level)
+    response_data = bucket_items(periods, grouping_level)
+
+    # Port calls arriving at / leaving the harbours per day, port and type, from the port-call table,
+    # folded into {(port, type): count} per bucket
+    filters = {'port__in': all_possible_locations}
+    if arrival_types:
+        filters['ais_type_summary__in'] = arrival_types
+    movements = {}
+    for field in ('arrival', 'departure'):
+        counts = counts_by_period(field, date_from, date_to, 'day', ['port', 'ais_type_summary'], filters=filters)
+        movements[field] = sum_by_bucket(counts, periods)
+
+    for item, arrivals, departures in zip(response_data, movements['arrival'], movements['departure']):
         if filter == 'harbor and type':
-            arrival = (filtered_trips.filter(current_port__in=all_possible_locations).
-                       values('imo', 'ship_id', 'current_port', 'last_port', 'ais_type_summary').distinct())
-            if harbor:
-                arrival = arrival.filter(current_port=harbor)
-                all_possible_locations = [harbor]
-
-            if type:
-                arrival = arrival.filter(ais_type_summary__in=type_list)
-                all_possible_types = type_list
-
             for location in all_possible_locations:
-                if location not in item:
-                    item[location] = {}
-                    for t in all_possible_types:
-                        item[location][t] = {'arrival': 0, 'departure': 0}
-
-            for counts in arrival:
-                ship_id = (counts['imo'], counts['ship_id'], counts['current_port'])
-                if ship_id not in unique_arrival_ships:
-                    unique_arrival_ships.add(ship_id)
-                    port = counts['current_port']
-                    ais_type = counts['ais_type_summary']
-                    if port in item and ais_type in item[port]:
-                        item[port][ais_type]['arrival'] += 1  # Increment the count for the port and type
-
-            for arrival_ship in unique_arrival_ships:
-                imo, ship_id, arrival_port = arrival_ship
-                ship_trips = filtered_trips.filter(imo=imo, ship_id=ship_id).order_by('timestamp')
-                previous_port = arrival_port
-
-                for trip in ship_trips:
-                    current_port = trip.current_port
-                    last_port = trip.last_port
-                    next_port = trip.next_port_name
-                    ais_type = trip.ais_type_summary
-
-                    if current_port != previous_port:
-                        if last_port != previous_port and (next_port != previous_port or next_port is None):
-                            if previous_port in item and ais_type in item[port] and arrival_ship not in unique_departure_ships:
-                                item[previous_port][ais_type]['departure'] -= 1
-                                unique_departure_ships.add(arrival_ship)
-                            break
-                    previous_port = current_port
+                item[location] = {t: {'arrival': arrivals[(location, t)], 'departure': -departures[(location, t)]}
+                                  for t in all_possible_types}
 
         elif filter == 'harbor':
-            arrival = (filtered_trips.filter(current_port__in=all_possible_locations).
-                       values('imo', 'ship_id', 'current_port', 'last_port').distinct())
-            if harbor:
-                arrival = arrival.filter(current_port=harbor)
-                all_possible_locations = [harbor]
-
             port_counts = {location: {'arrival': 0, 'departure': 0} for location in all_possible_locations}
-
-            for count_item in arrival:
-                ship_id = (count_item['imo'], count_item['ship_id'], count_item['current_port'])
-                if ship_id not in unique_arrival_ships:
-                    unique_arrival_ships.add(ship_id)
-                    port = count_item['current_port']
-                    if port in port_counts:
-                        port_counts[port]['arrival'] += 1
-
-            for arrival_ship in unique_arrival_ships:
-                imo, ship_id, arrival_port = arrival_ship
-                ship_trips = filtered_trips.filter(imo=imo, ship_id=ship_id).order_by('timestamp')
-                previous_port = arrival_port
-
-                for trip in ship_trips:
-                    current_port = trip.current_port
-                    last_port = trip.last_port
-                    next_port = trip.next_port_name
-
-                    if current_port != previous_port:
-                        if last_port != previous_port and (next_port != previous_port or next_port is None):
-                            if previous_port in port_counts and arrival_ship not in unique_departure_ships:
-                                port_counts[previous_port]['departure'] -= 1
-                                unique_departure_ships.add(arrival_ship)
-                            break
-                    previous_port = current_port
+            for (port, _), count in arrivals.items():
+                port_counts[port]['arrival'] += count
+            for (port, _), count in departures.items():
+                port_counts[port]['departure'] -= count
             item.update(port_counts)
 
-            for location in all_possible_locations:
-                if location not in item:
-                    item[location] = 0
-
         elif filter == 'type':
-            arrival = (filtered_trips.filter(current_port__in=all_possible_locations).
-                values('imo', 'ship_id', 'current_port', 'last_port', 'ais_type_summary').distinct())
-
-            if type:
-                arrival = arrival.filter(ais_type_summary__in=type_list)
-                all_possible_types = type_list
-
             type_counts = {types: {'arrival': 0, 'departure': 0} for types in all_possible_types}
-
-            for count_item in arrival:
-                ship_id = (count_item['imo'], count_item['ship_id'], count_item['current_port'])
-                if ship_id not in unique_arrival_ships:
-                    unique_arrival_ships.add(ship_id)
-                    port = count_item['ais_type_summary']
-                    if port in type_counts:
-                        type_counts[port]['arrival'] += 1
-
-            for arrival_ship in unique_arrival_ships:
-                imo, ship_id, arrival_port = arrival_ship
-                ship_trips = filtered_trips.filter(imo=imo, ship_id=ship_id).order_by('timestamp')
-                previous_port = arrival_port
-
-                for trip in ship_trips:
-                    current_port = trip.current_port
-                    last_port = trip.last_port
-                    next_port = trip.next_port_name
-                    ais_type = trip.ais_type_summary
-
-                    if current_port != previous_port:
-                        if last_port != previous_port and (next_port != previous_port or next_port is None):
-                            if previous_port in all_possible_locations and ais_type in type_counts and arrival_ship not in unique_departure_ships:
-                                type_counts[ais_type]['departure'] -= 1
-                                unique_departure_ships.add(arrival_ship)
-                            break
-                    previous_port = current_port
+            for (_, ais_type), count in arrivals.items():
+                if ais_type in type_counts:
+                    type_counts[ais_type]['arrival'] += count
+            for (_, ais_type), count in departures.items():
+                if ais_type in type_counts:
+                    type_counts[ais_type]['departure'] -= count
             item.update(type_counts)
 
-            for types in all_possible_types:
-                if types not in item:
-                    item[types] = 0
-
         elif filter == 'all':
-            arrival = (filtered_trips.filter(current_port__in=all_possible_locations).
-                       values('imo', 'ship_id', 'current_port', 'last_port').distinct())
-
-            total_arrival = 0
-            total_departure = 0
-
-            for count_item in arrival:
-                ship_id = (count_item['imo'], count_item['ship_id'], count_item['current_port'])
-                if ship_id not in unique_arrival_ships:
-                    unique_arrival_ships.add(ship_id)
-                    port = count_item['current_port']
-                    if port in all_possible_locations:
-                        total_arrival += 1
-
-            for arrival_ship in unique_arrival_ships:
-                imo, ship_id, arrival_port = arrival_ship
-                ship_trips = filtered_trips.filter(imo=imo, ship_id=ship_id).order_by('timestamp')
-                previous_port = arrival_port
-
-                for trip in ship_trips:
-                    current_port = trip.current_port
-                    last_port = trip.last_port
-                    next_port = trip.next_port_name
-
-                    if current_port != previous_port:
-                        if last_port != previous_port and (next_port != previous_port or next_port is None):
-                            if previous_port in all_possible_locations and arrival_ship not in unique_departure_ships:
-                                total_departure -= 1
-                                unique_departure_ships.add(arrival_ship)
-                            break
-                    previous_port = current_port
-
-            item['arrival'] = total_arrival
-            item['departure'] = total_departure
-
-        response_data.append(item)
-        current_date = filter_end + timedelta(days=1)
+            item['arrival'] = sum(arrivals.values())
+            item['departure'] = -sum(departures.values())
 
     return JsonResponse(response_data, safe=False)
 
@@ -1144,102 +798,60 @@ def get_country_name(country_code):
 
 
 @api_view(['GET'])
+@profiled
+@cached_response
 def mer_visual_flag_count(request):
     date_from = datetime.strptime(request.GET.get('date_from'), '%Y-%m-%d').date()
     date_to = datetime.strptime(request.GET.get('date_to'), '%Y-%m-%d').date()
 
-    filter = request.GET.get('filter')
+    filter = request.GET.get('filter')  # 'harbor and type' or 'type'; the type is a next port country code
     harbor = request.GET.get('harbor')
     type = request.GET.get('type')
     grouping_level = request.GET.get('group_by')
 
-    all_possible_types = Full_Data.objects.exclude(next_port_country='').values_list('next_port_country', flat=True).distinct()
-    all_possible_locations = ['KARACHI', 'PORT QASIM', 'GWADAR']
+    periods = bucket_periods(date_from, date_to, grouping_level)
+    response_data = bucket_items(periods, grouping_level)
+    if filter not in ('harbor and type', 'type'):
+        return JsonResponse(response_data, safe=False)
 
-    response_data = []
+    all_possible_locations = ['KARACHI', 'PORT QASIM', 'GWADAR']
+    if harbor and filter == 'harbor and type':
+        all_possible_locations = [harbor]
+    if type:
+        all_possible_types = [type]
+    else:
+        all_possible_types = list(activity_values('next_port_country').exclude(next_port_country=''))
 
-    current_date = date_from
-    while current_date <= date_to:
-        year = current_date.year
-        month = current_date.strftime('%B')
-        filter_start = current_date
-        week_end = current_date + timedelta(days=6)
+    # Distinct vessels per bucket, next port country and (for 'harbor and type') port, from one fetch of
+    # the range's rollup rows. 'type' counts a vessel once per port it was seen at.
+    filters = {'current_port__in': all_possible_locations}
+    if type:
+        filters['next_port_country'] = type
+    if filter == 'harbor and type':
+        dimensions, distinct = ['current_port', 'next_port_country'], ['imo', 'ship_id']
+    else:
+        dimensions, distinct = ['next_port_country'], ['imo', 'ship_id', 'current_port']
+    rows = fetch_activity(date_from, date_to, ['imo', 'ship_id', 'current_port', 'next_port_country'], filters)
+    counts = count_distinct(rows, periods, dimensions, distinct)
 
-        if grouping_level == 'day':
-            item = {'Year': year, 'Month': month, 'Date': current_date.day}
-            filter_end = current_date
-        elif grouping_level == 'week':
-            if week_end > date_to:
-                week_end = date_to
-            item = {
-                'Year': year,
-                'Week_Start': current_date.strftime('%d-%m-%Y'),
-                'Week_End': week_end.strftime('%d-%m-%Y')
-            }
-            filter_end = week_end
-            if filter_end > date_to:
-                filter_end = date_to
-        else:  # month
-            start_of_next_month = (current_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-            if start_of_next_month > date_to:
-                filter_end = date_to
-            else:
-                filter_end = start_of_next_month - timedelta(days=1)
-            item = {'Year': year, 'Month': month}
-
-        filtered_trips = Full_Data.objects.filter(timestamp__date__range=(filter_start, filter_end))
+    # Codes that share a country name are counted together under it
+    country_names = {}
+    for code in all_possible_types + [key[-1] for bucket in counts for key in bucket]:
+        if code not in country_names:
+            country_names[code] = get_country_name(code)
 
+    for item, bucket in zip(response_data, counts):
         if filter == 'harbor and type':
-            count = filtered_trips.values('imo', 'ship_id', 'current_port', 'next_port_country').distinct()
-            if harbor:
-                count = count.filter(current_port=harbor)
-                all_possible_locations = [harbor]
-
-            if type:
-                count = count.filter(next_port_country=type)
-                all_possible_types = [type]
-
             for location in all_possible_locations:
-                if location not in item:
-                    item[location] = {}
-                    for t in all_possible_types:
-                        full_type_name = get_country_name(t)
-                        item[location][full_type_name] = 0
-
-            for counts in count:
-                port = counts['current_port']
-                ais_type = counts['next_port_country']
-                full_type_name = get_country_name(ais_type)
-                if port in item and full_type_name in item[port]:
-                    item[port][full_type_name] += 1
-
-            for location in all_possible_locations:
-                if location not in item:
-                    item[location] = {}
-                    for t in all_possible_types:
-                        full_type_name = get_country_name(t)
-                        item[location][full_type_name] = 0
-
-        elif filter == 'type':
-            count = filtered_trips.filter(current_port__in=all_possible_locations).values('imo', 'ship_id', 'current_port', 'next_port_country').distinct()
-            if type:
-                count = count.filter(next_port_country=type)
-                all_possible_types = [type]
-
-            type_counts = {get_country_name(types): 0 for types in all_possible_types}
-            for count_item in count:
-                port = count_item['next_port_country']
-                full_type_name = get_country_name(port)
-                if full_type_name in type_counts:
-                    type_counts[full_type_name] += 1
+                item[location] = {country_names[t]: 0 for t in all_possible_types}
+            for (port, code), count in bucket.items():
+                if country_names[code] in item[port]:
+                    item[port][country_names[code]] += count
+        else:
+            type_counts = {country_names[t]: 0 for t in all_possible_types}
+            for (code,), count in bucket.items():
+                if country_names[code] in type_counts:
+                    type_counts[country_names[code]] += count
             item.update(type_counts)
 
-            for types in all_possible_types:
-                full_type_name = get_country_name(types)
-                if full_type_name not in item:
-                    item[full_type_name] = 0
-
-        response_data.append(item)
-        current_date = filter_end + timedelta(days=1)
-
     return JsonResponse(response_data, safe=False)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...ais_benchmark import ENDPOINTS, populated_tables, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Load synthetic fulldata of growing sizes into EMPTIED AIS tables and record latency, query count '
+            'and peak memory of every analytics endpoint as JSON. Run against a stand-in database only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma separated fulldata row counts, e.g. 10000,1000000,50000000.')
+        parser.add_argument('--days', type=int, default=90, help='Time span the rows are spread over.')
+        parser.add_argument('--vessels', type=int, help='Fleet size (default grows with the row count).')
+        parser.add_argument('--satellite-share', type=float, default=0.35,
+                            help='Share of at-sea reports received by satellite.')
+        parser.add_argument('--mmsi-only-share', type=float, default=0.15,
+                            help="Share of vessels reporting imo '0'.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per endpoint.')
+        parser.add_argument('--endpoints', help='Comma separated endpoint names (default all).')
+        parser.add_argument('--output', default='ais_benchmark.json')
+        parser.add_argument('--allow-wipe', action='store_true',
+                            help='Run even though the AIS tables already hold rows, which will be deleted.')
+
+    def handle(self, *args, **options):
+        populated = populated_tables()
+        if populated and not options['allow_wipe']:
+            raise CommandError(f"The benchmark truncates tables that hold rows: {', '.join(populated)}. Point the "
+                               f"settings at a stand-in database or pass --allow-wipe.")
+
+        endpoints = options['endpoints'].split(',') if options['endpoints'] else None
+        unknown = set(endpoints or []) - {name for name, _, _ in ENDPOINTS}
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        report = run_benchmark(
+            [int(value) for value in options['sizes'].split(',')],
+            options['output'],
+            days=options['days'],
+            repeat=options['repeat'],
+            endpoints=endpoints,
+            stdout=self.stdout,
+            vessels=options['vessels'],
+            satellite_share=options['satellite_share'],
+            mmsi_only_share=options['mmsi_only_share'],
+            seed=options['seed'],
+        )
+        failed = [f"{size['rows']}:{name}" for size in report['sizes']
+                  for name, result in size['endpoints'].items() if 'error' in result]
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Failed: {', '.join(failed)}"))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
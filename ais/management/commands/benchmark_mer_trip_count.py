@@ -0,0 +1,55 @@
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from ...ais_rollup import refresh_port_activity
+from ...ais_views import mer_trip_count
+
+
+class Command(BaseCommand):
+    help = ('Time mer_trip_count over growing date ranges and fail if its query count grows with the range '
+            '(regression guard for the single-query bucketing).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-to', default=date.today().strftime('%Y-%m-%d'))
+        parser.add_argument('--days', default='7,30,90,365',
+                            help='Comma separated range lengths in days.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        date_to = datetime.strptime(options['date_to'], '%Y-%m-%d')
+        # Bring the rollup up to date first so its refresh is not part of the measurement
+        refresh_port_activity()
+
+        factory = RequestFactory()
+        results = []
+        for days in [int(value) for value in options['days'].split(',')]:
+            params = {
+                'date_from': (date_to - timedelta(days=days - 1)).strftime('%Y-%m-%d'),
+                'date_to': date_to.strftime('%Y-%m-%d'),
+            }
+            timings = []
+            query_counts = []
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = mer_trip_count(factory.get('/mer_activity_trend', params))
+                    timings.append((time.perf_counter() - start) * 1000)
+                query_counts.append(len(queries))
+            results.append({
+                'days': days,
+                'buckets': len(json.loads(response.content)),
+                'queries': min(query_counts),
+                'best_ms': round(min(timings), 2),
+            })
+            self.stdout.write(f"{days:>5} days: {results[-1]['buckets']:>4} buckets, "
+                              f"{results[-1]['queries']:>3} queries, {results[-1]['best_ms']:.2f} ms")
+
+        if len({result['queries'] for result in results}) > 1:
+            raise CommandError('mer_trip_count query count depends on the date range length.')
+        self.stdout.write(self.style.SUCCESS('Query count is independent of the range length.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_tables import ensure_tables
+
+
+class Command(BaseCommand):
+    help = 'Create the derived AIS tables (sync state, rollups, indexes) that do not exist yet.'
+
+    def handle(self, *args, **options):
+        created = ensure_tables()
+        if created:
+            self.stdout.write(self.style.SUCCESS(f"Created: {', '.join(created)}"))
+        else:
+            self.stdout.write('All derived AIS tables already exist.')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_cache import invalidate
+
+
+class Command(BaseCommand):
+    help = 'Drop every cached analytics response, e.g. after fulldata rows were corrected in place.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Cached responses invalidated (generation {invalidate()}).'))
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...ais_partitions import (PARTITIONED_MODELS, detach_partitions, ensure_indexes, ensure_partitions,
+                               migrate_table)
+
+
+class Command(BaseCommand):
+    help = ('Maintain the monthly range partitions of fulldata and mer_trip_detail: create the upcoming '
+            'months (run it from cron), convert the plain tables with --migrate and detach old months. '
+            'Missing composite indexes are created either way, concurrently on plain tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', help='Comma separated tables (default fulldata,mer_trip_detail).')
+        parser.add_argument('--migrate', action='store_true',
+                            help='Convert plain tables into partitioned ones, copying every row.')
+        parser.add_argument('--months-ahead', type=int,
+                            help='Months after the current one to create partitions for (default '
+                                 'AIS_PARTITION_MONTHS_AHEAD, 3).')
+        parser.add_argument('--detach-before', help='Detach the partitions of the months before YYYY-MM.')
+        parser.add_argument('--dry-run', action='store_true', help='Print the SQL instead of running it.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(f'Partitioning needs PostgreSQL; the database is {connection.vendor}.')
+        models = {model._meta.db_table: model for model in PARTITIONED_MODELS}
+        tables = options['tables'].split(',') if options['tables'] else list(models)
+        unknown = set(tables) - set(models)
+        if unknown:
+            raise CommandError(f"Not partitioned: {', '.join(sorted(unknown))}")
+        selected = [models[table] for table in tables]
+        dry_run = options['dry_run']
+        stdout = self.stdout if dry_run or options['verbosity'] > 1 else None
+
+        if options['migrate']:
+            for model in selected:
+                stats = migrate_table(model, options['months_ahead'], dry_run, stdout)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{stats['table']}: {stats['partitions']} monthly partitions in {stats['elapsed_seconds']}s."))
+
+        indexed = ensure_indexes(selected, dry_run, stdout)
+        self.stdout.write(self.style.SUCCESS(f"Indexed: {', '.join(indexed)}") if indexed
+                          else 'Indexes already exist.')
+
+        created = ensure_partitions(options['months_ahead'], selected, dry_run, stdout)
+        self.stdout.write(f"Created: {', '.join(created)}" if created else 'Upcoming partitions already exist.')
+
+        if options['detach_before']:
+            before = datetime.strptime(options['detach_before'], '%Y-%m').date()
+            detached = detach_partitions(before, selected, dry_run, stdout)
+            self.stdout.write(self.style.SUCCESS(
+                f"Detached: {', '.join(detached)}" if detached else 'No partitions to detach.'))
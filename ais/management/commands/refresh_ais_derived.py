@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...ais_cache import sync_ingest
+
+
+class Command(BaseCommand):
+    help = ('Fold new fulldata rows into the rollup, port-call and latest-position tables and expire the cached '
+            'responses whose range they touch. Run it on a schedule (cron, a timer) or keep it running with --every.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, help='Repeat every this many seconds instead of running once.')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = sync_ingest()
+            expired = (f"expired ranges reaching {stats['first_day'] or 'any day'}"
+                       if stats['ingest_version'] is not None else 'no new rows')
+            self.stdout.write(self.style.SUCCESS(
+                f"Up to fulldata id {stats['last_id']}: {stats['port_activity']['days_rebuilt']} rollup days rebuilt, "
+                f"{stats['port_calls']['calls_created']} port calls created, "
+                f"{stats['latest_positions']['updated']} positions moved; {expired}."
+            ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
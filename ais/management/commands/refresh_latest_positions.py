@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_positions import refresh_latest_positions
+
+
+class Command(BaseCommand):
+    help = 'Update the last known position of every ship with fulldata rows added since the last refresh.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every position from scratch.')
+
+    def handle(self, *args, **options):
+        stats = refresh_latest_positions(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['rows']} rows up to fulldata id {stats['last_id']}: {stats['created']} ships added, "
+            f"{stats['updated']} moved in {stats['elapsed_seconds']}s."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_rollup import refresh_port_activity
+
+
+class Command(BaseCommand):
+    help = 'Update the daily port-activity rollup with fulldata rows added since the last refresh.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the rollup for every day from scratch.')
+
+    def handle(self, *args, **options):
+        stats = refresh_port_activity(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {stats['days_rebuilt']} days ({stats['rows_written']} rows) up to fulldata id "
+            f"{stats['last_id']} in {stats['elapsed_seconds']}s."
+        ))
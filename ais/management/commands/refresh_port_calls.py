@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_port_calls import refresh_port_calls
+
+
+class Command(BaseCommand):
+    help = 'Fold fulldata rows added since the last refresh into the port-call table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every port call from scratch.')
+        parser.add_argument('--batch-size', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        stats = refresh_port_calls(full=options['full'], batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['rows']} rows up to fulldata id {stats['last_id']}: {stats['calls_created']} calls "
+            f"created, {stats['calls_updated']} updated in {stats['elapsed_seconds']}s."
+        ))
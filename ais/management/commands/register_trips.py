@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...ais_trips import SyncInProgress, register_trips
+
+
+class Command(BaseCommand):
+    help = 'Register merchant trips and trip details for fulldata rows added since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Full_Data rows processed and committed per batch.')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows per bulk INSERT.')
+        parser.add_argument('--workers', type=int,
+                            help='Processes segmenting trips in parallel (default AIS_TRIP_WORKERS, 1).')
+
+    def handle(self, *args, **options):
+        try:
+            stats = register_trips(batch_size=options['batch_size'], chunk_size=options['chunk_size'],
+                                   stdout=self.stdout, workers=options['workers'])
+        except SyncInProgress as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['rows']} rows up to id {stats['last_id']} in {stats['elapsed_seconds']}s "
+            f"({stats['rows_per_second']} rows/sec): {stats['vessels_created']} vessels, "
+            f"{stats['trips_created']} trips created, {stats['trips_completed']} completed, "
+            f"{stats['details_created']} trip details."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ...ais_vessels import sync_vessels
+
+
+class Command(BaseCommand):
+    help = 'Insert every distinct (imo, ship_id) in fulldata that is missing from mer_vessel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', action='store_true',
+                            help='Also update static attributes of existing vessels from their latest report.')
+
+    def handle(self, *args, **options):
+        stats = sync_vessels(refresh=options['refresh'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['distinct_vessels']} distinct vessels: {stats['created']} created, "
+            f"{stats['updated']} updated, {stats['existing']} already registered "
+            f"({stats['elapsed_seconds']}s)."
+        ))
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.db import models
 from django.utils import timezone
 
@@ -65,6 +67,13 @@ class Full_Data(models.Model):
     class Meta:
         managed = False
         db_table = 'fulldata'
+        # Composite indexes of the analytics' access paths; see ais_partitions for the monthly partitions
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='fulldata_time_id_idx'),
+            models.Index(fields=['ship_id', 'timestamp'], name='fulldata_ship_time_idx'),
+            models.Index(fields=['current_port', 'timestamp'], name='fulldata_port_time_idx'),
+            models.Index(fields=['imo', 'mmsi', 'timestamp'], name='fulldata_vessel_time_idx'),
+        ]
 
 
 class Merchant_Vessel(models.Model):
@@ -160,6 +169,10 @@ class Trip_Details(models.Model):
     class Meta:
         managed = False
         db_table = 'mer_trip_detail'
+        indexes = [
+            models.Index(fields=['mtd_mt_key', 'mtd_timestamp'], name='trip_detail_trip_time_idx'),
+            models.Index(fields=['mtd_timestamp'], name='trip_detail_time_idx'),
+        ]
 
 
 class MerSreports(models.Model):
@@ -317,3 +330,107 @@ class MRFishing(models.Model):
         managed = False
         db_table = 'misrep_fishing'
 
+
+class PortActivityDaily(models.Model):
+    # One row per vessel per day per combination of port/type/flag attributes it reported that day
+    id = models.BigAutoField(primary_key=True)
+    day = models.DateField()
+    imo = models.CharField(max_length=100, blank=True, null=True)
+    mmsi = models.CharField(max_length=100, blank=True, null=True)
+    ship_id = models.CharField(max_length=100, blank=True, null=True)
+    current_port = models.CharField(max_length=100, blank=True, null=True)
+    last_port = models.CharField(max_length=100, blank=True, null=True)
+    ais_type_summary = models.CharField(max_length=100, blank=True, null=True)
+    flag = models.CharField(max_length=100, blank=True, null=True)
+    next_port_country = models.CharField(max_length=100, blank=True, null=True)
+    vessel_key = models.BigIntegerField(blank=True, null=True)  # VesselIdentity key, null without an identity
+    first_seen = models.DateTimeField(blank=True, null=True)  # earliest report folded into this row
+    last_seen = models.DateTimeField(blank=True, null=True)  # latest report folded into this row
+    reports = models.IntegerField(default=0)  # number of fulldata rows folded into this row
+
+    class Meta:
+        managed = False
+        db_table = 'ais_port_activity_daily'
+        indexes = [
+            models.Index(fields=['day', 'current_port'], name='port_activity_day_port_idx'),
+            models.Index(fields=['day', 'vessel_key'], name='port_activity_day_vessel_idx'),
+        ]
+
+
+class PortCall(models.Model):
+    # One stay of a vessel at a port: consecutive reports with that current_port, anchorages merged
+    id = models.BigAutoField(primary_key=True)
+    imo = models.CharField(max_length=100, blank=True, null=True)
+    mmsi = models.CharField(max_length=100, blank=True, null=True)
+    ship_id = models.CharField(max_length=100, blank=True, null=True)
+    vessel_key = models.BigIntegerField(blank=True, null=True)  # VesselIdentity key, calls are tracked per vessel
+    port = models.CharField(max_length=100)
+    ais_type_summary = models.CharField(max_length=100, blank=True, null=True)  # as reported on arrival
+    flag = models.CharField(max_length=100, blank=True, null=True)
+    arrival = models.DateTimeField()  # first report at the port
+    departure = models.DateTimeField(blank=True, null=True)  # last report at the port, null while still there
+    last_seen = models.DateTimeField()  # latest report at the port so far
+    dwell = models.DurationField(default=timedelta)  # last_seen - arrival
+    reports = models.IntegerField(default=0)
+
+    class Meta:
+        managed = False
+        db_table = 'ais_port_calls'
+        indexes = [
+            models.Index(fields=['port', 'arrival'], name='port_call_arrival_idx'),
+            models.Index(fields=['port', 'departure'], name='port_call_departure_idx'),
+            models.Index(fields=['vessel_key', 'arrival'], name='port_call_vessel_key_idx'),
+        ]
+
+
+class VesselLatestPosition(models.Model):
+    # Last known position of every ship_id, kept up to date from fulldata for the live map
+    ship_id = models.CharField(max_length=100, primary_key=True)
+    imo = models.CharField(max_length=100, blank=True, null=True)
+    mmsi = models.CharField(max_length=100, blank=True, null=True)
+    fulldata_id = models.BigIntegerField()  # fulldata row the position was taken from
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    speed = models.FloatField(blank=True, null=True)
+    course = models.FloatField(blank=True, null=True)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'ais_latest_positions'
+        indexes = [
+            models.Index(fields=['timestamp'], name='latest_position_time_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='latest_position_coords_idx'),
+        ]
+
+
+class VesselIdentity(models.Model):
+    # Stable integer key of every vessel: the MMSI identifies vessels reporting imo '0', the IMO all others
+    vessel_key = models.BigAutoField(primary_key=True)
+    identity = models.CharField(max_length=100, unique=True)
+    imo = models.CharField(max_length=100, blank=True, null=True)  # as first seen
+    mmsi = models.CharField(max_length=100, blank=True, null=True)  # as first seen
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        managed = False
+        db_table = 'ais_vessel_identities'
+
+
+class AisSyncState(models.Model):
+    name = models.CharField(max_length=100, primary_key=True)  # name of the job that owns the high-water mark
+    last_id = models.BigIntegerField(default=0)  # last fulldata.id the job has processed
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        managed = False
+        db_table = 'ais_sync_state'
+
+    @classmethod
+    def get_mark(cls, name):
+        state = cls.objects.filter(name=name).first()
+        return state.last_id if state else 0
+
+    @classmethod
+    def set_mark(cls, name, last_id):
+        cls.objects.update_or_create(name=name, defaults={'last_id': last_id, 'updated_at': timezone.now()})
@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+from django.test import TestCase
+
+from .ais_tables import ensure_tables
+from .ais_trips import ongoing_trips, register_trips
+from .models import AisSyncState, Full_Data, Merchant_Trip, Merchant_Vessel, Trip_Details, VesselIdentity
+
+
+def moment(day):
+    return datetime(2024, 1, day, tzinfo=timezone.utc)
+
+
+class OngoingTripsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The AIS tables are unmanaged, so the test database does not have them; create them before the
+        # class transaction starts (SQLite refuses schema changes inside one)
+        ensure_tables([AisSyncState, VesselIdentity, Full_Data, Merchant_Vessel, Merchant_Trip, Trip_Details])
+        super().setUpClass()
+
+    def setUp(self):
+        self.vessel = Merchant_Vessel.objects.create(mv_imo='9000001', mv_mmsi='463000001', mv_ship_id='1')
+        self.older, self.latest = [
+            Merchant_Trip.objects.create(mt_mv_key=self.vessel, mt_destination='KARACHI', mt_eta=moment(10),
+                                         mt_first_observed_at=moment(first), mt_last_observed_at=moment(first + 1),
+                                         mt_trip_status='Ongoing')
+            for first in (1, 3)
+        ]
+
+    def test_only_latest_ongoing_trip_is_continued(self):
+        current = ongoing_trips({self.vessel.mv_key})
+
+        self.assertEqual([trip.mt_key for trip in current.values()], [self.latest.mt_key])
+        self.older.refresh_from_db()
+        self.assertEqual(self.older.mt_trip_status, 'Completed')
+        self.assertEqual(self.older.mt_observed_duration, 1)
+
+    def test_registration_leaves_one_ongoing_trip(self):
+        Full_Data.objects.create(imo='9000001', mmsi='463000001', ship_id='1', destination='KARACHI',
+                                 eta=moment(10), timestamp=moment(5), latitude=24.8, longitude=66.9)
+
+        register_trips()
+
+        ongoing = Merchant_Trip.objects.filter(mt_mv_key=self.vessel, mt_trip_status='Ongoing')
+        self.assertEqual([trip.mt_key for trip in ongoing], [self.latest.mt_key])
+        self.assertEqual(ongoing[0].mt_last_observed_at, moment(5))
+        self.assertEqual(Trip_Details.objects.get().mtd_mt_key_id, self.latest.mt_key)
+        self.assertEqual(Merchant_Trip.objects.get(mt_key=self.older.mt_key).mt_trip_status, 'Completed')
@@ -0,0 +1,229 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import face_recognition
+import numpy as np
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from .models import PersonImages, PersonImageEncoding
+
+FACE_DB = 'face_detection'
+ENCODING_SIZE = 128
+
+
+DEFAULT_OPTIONS = {
+    'MAX_DIMENSION': 1024,  # longest image side used for detection, None keeps full resolution
+    'MODEL': 'hog',  # face detector: 'hog' (fast on CPU) or 'cnn' (accurate, needs a GPU to be fast)
+    'UPSAMPLE': 1,  # times to upsample the image when looking for faces
+    'NUM_JITTERS': 1,  # re-samples per encoding; higher is more accurate and proportionally slower
+    'ENCODING_MODEL': 'small',  # landmark model used for encoding: 'small' (5 points) or 'large' (68)
+}
+
+
+def get_options(**overrides):
+    return {**DEFAULT_OPTIONS, **getattr(settings, 'FACE_RECOGNITION_OPTIONS', {}), **overrides}
+
+
+def load_image(image_file, max_dimension=None):
+    """
+    Decode an image as an RGB array, shrinking it so its longest side is at most ``max_dimension``.
+    JPEGs are decoded directly at reduced scale, which is most of the saving on phone photos.
+    Returns (image, scale) where scale maps downscaled coordinates back to the original image.
+    """
+    image = Image.open(image_file)
+    width, height = image.size
+    if max_dimension:
+        image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    if max_dimension:
+        image.thumbnail((max_dimension, max_dimension))
+    # EXIF rotation only swaps the sides, so the longest side still gives the scale
+    scale = max(width, height) / max(image.size)
+    return np.asarray(image), scale
+
+
+def detect_faces(image_file, options=None, timings=None):
+    """
+    Detect and encode every face in ``image_file`` with the configured pipeline.
+    Returns a list of ((top, right, bottom, left), encoding) with locations in original image
+    coordinates. When ``timings`` is a dict, per-stage durations in milliseconds are added to it.
+    """
+    options = options or get_options()
+    timings = {} if timings is None else timings
+
+    start = time.perf_counter()
+    image, scale = load_image(image_file, options['MAX_DIMENSION'])
+    decoded = time.perf_counter()
+    locations = face_recognition.face_locations(image, number_of_times_to_upsample=options['UPSAMPLE'],
+                                                model=options['MODEL'])
+    detected = time.perf_counter()
+    encodings = face_recognition.face_encodings(image, known_face_locations=locations,
+                                                num_jitters=options['NUM_JITTERS'],
+                                                model=options['ENCODING_MODEL'])
+    encoded = time.perf_counter()
+
+    timings['decode'] = timings.get('decode', 0) + (decoded - start) * 1000
+    timings['detect'] = timings.get('detect', 0) + (detected - decoded) * 1000
+    timings['encode'] = timings.get('encode', 0) + (encoded - detected) * 1000
+
+    locations = [tuple(int(round(value * scale)) for value in location) for location in locations]
+    return list(zip(locations, encodings))
+
+
+def encode_image(image_file, options=None, timings=None):
+    """Return the encoding of the first face found in ``image_file`` or None."""
+    faces = detect_faces(image_file, options, timings)
+    if not faces:
+        return None
+    return faces[0][1]
+
+
+def encode_faces_from_bytes(data, options=None):
+    """
+    Detect and encode every face in an encoded image. Runs inside the worker processes, so it
+    only takes and returns picklable values: (faces, timings) where faces is a list of
+    ((top, right, bottom, left), encoding).
+    """
+    timings = {}
+    faces = detect_faces(io.BytesIO(data), options, timings)
+    return faces, timings
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'FACE_ENCODING_WORKERS', None) or os.cpu_count()
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def encode_faces_parallel(images, options=None):
+    """
+    Encode every face of every image (raw bytes) across the process pool, preserving order.
+    Options are resolved here and passed explicitly so workers do not depend on Django settings.
+    """
+    options = options or get_options()
+    return list(get_executor().map(encode_faces_from_bytes, images, repeat(options)))
+
+
+_table_ready = False
+_table_lock = threading.Lock()
+
+
+def ensure_encoding_table():
+    """
+    Create the encoding table when it is missing, so the first upload or search of a deployment works
+    without running rebuild_face_encodings first. Checked once per process.
+    """
+    global _table_ready
+    with _table_lock:
+        if _table_ready:
+            return
+        connection = connections[FACE_DB]
+        if PersonImageEncoding._meta.db_table not in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.create_model(PersonImageEncoding)
+        _table_ready = True
+
+
+def store_encoding(person_image, encoding):
+    """Persist ``encoding`` (or None when no face was found) for ``person_image``."""
+    ensure_encoding_table()
+    blob = None
+    status = PersonImageEncoding.STATUS_NO_FACE
+    if encoding is not None:
+        blob = np.asarray(encoding, dtype=np.float64).tobytes()
+        status = PersonImageEncoding.STATUS_READY
+    PersonImageEncoding.objects.using(FACE_DB).update_or_create(
+        person_image_id=person_image,
+        defaults={'encoding': blob, 'status': status}
+    )
+
+
+def load_gallery(since=None):
+    """
+    Load stored encodings into one contiguous (N, 128) float64 matrix.
+    Returns (person_image_ids, matrix, synced_at) where row i of the matrix belongs to
+    person_image_ids[i]. Pass a previous ``synced_at`` as ``since`` to only load encodings
+    written from that point on.
+    """
+    ensure_encoding_table()
+    rows = PersonImageEncoding.objects.using(FACE_DB).filter(encoding__isnull=False) \
+        .exclude(status=PersonImageEncoding.STATUS_FAILED)
+    if since is not None:
+        rows = rows.filter(updated_at__gte=since)
+    rows = rows.order_by('updated_at').values_list('person_image_id', 'encoding', 'updated_at')
+
+    ids = []
+    blobs = []
+    synced_at = since
+    for person_image_id, blob, updated_at in rows:
+        ids.append(person_image_id)
+        blobs.append(bytes(blob))
+        synced_at = updated_at
+
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty((0, ENCODING_SIZE), dtype=np.float64), synced_at
+
+    matrix = np.frombuffer(b''.join(blobs), dtype=np.float64).reshape(len(ids), ENCODING_SIZE)
+    return np.asarray(ids, dtype=np.int64), matrix, synced_at
+
+
+def load_cleared(since=None):
+    """
+    Ids of the person images whose encoding was cleared (re-enrolment pending, no face found) or
+    whose enrolment failed, the rows ``load_gallery`` leaves out. Returns (person_image_ids, synced_at);
+    ``since`` works as for ``load_gallery``.
+    """
+    ensure_encoding_table()
+    rows = PersonImageEncoding.objects.using(FACE_DB) \
+        .filter(Q(encoding__isnull=True) | Q(status=PersonImageEncoding.STATUS_FAILED))
+    if since is not None:
+        rows = rows.filter(updated_at__gte=since)
+    rows = rows.order_by('updated_at').values_list('person_image_id', 'updated_at')
+
+    ids = []
+    synced_at = since
+    for person_image_id, updated_at in rows:
+        ids.append(person_image_id)
+        synced_at = updated_at
+    return ids, synced_at
+
+
+def rebuild_encodings(missing_only=False, stdout=None):
+    """Re-encode stored photos from disk. Returns (encoded, without_face) counts."""
+    ensure_encoding_table()
+
+    person_images = PersonImages.objects.using(FACE_DB).exclude(photo='').exclude(photo__isnull=True)
+    if missing_only:
+        person_images = person_images.filter(encoding__isnull=True)
+
+    encoded = 0
+    without_face = 0
+    for person_image in person_images.iterator(chunk_size=500):
+        try:
+            encoding = encode_image(person_image.photo.path)
+        except (FileNotFoundError, OSError) as e:
+            if stdout:
+                stdout.write(f"Skipping person image {person_image.id}: {e}")
+            continue
+
+        store_encoding(person_image, encoding)
+        if encoding is None:
+            without_face += 1
+        else:
+            encoded += 1
+
+    return encoded, without_face
@@ -0,0 +1,84 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .encodings import FACE_DB, encode_faces_parallel, ensure_encoding_table, store_encoding
+from .models import PersonImages, PersonImageEncoding
+from .search import index_encoding, unindex_encoding
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (256, 256)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'FACE_ENROLMENT_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face-enrolment')
+        return _executor
+
+
+def enqueue_enrolment(person_image, encoding=None):
+    """
+    Mark ``person_image`` as pending and hand it to the enrolment workers.
+    When the caller already has the encoding (e.g. from the upload that created the row) it is
+    reused and only the thumbnail is generated in the background.
+    The previous encoding is cleared, so the photo stops matching until it is enrolled again.
+    """
+    ensure_encoding_table()
+    PersonImageEncoding.objects.using(FACE_DB).update_or_create(
+        person_image_id=person_image,
+        defaults={'status': PersonImageEncoding.STATUS_PENDING, 'encoding': None}
+    )
+    unindex_encoding(person_image.id)
+    return get_executor().submit(enrol, person_image.id, encoding)
+
+
+def enrol(person_image_id, encoding=None):
+    """Detect, encode and thumbnail one stored photo, then make it searchable."""
+    close_old_connections()
+    try:
+        person_image = PersonImages.objects.using(FACE_DB).get(id=person_image_id)
+        with person_image.photo.open('rb') as photo:
+            data = photo.read()
+
+        if encoding is None:
+            faces, _ = encode_faces_parallel([data])[0]
+            encoding = faces[0][1] if faces else None
+
+        store_encoding(person_image, encoding)
+        index_encoding(person_image_id, encoding)
+        store_thumbnail(person_image, data)
+    except Exception:
+        logger.exception("Enrolment failed for person image %s", person_image_id)
+        # update() skips auto_now, so updated_at is set by hand for other workers' indexes to see the failure
+        PersonImageEncoding.objects.using(FACE_DB).filter(person_image_id=person_image_id) \
+            .update(status=PersonImageEncoding.STATUS_FAILED, updated_at=timezone.now())
+        unindex_encoding(person_image_id)
+    finally:
+        close_old_connections()
+
+
+def store_thumbnail(person_image, data):
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=85)
+
+    encoding_row = PersonImageEncoding.objects.using(FACE_DB).get(person_image_id=person_image)
+    name = os.path.splitext(os.path.basename(person_image.photo.name))[0]
+    encoding_row.thumbnail.save(f"{name}.jpg", ContentFile(buffer.getvalue()), save=False)
+    PersonImageEncoding.objects.using(FACE_DB).filter(id=encoding_row.id).update(thumbnail=encoding_row.thumbnail.name)
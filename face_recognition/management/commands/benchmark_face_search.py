@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ...encodings import ENCODING_SIZE, load_gallery
+from ...search import BruteForceIndex, IVFIndex
+
+
+class Command(BaseCommand):
+    help = 'Measure recall@k and latency of the approximate face search backend against the exact scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--n-lists', type=int, default=None)
+        parser.add_argument('--n-probe', default='1,2,4,8,16',
+                            help='Comma separated n_probe values to evaluate.')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Benchmark on this many random encodings instead of the stored gallery.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        k = options['k']
+
+        if options['synthetic']:
+            # Clustered random vectors roughly shaped like dlib encodings (several photos per person)
+            people = max(1, options['synthetic'] // 4)
+            centers = rng.normal(0, 0.1, size=(people, ENCODING_SIZE))
+            owners = rng.integers(0, people, size=options['synthetic'])
+            matrix = centers[owners] + rng.normal(0, 0.03, size=(options['synthetic'], ENCODING_SIZE))
+            ids = np.arange(1, options['synthetic'] + 1, dtype=np.int64)
+        else:
+            ids, matrix, _ = load_gallery()
+
+        if len(ids) == 0:
+            self.stdout.write(self.style.WARNING('No encodings to benchmark.'))
+            return
+
+        picked = rng.choice(len(ids), min(options['queries'], len(ids)), replace=False)
+        queries = matrix[picked] + rng.normal(0, 0.01, size=(len(picked), ENCODING_SIZE))
+
+        exact = BruteForceIndex()
+        exact.build(ids, matrix)
+        start = time.perf_counter()
+        truth = exact.search(queries, k=k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        self.stdout.write(f"gallery={len(ids)} queries={len(queries)} k={k}")
+        self.stdout.write(f"exact: {exact_ms:.3f} ms/query")
+
+        approximate = IVFIndex(n_lists=options['n_lists'], min_train_size=0, seed=options['seed'])
+        start = time.perf_counter()
+        approximate.build(ids, matrix)
+        self.stdout.write(f"ivf: trained {len(approximate.centroids)} lists in {time.perf_counter() - start:.2f}s")
+
+        for n_probe in [int(value) for value in options['n_probe'].split(',')]:
+            approximate.n_probe = n_probe
+            start = time.perf_counter()
+            found = approximate.search(queries, k=k)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            hits = sum(len(np.intersect1d(expected, got)) for (expected, _), (got, _) in zip(truth, found))
+            recall = hits / sum(len(expected) for expected, _ in truth)
+            self.stdout.write(f"ivf n_probe={n_probe}: recall@{k}={recall:.4f} {elapsed_ms:.3f} ms/query")
@@ -36,3 +36,29 @@ class PersonImages(models.Model):
     class Meta:
         managed = False
         db_table = 'person_images'
+
+
+class PersonImageEncoding(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_NO_FACE = 'no_face'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_NO_FACE, 'No face'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    person_image_id = models.OneToOneField('PersonImages', on_delete=models.CASCADE, db_column='person_image_id',
+                                           related_name='encoding')
+    encoding = models.BinaryField(blank=True, null=True)  # 128 float64 values, NULL when no face was found
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    thumbnail = models.ImageField(upload_to='person_images/thumbnails/', blank=True, null=True)
+    created_at = models.DateTimeField(blank=True, null=True, default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = False
+        db_table = 'person_image_encodings'
@@ -0,0 +1,317 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .encodings import ENCODING_SIZE, load_cleared, load_gallery
+
+DEFAULT_TOP_K = 50
+
+
+def pairwise_distances(queries, gallery, gallery_sq_norms=None):
+    """Euclidean distances between every query row and every gallery row, shape (Q, N)."""
+    if gallery_sq_norms is None:
+        gallery_sq_norms = np.einsum('ij,ij->i', gallery, gallery)
+    query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+    squared = query_sq_norms[:, None] + gallery_sq_norms[None, :] - 2.0 * (queries @ gallery.T)
+    np.maximum(squared, 0.0, out=squared)
+    return np.sqrt(squared)
+
+
+def top_k(distances, k):
+    """Column indexes of the k smallest values of each row, sorted ascending."""
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return np.empty((distances.shape[0], 0), dtype=np.int64)
+    if k < distances.shape[1]:
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        nearest = np.tile(np.arange(distances.shape[1]), (distances.shape[0], 1))
+    order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+class FaceIndex:
+    """
+    Base class for face search backends.
+    Rows are keyed by PersonImages id; adding an id that is already indexed replaces its encoding.
+    Removing an id moves the last row into its place, so the rows stay contiguous.
+    Writes and searches hold ``lock``: enrolment threads grow and reorder the arrays while request
+    threads search, and a search must never pair distances of one layout with ids of another.
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, ENCODING_SIZE), dtype=np.float64)
+        self.sq_norms = np.empty(0, dtype=np.float64)
+        self.size = 0
+        self.positions = {}
+        self.synced_at = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def build(self, ids, matrix):
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock:
+            self.ids = ids.copy()
+            self.matrix = np.array(matrix, dtype=np.float64, order='C').reshape(-1, ENCODING_SIZE)
+            self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+            self.size = len(ids)
+            self.positions = {int(person_image_id): row for row, person_image_id in enumerate(ids)}
+            self.on_build()
+
+    def add(self, person_image_id, encoding):
+        person_image_id = int(person_image_id)
+        encoding = np.asarray(encoding, dtype=np.float64)
+        with self.lock:
+            row = self.positions.get(person_image_id)
+            if row is None:
+                row = self.size
+                self.grow(row + 1)
+                self.ids[row] = person_image_id
+                self.positions[person_image_id] = row
+                self.size += 1
+            self.matrix[row] = encoding
+            self.sq_norms[row] = encoding @ encoding
+            self.on_add(row)
+
+    def remove(self, person_image_id):
+        """Drop ``person_image_id`` from the index. Returns False when it was not indexed."""
+        with self.lock:
+            row = self.positions.pop(int(person_image_id), None)
+            if row is None:
+                return False
+            last = self.size - 1
+            self.on_remove(row, last)
+            if row != last:
+                self.ids[row] = self.ids[last]
+                self.matrix[row] = self.matrix[last]
+                self.sq_norms[row] = self.sq_norms[last]
+                self.positions[int(self.ids[row])] = row
+            self.size = last
+            return True
+
+    def grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, ENCODING_SIZE), dtype=np.float64)
+        sq_norms = np.empty(capacity, dtype=np.float64)
+        ids[:self.size] = self.ids[:self.size]
+        matrix[:self.size] = self.matrix[:self.size]
+        sq_norms[:self.size] = self.sq_norms[:self.size]
+        self.ids, self.matrix, self.sq_norms = ids, matrix, sq_norms
+
+    def search(self, queries, k=DEFAULT_TOP_K):
+        """
+        Return one (person_image_ids, distances) pair per query row, nearest first.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+        with self.lock:
+            if self.size == 0:
+                return [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in range(len(queries))]
+            return self.search_rows(queries, k)
+
+    def search_rows(self, queries, k):
+        raise NotImplementedError
+
+    def default_k(self):
+        """Neighbours returned per query when the caller does not ask for a number."""
+        return DEFAULT_TOP_K
+
+    def on_build(self):
+        pass
+
+    def on_add(self, row):
+        pass
+
+    def on_remove(self, row, last):
+        """Called before ``row`` is dropped and ``last`` (the final row) is moved into its place."""
+        pass
+
+
+class BruteForceIndex(FaceIndex):
+    """Exact search: one matrix product against the whole gallery."""
+
+    def default_k(self):
+        # The scan is exact anyway, so return the whole gallery and leave the cut to the distance threshold
+        return self.size
+
+    def search_rows(self, queries, k):
+        distances = pairwise_distances(queries, self.matrix[:self.size], self.sq_norms[:self.size])
+        nearest = top_k(distances, k)
+        return [(self.ids[rows], distances[i, rows]) for i, rows in enumerate(nearest)]
+
+
+class IVFIndex(FaceIndex):
+    """
+    Approximate search with an inverted file: encodings are clustered with k-means and a query
+    only scans the ``n_probe`` lists whose centroids are closest. Raising ``n_probe`` trades
+    latency for recall; ``n_probe == n_lists`` is an exact scan.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, train_iterations=10, min_train_size=1000, seed=0):
+        super().__init__()
+        self.requested_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.min_train_size = min_train_size
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.assignments = {}
+
+    def on_build(self):
+        self.centroids = None
+        self.lists = []
+        self.assignments = {}
+        if self.size >= self.min_train_size:
+            self.train()
+
+    def train(self):
+        matrix = self.matrix[:self.size]
+        n_lists = self.requested_lists or max(1, int(np.sqrt(self.size)))
+        n_lists = min(n_lists, self.size)
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = min(self.size, n_lists * 256)
+        sample = matrix[rng.choice(self.size, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            labels = pairwise_distances(sample, centroids).argmin(axis=1)
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Re-seed empty lists from random gallery rows so every list stays usable
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+        self.centroids = centroids
+        labels = self.assign(matrix)
+        self.lists = [list(np.flatnonzero(labels == list_id)) for list_id in range(n_lists)]
+        self.assignments = {row: int(label) for row, label in enumerate(labels)}
+
+    def assign(self, rows):
+        labels = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start:start + 4096]
+            labels[start:start + len(chunk)] = pairwise_distances(chunk, self.centroids).argmin(axis=1)
+        return labels
+
+    def on_add(self, row):
+        if self.centroids is None:
+            if self.size >= self.min_train_size:
+                self.train()
+            return
+        label = int(self.assign(self.matrix[row:row + 1])[0])
+        previous = self.assignments.get(row)
+        if previous == label:
+            return
+        if previous is not None:
+            self.lists[previous].remove(row)
+        self.lists[label].append(row)
+        self.assignments[row] = label
+
+    def on_remove(self, row, last):
+        if self.centroids is None:
+            return
+        self.lists[self.assignments.pop(row)].remove(row)
+        if row != last:
+            label = self.assignments.pop(last)
+            rows = self.lists[label]
+            rows[rows.index(last)] = row
+            self.assignments[row] = label
+
+    def search_rows(self, queries, k):
+        if self.centroids is None:
+            # Too small to be worth clustering yet
+            return BruteForceIndex.search_rows(self, queries, k)
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = top_k(pairwise_distances(queries, self.centroids), n_probe)
+
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.fromiter((row for list_id in lists for row in self.lists[list_id]), dtype=np.int64)
+            if len(rows) == 0:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0)))
+                continue
+            distances = pairwise_distances(query[None, :], self.matrix[rows], self.sq_norms[rows])
+            nearest = top_k(distances, k)[0]
+            results.append((self.ids[rows[nearest]], distances[0, nearest]))
+        return results
+
+
+BACKENDS = {
+    'brute': BruteForceIndex,
+    'ivf': IVFIndex,
+}
+
+
+def create_index(backend=None, **options):
+    backend = backend or getattr(settings, 'FACE_SEARCH_BACKEND', 'brute')
+    options = {**getattr(settings, 'FACE_SEARCH_OPTIONS', {}), **options}
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown face search backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+    if backend == 'brute':
+        return BruteForceIndex()
+    return BACKENDS[backend](**options)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Process-wide search index. Built from the encoding store on first use, then topped up with
+    encodings stored since the last call so photos enrolled by other workers become searchable, and
+    pruned of the ones cleared or failed since, so re-enrolled or broken photos stop matching.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = create_index()
+            ids, matrix, synced_at = load_gallery()
+            index.build(ids, matrix)
+            index.synced_at = synced_at
+            _index = index
+        else:
+            # ``since`` is inclusive, so rows written at the same instant are re-applied (a no-op)
+            cleared, cleared_at = load_cleared(since=_index.synced_at)
+            ids, matrix, synced_at = load_gallery(since=_index.synced_at)
+            for person_image_id in cleared:
+                _index.remove(person_image_id)
+            for person_image_id, encoding in zip(ids, matrix):
+                _index.add(person_image_id, encoding)
+            _index.synced_at = max(filter(None, (synced_at, cleared_at)), default=None)
+        return _index
+
+
+def index_encoding(person_image_id, encoding):
+    """
+    Insert a freshly stored encoding into the in-process index, if it has been built.
+    An encoding of None (no face found) takes the photo out of the index instead.
+    """
+    with _index_lock:
+        if _index is None:
+            return
+        if encoding is None:
+            _index.remove(person_image_id)
+        else:
+            _index.add(person_image_id, encoding)
+
+
+def unindex_encoding(person_image_id):
+    """Take a photo whose encoding was cleared or failed out of the in-process index, if it has been built."""
+    with _index_lock:
+        if _index is not None:
+            _index.remove(person_image_id)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import PersonImages, Person, Boats
+from .models import PersonImages, PersonImageEncoding, Person, Boats
 
 
 class PersonSerializer(serializers.ModelSerializer):
@@ -17,7 +17,14 @@ class BoatSerializer(serializers.ModelSerializer):
 class PersonImagesSerializer(serializers.ModelSerializer):
     person_id = PersonSerializer(read_only=True)
     boat_id = BoatSerializer(read_only=True)
+    enrolment_status = serializers.SerializerMethodField()
 
     class Meta:
         model = PersonImages
-        fields = ['id', 'photo', 'created_at', 'person_id', 'boat_id']
+        fields = ['id', 'photo', 'created_at', 'person_id', 'boat_id', 'enrolment_status']
+
+    def get_enrolment_status(self, obj):
+        try:
+            return obj.encoding.status
+        except PersonImageEncoding.DoesNotExist:
+            return None
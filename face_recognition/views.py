@@ -1,57 +1,102 @@
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
-import face_recognition
+from .encodings import encode_faces_parallel, encode_image, ensure_encoding_table
+from .enrolment import enqueue_enrolment
+from .search import get_index
 from .models import PersonImages
 from .serializers import PersonImagesSerializer
 
+logger = logging.getLogger(__name__)
+
+
+def server_timing(timings):
+    """Per-stage durations as a Server-Timing header, so clients and proxies can see where time went."""
+    logger.debug("face_recognition timings: %s", timings)
+    return {'Server-Timing': ', '.join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())}
+
 
 class PersonImagesViewSet(viewsets.ModelViewSet):
-    queryset = PersonImages.objects.using('face_detection').all()
+    queryset = PersonImages.objects.using('face_detection').select_related('person_id', 'boat_id', 'encoding')
     serializer_class = PersonImagesSerializer
 
+    def get_queryset(self):
+        # The queryset joins the encoding table, which a fresh deployment does not have yet
+        ensure_encoding_table()
+        return super().get_queryset()
+
     def calculate_accuracy(self, distance, threshold=0.6):
         # Convert face distance to a percentage accuracy
         accuracy = (1.0 - distance) * 100 if distance < threshold else 0
         return round(accuracy, 2)
 
+    def get_top_k(self, request, index):
+        """
+        Validated ``top_k`` of the request: how many nearest gallery photos are scored per face, from 1 up
+        to the gallery size. Defaults to the backend's ``default_k()``, the whole gallery for the exact scan.
+        """
+        value = request.data.get('top_k')
+        if value is None:
+            return index.default_k()
+        try:
+            top_k = int(value)
+        except (TypeError, ValueError):
+            raise ParseError(f"top_k must be an integer, not '{value}'.")
+        limit = max(len(index), 1)
+        if not 1 <= top_k <= limit:
+            raise ParseError(f"top_k must be between 1 and {limit}.")
+        return top_k
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        # Keep the encoding store in sync when the photo is replaced
+        if 'photo' in self.request.FILES and instance.photo:
+            enqueue_enrolment(instance)
+
     def create(self, request, *args, **kwargs):
         uploaded_file = request.FILES.get('photo')
         if not uploaded_file:
             return Response({'detail': 'No image uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Load the uploaded image
-        uploaded_image = face_recognition.load_image_file(uploaded_file)
-        uploaded_image_encoding = face_recognition.face_encodings(uploaded_image)
+        index = get_index()
+        top_k = self.get_top_k(request, index)
 
-        if not uploaded_image_encoding:
-            return Response({'detail': 'No face found in the uploaded image.'}, status=status.HTTP_400_BAD_REQUEST)
+        # Decode, detect and encode the uploaded image with the configured pipeline
+        timings = {}
+        uploaded_image_encoding = encode_image(uploaded_file, timings=timings)
 
-        uploaded_image_encoding = uploaded_image_encoding[0]
+        if uploaded_image_encoding is None:
+            return Response({'detail': 'No face found in the uploaded image.'}, status=status.HTTP_400_BAD_REQUEST,
+                            headers=server_timing(timings))
 
         matches = []
         threshold = 0.7  # You can adjust this threshold as needed
 
-        for person_image in PersonImages.objects.using('face_detection').all():
-            stored_image_path = person_image.photo.path
-            stored_image = face_recognition.load_image_file(stored_image_path)
-            stored_image_encoding = face_recognition.face_encodings(stored_image)
+        # Look up the nearest stored encodings through the configured search backend
+        search_start = time.perf_counter()
+        gallery_ids, face_distances = index.search(uploaded_image_encoding, k=top_k)[0]
+        timings['search'] = (time.perf_counter() - search_start) * 1000
+        candidates = np.flatnonzero(face_distances < threshold)
+        person_images = self.get_queryset().in_bulk(gallery_ids[candidates].tolist())
 
-            if not stored_image_encoding:
+        for candidate in candidates:
+            person_image = person_images.get(int(gallery_ids[candidate]))
+            if person_image is None:
                 continue
 
-            stored_image_encoding = stored_image_encoding[0]
-
-            # Calculate the distance between the uploaded image and the stored image
-            face_distance = face_recognition.face_distance([stored_image_encoding], uploaded_image_encoding)[0]
-
-            if face_distance < threshold:
-                accuracy = self.calculate_accuracy(face_distance, threshold)
-                if accuracy > 0:
-                    match_data = {
-                        'person_image': person_image,
-                        'accuracy': accuracy
-                    }
-                    matches.append(match_data)
+            accuracy = self.calculate_accuracy(float(face_distances[candidate]), threshold)
+            if accuracy > 0:
+                match_data = {
+                    'person_image': person_image,
+                    'accuracy': accuracy
+                }
+                matches.append(match_data)
 
         if matches:
             matches.sort(key=lambda x: x['accuracy'], reverse=True)  # Sort by highest accuracy first
@@ -61,10 +106,78 @@ class PersonImagesViewSet(viewsets.ModelViewSet):
                 match_data = serializer.data
                 match_data['accuracy'] = match['accuracy']
                 response_data.append(match_data)
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(response_data, status=status.HTTP_200_OK, headers=server_timing(timings))
 
         # If no match is found, create a new PersonImages instance
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        # Encoding and thumbnailing finish in the background; enrolment_status turns 'ready' once searchable
+        enqueue_enrolment(serializer.instance, uploaded_image_encoding)
+        return Response(self.get_serializer(serializer.instance).data, status=status.HTTP_201_CREATED,
+                        headers=server_timing(timings))
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """
+        Identify every face in several uploads (``photos``) or in a group photo.
+        Faces are detected and encoded across a process pool and all of them are scored against
+        the gallery in one search call. Nothing is enrolled. At most FACE_BATCH_MAX_FILES uploads are taken.
+        """
+        uploaded_files = request.FILES.getlist('photos') or request.FILES.getlist('photo')
+        if not uploaded_files:
+            return Response({'detail': 'No image uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_files = getattr(settings, 'FACE_BATCH_MAX_FILES', 20)
+        if len(uploaded_files) > max_files:
+            return Response({'detail': f'At most {max_files} images can be uploaded at once.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            threshold = float(request.data.get('threshold', 0.7))
+        except (TypeError, ValueError):
+            raise ParseError(f"threshold must be a number, not '{request.data.get('threshold')}'.")
+        index = get_index()
+        top_k = self.get_top_k(request, index)
+
+        faces_per_image = encode_faces_parallel([uploaded_file.read() for uploaded_file in uploaded_files])
+        faces = [(image_index, location, encoding)
+                 for image_index, (image_faces, _) in enumerate(faces_per_image)
+                 for location, encoding in image_faces]
+
+        # Stage timings are summed over images; the stages ran in parallel so they exceed wall time
+        timings = {}
+        for _, image_timings in faces_per_image:
+            for stage, duration in image_timings.items():
+                timings[stage] = timings.get(stage, 0) + duration
+
+        response_data = [{'image': uploaded_file.name, 'faces': []} for uploaded_file in uploaded_files]
+        if not faces:
+            return Response(response_data, status=status.HTTP_200_OK, headers=server_timing(timings))
+
+        queries = np.stack([encoding for _, _, encoding in faces])
+        search_start = time.perf_counter()
+        results = index.search(queries, k=top_k)
+        timings['search'] = (time.perf_counter() - search_start) * 1000
+
+        # Fetch every matched PersonImages row in one query
+        matched_ids = set()
+        for gallery_ids, face_distances in results:
+            matched_ids.update(gallery_ids[face_distances < threshold].tolist())
+        person_images = self.get_queryset().in_bulk(list(matched_ids))
+
+        for (image_index, location, _), (gallery_ids, face_distances) in zip(faces, results):
+            matches = []
+            for person_image_id, face_distance in zip(gallery_ids.tolist(), face_distances.tolist()):
+                person_image = person_images.get(person_image_id)
+                if person_image is None or face_distance >= threshold:
+                    continue
+                match_data = self.get_serializer(person_image).data
+                match_data['accuracy'] = self.calculate_accuracy(face_distance, threshold)
+                matches.append(match_data)
+
+            response_data[image_index]['faces'].append({
+                'location': {'top': location[0], 'right': location[1], 'bottom': location[2], 'left': location[3]},
+                'matches': matches
+            })
+
+        return Response(response_data, status=status.HTTP_200_OK, headers=server_timing(timings))